@@ -12,14 +12,17 @@ from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import main.routing
+from main.lifespan import LifespanMiddleware
+from main.notifications import DispatcherLoopMiddleware
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'language_exchange.settings')
 
-application = ProtocolTypeRouter({
+# Lifespan events flush the in-memory queues on shutdown (see main/lifespan.py)
+application = LifespanMiddleware(DispatcherLoopMiddleware(ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AuthMiddlewareStack(
         URLRouter(
             main.routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})))
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+Channel layer configuration profiles.
+
+``build_channel_layers`` turns a backend name and a list of Redis URLs into
+a ``CHANNEL_LAYERS`` setting:
+
+* ``memory`` - ``InMemoryChannelLayer``. Only reaches sockets served by the
+  same process, so it is limited to a single Daphne worker.
+* ``redis``  - ``channels_redis`` core layer (needs a real Redis server).
+* ``pubsub`` - ``channels_redis`` pub/sub layer. Lower latency, no
+  persistence of undelivered messages.
+
+Passing several URLs to ``redis`` or ``pubsub`` shards channels and groups
+across those servers by consistent hashing.
+"""
+
+BACKENDS = {
+    'memory': 'channels.layers.InMemoryChannelLayer',
+    'redis': 'channels_redis.core.RedisChannelLayer',
+    'pubsub': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+}
+
+
+def build_channel_layers(backend='memory', urls=None, prefix='langlink', capacity=1000, expiry=60):
+    """Return a ``CHANNEL_LAYERS`` dict for ``backend``"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown channel layer backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+    layer = {'BACKEND': BACKENDS[backend]}
+    if backend == 'memory':
+        layer['CONFIG'] = {'capacity': capacity, 'expiry': expiry}
+        return {'default': layer}
+
+    hosts = [url.strip() for url in (urls or []) if url.strip()]
+    if not hosts:
+        raise ValueError(f"The {backend!r} channel layer needs at least one Redis URL")
+
+    layer['CONFIG'] = {'hosts': hosts, 'prefix': prefix}
+    if backend == 'redis':
+        layer['CONFIG'].update({'capacity': capacity, 'expiry': expiry})
+    return {'default': layer}
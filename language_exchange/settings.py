@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 
+from .channel_layers import build_channel_layers
+from .databases import build_databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -50,6 +53,8 @@ CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
 
 MIDDLEWARE = [
+    # First, so the latency covers the whole middleware stack
+    'main.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,6 +79,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'main.context_processors.unread_messages_count',
+                'main.context_processors.presence',
             ],
         },
     },
@@ -86,11 +92,51 @@ ASGI_APPLICATION = 'language_exchange.asgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_BACKEND selects a profile from language_exchange/databases.py:
+# 'sqlite' (default) runs in WAL mode with immediate write transactions;
+# 'postgresql' connects to DATABASE_URL through a psycopg connection pool,
+# or with persistent connections when DATABASE_POOL=0.
+# SQLITE_PATH points a shell at another file, e.g. a scratch copy for benchmarks.
+DATABASES = build_databases(
+    backend=os.environ.get('DATABASE_BACKEND', 'sqlite'),
+    path=os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+    url=os.environ.get('DATABASE_URL'),
+    pool=os.environ.get('DATABASE_POOL', '1') == '1',
+    pool_max_size=int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+    conn_max_age=int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+    # A file rather than shared-cache memory, so tests with parallel
+    # writers see SQLite's real locking
+    test_name=BASE_DIR / 'test_db.sqlite3',
+)
+
+
+# Caches
+# 'default' holds presence, matching buckets and other shared state.
+# 'fragments' holds rendered page fragments (see main/fragments.py); its
+# entries are invalidated by version counters and never expire. Set
+# FRAGMENT_CACHE_BACKEND to 'file' to share them between processes.
+FRAGMENT_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'langlink-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('FRAGMENT_CACHE_DIR', str(BASE_DIR / 'cache' / 'fragments')),
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'langlink',
+    },
+    'fragments': {
+        **FRAGMENT_CACHE_BACKENDS[os.environ.get('FRAGMENT_CACHE_BACKEND', 'locmem')],
+        'TIMEOUT': None,
+    },
 }
 
 
@@ -138,14 +184,14 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 # Channels
-# --- THIS BLOCK IS UPDATED ---
-# We are using the in-memory channel layer for development.
-# This removes the need for a Redis server.
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+# The in-memory channel layer is used for development, which removes the
+# need for a Redis server but only works with a single worker process.
+# Set CHANNEL_LAYER_BACKEND to 'redis' or 'pubsub' to fan out across
+# workers; several comma-separated CHANNEL_REDIS_URLS shard the layer.
+CHANNEL_LAYERS = build_channel_layers(
+    backend=os.environ.get('CHANNEL_LAYER_BACKEND', 'memory'),
+    urls=os.environ.get('CHANNEL_REDIS_URLS', 'redis://127.0.0.1:6379/0').split(','),
+)
 
 # Login URL
 LOGIN_URL = 'login'
@@ -155,4 +201,81 @@ LOGOUT_REDIRECT_URL = 'login'
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Chat history pagination
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+
+# History sent on connect, batched into compact frames (see main/history_frames.py)
+CHAT_HISTORY_FRAMES = {
+    'MAX_MESSAGES_PER_FRAME': 100,  # one frame holds a full page of history
+}
+
+# Delta sync for reconnecting chat sockets (see main/resume.py)
+CHAT_RESUME = {
+    'MAX_MISSED_MESSAGES': 500,  # beyond this the client gets a resync and the newest window
+    'RECONNECT_MIN_MS': 1000,    # reconnect backoff hints sent in the hello frame
+    'RECONNECT_MAX_MS': 30000,
+}
+
+# Batched write-behind persistence of WebSocket chat messages
+CHAT_WRITE_BEHIND = {
+    'ENABLED': True,
+    'MAX_BATCH': 100,        # messages per bulk_create
+    'FLUSH_INTERVAL': 0.05,  # seconds a message may wait for its batch
+    'MAX_PENDING': 1000,     # queued messages before senders are throttled
+}
+
+# Recently submitted client message ids, answered without a query (see main/idempotency.py)
+CHAT_IDEMPOTENCY = {
+    'WINDOW': 600,      # seconds a client id is remembered
+    'MAX_KEYS': 10000,  # oldest ids are dropped beyond this
+}
+
+# Batched dispatch of per-user new-message notifications
+CHAT_NOTIFICATIONS = {
+    'MAX_BATCH': 500,        # outbox events resolved per query
+    'FLUSH_INTERVAL': 0.05,  # seconds events are coalesced before sending
+    'MAX_ATTEMPTS': 3,       # tries per notification before it is dropped
+    'RETRY_DELAY': 1.0,      # seconds before a retry, times the attempt number
+}
+
+# Partner matching (see main/matching.py)
+MATCHING = {
+    'PAGE_SIZE': 12,         # matches per page
+    'CACHE_TIMEOUT': 300,    # seconds ranked buckets and pages are cached
+    'MAX_CANDIDATES': 1000,  # ranked candidates kept per language pair
+    'ACTIVITY_DAYS': 30,     # ProgressLog window used for ranking
+}
+
+# Live presence (see main/presence.py)
+PRESENCE = {
+    'TIMEOUT': 60,             # seconds without a heartbeat before a user is offline
+    'HEARTBEAT_INTERVAL': 25,  # seconds between client heartbeats
+    'FLUSH_INTERVAL': 30,      # seconds between batched is_online/last_seen writes
+}
+
+# Profile picture processing (see main/images.py)
+IMAGE_PROCESSING = {
+    'ASYNC': True,            # resize in a thread pool after commit; False to process inline
+    'WORKERS': 2,             # image worker threads per process
+    'MAX_DIMENSION': 1600,    # longest side of the stored original
+    'SIZES': [64, 160, 480],  # square avatar sizes, each in WebP and JPEG
+    'QUALITY': 82,            # WebP/JPEG encoder quality
+}
+
+# Per-user page fragment cache (see main/fragments.py)
+FRAGMENT_CACHE = {
+    'ENABLED': True,       # False renders every page from scratch
+    'CACHE': 'fragments',  # alias in CACHES holding versions, fragments and hit/miss counters
+}
+
+# Request and consumer instrumentation (see main/instrumentation.py)
+INSTRUMENTATION = {
+    'ENABLED': os.environ.get('INSTRUMENTATION_ENABLED') == '1',  # switchable at runtime
+    'REFRESH_INTERVAL': 5,                                        # seconds between checks of the runtime switch
+    'PUBLISH_INTERVAL': 10,                                       # seconds between snapshots for request_metrics
+    'N_PLUS_ONE_THRESHOLD': 10,                                   # same SQL this often in one request is logged
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN'),             # bearer token for scraping /metrics
+}
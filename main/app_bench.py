@@ -0,0 +1,354 @@
+"""
+Load benchmark for the HTTP views and the chat WebSocket.
+
+Requests run in-process through ``language_exchange.asgi.application``,
+the same stack Daphne serves, with its middleware, session
+authentication and Channels routing. They are sent by ``concurrency``
+tasks on one event loop, with no server and no network in between. The
+figures therefore show the cost of the application and the database and
+leave out the transport.
+
+The benchmark users are ``bench_*`` users created by ``seed_bench_data``
+(see ``main/bench_data.py``). Each one is logged in through a real session
+row and picks a room it takes part in.
+
+The HTTP scenarios (``inbox``, ``messages``, ``unread``, ``dashboard``)
+report throughput, latency percentiles, response sizes and the number of
+queries per request. The ``websocket`` scenario opens ``sockets``
+concurrent chat sockets. It measures the time to accept and send the
+history, then the round trip of every message until the server confirms
+it. That is the ``message_ack`` with write-behind, otherwise the echoed
+``chat_message``.
+
+Queries are counted with ``main.instrumentation`` recordings that are not
+added to the request metrics. A recording covers one application call, so
+for a socket it includes the connect, every message and the write-behind
+batches that the socket starts.
+"""
+import asyncio
+import itertools
+import random
+import statistics
+import time
+import uuid
+
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .bench_data import bench_users
+from .channel_bench import percentile
+from .instrumentation import start_recording, stop_recording
+from .models import RoomMembership
+
+HTTP_SCENARIOS = {
+    'inbox': lambda user: '/inbox/',
+    'messages': lambda user: f'/api/chat/{user.room_name}/messages/',
+    'unread': lambda user: '/api/chat/unread-count/',
+    'dashboard': lambda user: '/progress/',
+}
+SCENARIOS = (*HTTP_SCENARIOS, 'websocket')
+TIMEOUT = 30
+
+
+class BenchUser:
+    """A logged-in bench user and one of its rooms"""
+
+    def __init__(self, user, room_id, room_name, session_key):
+        self.user = user
+        self.room_id = room_id
+        self.room_name = room_name
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()
+
+    @property
+    def headers(self):
+        return [(b'host', bench_host().encode()), (b'cookie', self.cookie)]
+
+
+def bench_host():
+    """A host name that passes ``ALLOWED_HOSTS``"""
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def prepare_users(count, seed_value=0):
+    """Log in ``count`` random bench users that have at least one room"""
+    users = list(bench_users().filter(room_memberships__isnull=False).distinct().order_by('id'))
+    if not users:
+        raise RuntimeError('No bench users found; run seed_bench_data first')
+    users = random.Random(seed_value).sample(users, min(count, len(users)))
+    rooms = {}
+    for membership in RoomMembership.objects.filter(user__in=users).select_related('room').order_by('id'):
+        rooms.setdefault(membership.user_id, membership.room)
+
+    prepared = []
+    for user in users:
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        room = rooms[user.id]
+        prepared.append(BenchUser(user, room.id, room.name, session.session_key))
+    return prepared
+
+
+def end_sessions(users):
+    SessionStore.get_model_class().objects.filter(
+        session_key__in=[user.cookie.split(b'=', 1)[1].decode() for user in users]
+    ).delete()
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def latency_summary(latencies):
+    return {
+        'mean': _ms(statistics.fmean(latencies)) if latencies else 0.0,
+        'p50': _ms(percentile(latencies, 50)),
+        'p95': _ms(percentile(latencies, 95)),
+        'p99': _ms(percentile(latencies, 99)),
+        'max': _ms(max(latencies)) if latencies else 0.0,
+    }
+
+
+def query_summary(counts):
+    return {
+        'mean': round(statistics.fmean(counts), 2) if counts else 0.0,
+        'p95': percentile(counts, 95),
+        'max': max(counts) if counts else 0,
+    }
+
+
+class Recorded:
+    """
+    ASGI wrapper that counts the queries of one application call.
+
+    The test communicators run the application with an empty context, so
+    the recording has to start inside the call.
+    """
+
+    def __init__(self, app, endpoint):
+        self.app = app
+        self.endpoint = endpoint
+        self.recording = None
+
+    async def __call__(self, scope, receive, send):
+        self.recording, token = start_recording(self.endpoint)
+        try:
+            return await self.app(scope, receive, send)
+        finally:
+            stop_recording(self.recording, token, register=False)
+
+    @property
+    def queries(self):
+        return len(self.recording.queries) if self.recording else 0
+
+
+async def http_get(app, path, headers):
+    communicator = HttpCommunicator(app, 'GET', path, headers=headers)
+    response = await communicator.get_response(timeout=TIMEOUT)
+    await communicator.wait(timeout=TIMEOUT)
+    return response
+
+
+async def run_http(app, name, users, requests, concurrency):
+    """Send ``requests`` GETs for scenario ``name`` from ``concurrency`` tasks"""
+    path_for = HTTP_SCENARIOS[name]
+    counter = itertools.count()
+    latencies, queries, sizes, statuses = [], [], [], {}
+
+    async def worker():
+        while (n := next(counter)) < requests:
+            user = users[n % len(users)]
+            recorded = Recorded(app, f'bench:{name}')
+            started = time.perf_counter()
+            try:
+                response = await http_get(recorded, path_for(user), user.headers)
+                status = response['status']
+                sizes.append(len(response['body']))
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            queries.append(recorded.queries)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    ok = statuses.get(200, 0)
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'errors': requests - ok,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': latency_summary(latencies),
+        'queries': query_summary(queries),
+        'response_bytes': round(statistics.fmean(sizes)) if sizes else 0,
+    }
+
+
+async def _drain(communicator, quiet=0.05):
+    """Receive frames until none arrives for ``quiet`` seconds; returns the count and the last arrival time"""
+    frames = 0
+    last = time.perf_counter()
+    while not await communicator.receive_nothing(timeout=quiet):
+        await communicator.receive_from()
+        frames += 1
+        last = time.perf_counter()
+    return frames, last
+
+
+async def _socket_session(app, index, user, messages, connected, results):
+    recorded = Recorded(app, 'bench:websocket')
+    communicator = WebsocketCommunicator(recorded, f'/ws/chat/{user.room_id}/', headers=user.headers)
+    try:
+        started = time.perf_counter()
+        accepted, _ = await communicator.connect(timeout=TIMEOUT)
+        if not accepted:
+            results['rejected'] += 1
+            return
+        history, finished = await _drain(communicator)
+        results['connect'].append(finished - started)
+        results['history_frames'].append(history)
+        # Send only once every socket is open, so the round trips overlap
+        await connected.wait()
+
+        # Client ids are idempotency keys, so they must not repeat across runs
+        run = uuid.uuid4().hex[:8]
+        for n in range(messages):
+            client_id = f'bench-{run}-{index}-{n}'
+            text = f'bench message {index}-{n}'
+            sent = time.perf_counter()
+            await communicator.send_json_to({'message': text, 'client_id': client_id})
+            while True:
+                frame = await communicator.receive_json_from(timeout=TIMEOUT)
+                if frame.get('type') == 'message_error' and frame.get('client_id') == client_id:
+                    results['failed'] += 1
+                    break
+                # Without write-behind the broadcast already carries the database id
+                confirmed = frame.get('client_id') == client_id and (
+                    frame.get('type') == 'message_ack' or (frame.get('type') == 'chat_message' and frame.get('message_id'))
+                )
+                if confirmed:
+                    results['round_trip'].append(time.perf_counter() - sent)
+                    break
+        await communicator.disconnect()
+    except Exception:
+        results['failed'] += 1
+        await communicator.disconnect()
+    finally:
+        results['queries'].append(recorded.queries)
+
+
+async def run_websockets(app, users, sockets, messages):
+    """Open ``sockets`` chat sockets at once and send ``messages`` on each"""
+    results = {'connect': [], 'history_frames': [], 'round_trip': [], 'queries': [], 'rejected': 0, 'failed': 0}
+    connected = asyncio.Event()
+    started = time.perf_counter()
+    tasks = [
+        asyncio.ensure_future(_socket_session(app, index, users[index % len(users)], messages, connected, results))
+        for index in range(sockets)
+    ]
+    # Wait until every socket has connected (or given up) before any sends
+    while len(results['connect']) + results['rejected'] + results['failed'] < sockets:
+        if all(task.done() for task in tasks):
+            break
+        await asyncio.sleep(0.01)
+    connect_elapsed = time.perf_counter() - started
+    connected.set()
+    sending = time.perf_counter()
+    await asyncio.gather(*tasks)
+    send_elapsed = time.perf_counter() - sending
+    confirmed = len(results['round_trip'])
+    return {
+        'sockets': sockets,
+        'messages_per_socket': messages,
+        'connected': len(results['connect']),
+        'rejected': results['rejected'],
+        'failed': results['failed'],
+        'connect_elapsed_s': round(connect_elapsed, 3),
+        'connect_ms': latency_summary(results['connect']),
+        'history_frames': round(statistics.fmean(results['history_frames']), 1) if results['history_frames'] else 0,
+        'messages_confirmed': confirmed,
+        'send_elapsed_s': round(send_elapsed, 3),
+        'throughput_msgs_per_s': round(confirmed / send_elapsed, 1) if send_elapsed else 0.0,
+        'round_trip_ms': latency_summary(results['round_trip']),
+        'queries_per_socket': query_summary(results['queries']),
+    }
+
+
+async def _run(scenarios, users, requests, concurrency, sockets, messages):
+    from language_exchange.asgi import application
+
+    results = {}
+    for name in scenarios:
+        if name == 'websocket':
+            results[name] = await run_websockets(application, users, sockets, messages)
+        else:
+            # One untimed pass to warm up imports, templates and connections
+            await run_http(application, name, users, min(len(users), concurrency), concurrency)
+            results[name] = await run_http(application, name, users, requests, concurrency)
+    return results
+
+
+def run_app_benchmark(scenarios=SCENARIOS, users=50, requests=500, concurrency=10, sockets=50,
+                      messages=10, cold=False, seed_value=0):
+    """
+    Run the scenarios and return ``{'meta': {...}, 'scenarios': {name: result}}``.
+
+    ``cold`` disables the fragment cache, so every page is rendered from
+    the database.
+    """
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    prepared = prepare_users(users, seed_value)
+    try:
+        with override_settings(FRAGMENT_CACHE={**getattr(settings, 'FRAGMENT_CACHE', {}), 'ENABLED': not cold}):
+            results = asyncio.run(_run(scenarios, prepared, requests, concurrency, sockets, messages))
+    finally:
+        end_sessions(prepared)
+    return {
+        'meta': {
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'bench_users': bench_users().count(),
+            'users': len(prepared),
+            'fragment_cache': not cold,
+            'write_behind': getattr(settings, 'CHAT_WRITE_BEHIND', {}).get('ENABLED', True),
+            'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'],
+        },
+        'scenarios': results,
+    }
+
+
+def compare(baseline, current):
+    """Per-scenario change of throughput and p95 latency against an earlier result, in percent"""
+    changes = {}
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        throughput = 'throughput_rps' if 'throughput_rps' in result else 'throughput_msgs_per_s'
+        latency = 'latency_ms' if 'latency_ms' in result else 'round_trip_ms'
+        changes[name] = {
+            throughput: _change(before.get(throughput), result[throughput]),
+            f'{latency}.p95': _change(before.get(latency, {}).get('p95'), result[latency]['p95']),
+        }
+    return changes
+
+
+def _change(before, after):
+    if not before:
+        return None
+    return round((after - before) / before * 100, 1)
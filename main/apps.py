@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        from . import checks  # registers the system checks
+        from .instrumentation import install_query_recorder
+
+        # Every connection, including those opened later in other threads
+        connection_created.connect(install_query_recorder, dispatch_uid='main.install_query_recorder')
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
@@ -0,0 +1,157 @@
+"""
+Synthetic data for the benchmarks.
+
+``seed`` creates ``bench_<n>`` users with profiles, 1:1 rooms, messages
+spread over the last ``DAYS`` days and progress logs. Everything is
+inserted with ``bulk_create``, so no per-row signals run. The data they
+would maintain is written directly: room memberships with unread
+counters and read watermarks, and the progress rollups. The same
+``seed_value`` always produces the same data.
+
+``clear`` deletes everything created by ``seed``.
+"""
+import random
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChatRoom, Message, Profile, ProgressLog, ProgressRollup, RoomMembership
+
+USERNAME_PREFIX = 'bench_'
+PASSWORD = 'bench-password'
+DAYS = 90
+WORDS = (
+    'hola', 'bonjour', 'hello', 'danke', 'grazie', 'obrigado', 'spasibo', 'xiexie', 'arigato',
+    'annyeong', 'namaste', 'how', 'are', 'you', 'today', 'practice', 'grammar', 'word', 'again',
+)
+# Incoming messages at the end of a room that stay unread, at most
+MAX_UNREAD = 5
+
+
+@contextmanager
+def historical_timestamps(*fields):
+    """Let ``bulk_create`` keep explicit values of ``auto_now_add`` fields"""
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field, _ in saved:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in saved:
+            field.auto_now_add = value
+
+
+def bench_users():
+    return User.objects.filter(username__startswith=USERNAME_PREFIX)
+
+
+def sentence(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 12)))
+
+
+def seed(users=1000, messages=100000, rooms_per_user=4, logs_per_user=20, seed_value=0,
+         batch_size=5000, log=print):
+    """Create the synthetic data set; returns the number of rows created per model"""
+    rng = random.Random(seed_value)
+    now = timezone.now()
+    languages = [code for code, _ in Profile.LANGUAGES]
+    counts = {}
+
+    password = make_password(PASSWORD)
+    start = bench_users().count()
+    User.objects.bulk_create([
+        User(username=f'{USERNAME_PREFIX}{n}', password=password, date_joined=now - timedelta(days=rng.randint(0, 365)))
+        for n in range(start, start + users)
+    ], batch_size=batch_size)
+    user_ids = list(bench_users().order_by('id').values_list('id', flat=True)[start:start + users])
+    counts['users'] = len(user_ids)
+    log(f"Created {len(user_ids)} users")
+
+    profiles = []
+    for user_id in user_ids:
+        native, learning = rng.sample(languages, 2)
+        profiles.append(Profile(user_id=user_id, native_language=native, learning_language=learning,
+                                bio=sentence(rng), last_seen=now - timedelta(minutes=rng.randint(0, 60 * 24 * 7))))
+    Profile.objects.bulk_create(profiles, batch_size=batch_size)
+
+    pairs = set()
+    for user_id in user_ids:
+        for partner in rng.sample(user_ids, min(len(user_ids), max(rooms_per_user // 2, 1) + 1)):
+            if partner != user_id:
+                pairs.add(tuple(sorted((user_id, partner))))
+    pairs = sorted(pairs)
+    with transaction.atomic():
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(name=f'chat_{user_a}_{user_b}', user_a_id=user_a, user_b_id=user_b) for user_a, user_b in pairs
+        ], batch_size=batch_size)
+        ChatRoom.participants.through.objects.bulk_create([
+            ChatRoom.participants.through(chatroom_id=room.id, user_id=user_id)
+            for room in rooms for user_id in (room.user_a_id, room.user_b_id)
+        ], batch_size=batch_size)
+    counts['rooms'] = len(rooms)
+    log(f"Created {len(rooms)} rooms")
+
+    # Messages in time order; the newest few incoming ones of each room stay unread
+    tail = defaultdict(lambda: deque(maxlen=MAX_UNREAD))
+    read_upto = {}
+    step = timedelta(days=DAYS) / max(messages, 1)
+    created = 0
+    with historical_timestamps(Message._meta.get_field('timestamp')):
+        while created < messages:
+            batch = []
+            for n in range(created, min(created + batch_size, messages)):
+                room = rooms[rng.randrange(len(rooms))]
+                sender = room.user_a_id if rng.random() < 0.5 else room.user_b_id
+                batch.append(Message(room_id=room.id, sender_id=sender, content=sentence(rng),
+                                     timestamp=now - timedelta(days=DAYS) + step * n))
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+            for message in batch:
+                room_tail = tail[message.room_id]
+                if len(room_tail) == room_tail.maxlen:
+                    oldest_id, oldest_sender = room_tail[0]
+                    read_upto[message.room_id, oldest_sender] = oldest_id
+                room_tail.append((message.id, message.sender_id))
+            created += len(batch)
+            log(f"Created {created}/{messages} messages")
+    counts['messages'] = created
+
+    memberships = []
+    for room in rooms:
+        for user_id, other_id in ((room.user_a_id, room.user_b_id), (room.user_b_id, room.user_a_id)):
+            unread_cut = rng.randint(0, MAX_UNREAD)
+            incoming = [message_id for message_id, sender in tail[room.id] if sender == other_id]
+            read, unread = incoming[:len(incoming) - unread_cut], incoming[len(incoming) - unread_cut:]
+            watermark = read[-1] if read else read_upto.get((room.id, other_id))
+            memberships.append(RoomMembership(room_id=room.id, user_id=user_id, unread_count=len(unread),
+                                              last_read_message_id=watermark))
+    RoomMembership.objects.bulk_create(memberships, batch_size=batch_size, ignore_conflicts=True)
+
+    activity_types = [code for code, _ in ProgressLog.ACTIVITY_CHOICES]
+    with historical_timestamps(ProgressLog._meta.get_field('date')):
+        logs = ProgressLog.objects.bulk_create([
+            ProgressLog(user_id=user_id, date=(now - timedelta(days=rng.randint(0, 60))).date(),
+                        activity_type=rng.choice(activity_types), language=rng.choice(languages),
+                        minutes_studied=rng.randint(5, 90), words_learned=rng.randint(0, 40))
+            for user_id in user_ids for _ in range(logs_per_user)
+        ], batch_size=batch_size)
+    for start in range(0, len(user_ids), 1000):
+        ProgressRollup.rebuild(user_ids=user_ids[start:start + 1000])
+    counts['progress_logs'] = len(logs)
+    log(f"Created {len(logs)} progress logs")
+    return counts
+
+
+def clear(log=print):
+    """Delete every bench user and everything that belongs to them"""
+    user_ids = list(bench_users().values_list('id', flat=True))
+    for start in range(0, len(user_ids), 500):
+        chunk = user_ids[start:start + 500]
+        ChatRoom.objects.filter(participants__in=chunk).delete()
+        User.objects.filter(id__in=chunk).delete()
+    log(f"Deleted {len(user_ids)} bench users")
@@ -0,0 +1,133 @@
+"""
+Fan-out benchmark for the channel layer.
+
+N worker processes each join one group through their own channel layer
+instance, like N Daphne workers with a connected socket each. The parent
+process then ``group_send``s M messages to that group and every worker
+records the delivery latency of every message. The result reports
+delivered messages per second and latency percentiles.
+
+Worker processes are started with the ``spawn`` method and only need
+``channels`` and the layer backend, not Django settings.
+"""
+import asyncio
+import multiprocessing
+import statistics
+import time
+
+from django.utils.module_loading import import_string
+
+GROUP = 'bench.fanout'
+
+
+def make_layer(layer_config):
+    backend = import_string(layer_config['BACKEND'])
+    return backend(**layer_config.get('CONFIG', {}))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _worker(layer_config, messages, ready, results, timeout):
+    layer = make_layer(layer_config)
+    channel = await layer.new_channel()
+    await layer.group_add(GROUP, channel)
+    ready.set()
+
+    latencies = []
+    last_received = None
+    try:
+        while len(latencies) < messages:
+            message = await asyncio.wait_for(layer.receive(channel), timeout)
+            last_received = time.time()
+            latencies.append(last_received - message['sent'])
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await layer.group_discard(GROUP, channel)
+        if hasattr(layer, 'flush'):
+            await layer.flush()
+    results.put((latencies, last_received))
+
+
+def worker_main(layer_config, messages, ready, results, timeout):
+    asyncio.run(_worker(layer_config, messages, ready, results, timeout))
+
+
+async def _produce(layer_config, messages, payload_size, rate):
+    layer = make_layer(layer_config)
+    payload = 'x' * payload_size
+    interval = 1 / rate if rate else 0
+    started = time.time()
+    for i in range(messages):
+        await layer.group_send(GROUP, {'type': 'bench.message', 'seq': i, 'sent': time.time(), 'payload': payload})
+        if interval:
+            await asyncio.sleep(max(0, started + (i + 1) * interval - time.time()))
+    # Give the pub/sub layer's receiver tasks time to drain before closing
+    await asyncio.sleep(0.1)
+    if hasattr(layer, 'flush'):
+        await layer.flush()
+    return started
+
+
+def run_fanout_benchmark(layer_config, workers=4, messages=1000, payload_size=128, rate=None, timeout=10.0):
+    """
+    Run the benchmark and return a summary dict.
+
+    ``rate`` limits the producer to that many messages per second;
+    by default it sends as fast as the layer accepts them.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    ready_events = []
+    processes = []
+    for _ in range(workers):
+        ready = ctx.Event()
+        process = ctx.Process(target=worker_main, args=(layer_config, messages, ready, results, timeout))
+        process.start()
+        ready_events.append(ready)
+        processes.append(process)
+
+    deadline = time.monotonic() + 60
+    for ready, process in zip(ready_events, processes):
+        while not ready.wait(timeout=0.1):
+            if not process.is_alive() or time.monotonic() > deadline:
+                for other in processes:
+                    other.terminate()
+                raise RuntimeError('Benchmark worker failed to join the group')
+
+    started = asyncio.run(_produce(layer_config, messages, payload_size, rate))
+    latencies = []
+    finished = started
+    for _ in processes:
+        worker_latencies, last_received = results.get()
+        latencies.extend(worker_latencies)
+        finished = max(finished, last_received or started)
+    elapsed = finished - started
+    for process in processes:
+        process.join()
+
+    expected = workers * messages
+    return {
+        'backend': layer_config['BACKEND'],
+        'workers': workers,
+        'messages': messages,
+        'payload_size': payload_size,
+        'delivered': len(latencies),
+        'expected': expected,
+        'lost': expected - len(latencies),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_msgs_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'max': round(max(latencies) * 1000, 3) if latencies else 0.0,
+        },
+    }
@@ -0,0 +1,93 @@
+"""
+System checks for the database profile (see ``language_exchange/databases.py``).
+
+The configuration checks run with every management command and at server
+start. The ``database``-tagged checks connect to the database: one reads
+the journal mode the SQLite file really uses, the other looks for the
+message search triggers (see ``main/search.py``). They run with
+``migrate`` and ``manage.py check --database default``.
+"""
+import importlib.util
+
+from django.conf import settings
+from django.core import checks
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+
+from language_exchange.databases import describe_database
+
+from .search import missing_triggers
+
+
+@checks.register()
+def check_database_profile(app_configs, **kwargs):
+    messages = []
+    for alias, database in settings.DATABASES.items():
+        options = database.get('OPTIONS', {})
+        if database['ENGINE'] == 'django.db.backends.sqlite3':
+            if 'journal_mode=wal' not in options.get('init_command', '').replace(' ', '').lower():
+                messages.append(checks.Warning(
+                    f"SQLite database {alias!r} does not enable WAL mode; readers and the writer block each other.",
+                    hint="Build DATABASES with language_exchange.databases.build_databases('sqlite', ...).",
+                    id='main.W001',
+                ))
+            if (options.get('transaction_mode') or '').upper() != 'IMMEDIATE':
+                messages.append(checks.Warning(
+                    f"SQLite database {alias!r} starts transactions DEFERRED; concurrent writers can fail with "
+                    f"'database is locked' instead of waiting.",
+                    hint="Set OPTIONS['transaction_mode'] to 'IMMEDIATE'.",
+                    id='main.W002',
+                ))
+        elif database['ENGINE'] == 'django.db.backends.postgresql':
+            if options.get('pool'):
+                if importlib.util.find_spec('psycopg_pool') is None:
+                    messages.append(checks.Error(
+                        f"Database {alias!r} uses a connection pool but psycopg_pool is not installed.",
+                        hint="pip install 'psycopg[binary,pool]'",
+                        id='main.E001',
+                    ))
+            elif database.get('CONN_MAX_AGE'):
+                messages.append(checks.Warning(
+                    f"Database {alias!r} keeps persistent connections; under ASGI every worker thread holds "
+                    f"its own connection.",
+                    hint="Prefer the connection pool (DATABASE_POOL=1) when serving with Daphne.",
+                    id='main.W003',
+                ))
+    return messages
+
+
+@checks.register(checks.Tags.database)
+def check_sqlite_journal_mode(app_configs, databases=None, **kwargs):
+    messages = []
+    for alias in databases or []:
+        connection = connections[alias]
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            continue
+        description = describe_database(connection)
+        if description['journal_mode'].lower() != 'wal':
+            messages.append(checks.Warning(
+                f"SQLite database {alias!r} runs in journal_mode={description['journal_mode']}.",
+                hint="The file may be on a filesystem without shared memory support; WAL needs one.",
+                id='main.W004',
+            ))
+    return messages
+
+
+@checks.register(checks.Tags.database)
+def check_search_index(app_configs, databases=None, **kwargs):
+    messages = []
+    for alias in databases or []:
+        connection = connections[alias]
+        # Before migrate has created the index there is nothing to check
+        if ('main', '0012_message_search') not in MigrationExecutor(connection).loader.applied_migrations:
+            continue
+        missing = missing_triggers(connection)
+        if missing:
+            messages.append(checks.Warning(
+                f"The message search index of database {alias!r} is missing the triggers "
+                f"{', '.join(sorted(missing))}; new and edited messages are not indexed.",
+                hint="A migration that rebuilt the main_message table dropped them. Recreate them as in "
+                     "migration 0012_message_search, then run manage.py rebuild_search_index.",
+                id='main.W005',
+            ))
+    return messages
@@ -1,132 +1,536 @@
 # main/consumers.py
+import asyncio
 import json
 import logging
+import uuid
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
-from .models import Message, ChatRoom
+from django.utils import timezone
+from .models import Message, ChatRoom, RoomMembership
+from .history_frames import encode, history_frames, negotiate
+from .idempotency import clean_client_id, find_submission, get_dedup_window, submit_message
+from .instrumentation import InstrumentedConsumerMixin
+from .message_writer import get_message_writer
+from .notifications import get_dispatcher, read_receipt_event
+from .presence import get_presence_tracker, online_user_ids
+from .resume import missed_messages, parse_resume_id, reconnect_hint
+from .pagination import paginate_messages
 
 logger = logging.getLogger(__name__)
-User = get_user_model()
 
-class ChatConsumer(AsyncWebsocketConsumer):
+# Rooms one multiplexed socket may subscribe to at once
+MAX_SUBSCRIBED_ROOMS = 50
+
+# Seconds a closing socket waits for its queued messages to be saved
+PENDING_ACK_TIMEOUT = 5
+
+
+def room_group(room_id):
+    return f'chat_{room_id}'
+
+
+class RoomMessagingMixin:
+    """
+    Room operations shared by ``ChatConsumer`` (one socket per room) and
+    ``UserConsumer`` (one socket per user). Every method takes the room it
+    acts on; the consumer provides ``self.user``, ``self.pending_acks`` and
+    ``self.history_encoding``.
+    """
+
+    @database_sync_to_async
+    def get_room(self, room_id):
+        """The room, if the connected user is one of its participants"""
+        return ChatRoom.objects.filter(id=room_id, participants=self.user).first()
+
+    async def post_message(self, room, message, client_id=None):
+        """
+        Persist a message from the socket's user and broadcast it to the room.
+
+        A retry with the ``client_id`` of a message already submitted is
+        only acknowledged to the sender (see main/idempotency.py).
+        """
+        try:
+            client_id = clean_client_id(client_id)
+        except ValueError as e:
+            logger.warning(f"Rejected message from user {self.user.id}: {str(e)}")
+            await self.send(text_data=json.dumps({
+                'type': 'message_error',
+                'client_id': str(client_id),
+                'room_id': str(room.id),
+            }))
+            return
+
+        writer = get_message_writer()
+        if writer is not None:
+            await self.receive_write_behind(room, writer, message, client_id)
+            return
+
+        # 1. First save the message to the database
+        saved = await self.save_message(room, message, client_id)
+        if not saved:
+            logger.error("Failed to save message to database")
+            return
+        message_obj, created = saved
+        if not created:
+            await self.acknowledge_retry(message_obj, client_id)
+            return
+
+        logger.info(f"Message saved to database. ID: {message_obj.id}, Room: {room.id}")
+
+        # 2. Then send the message to the room group
+        await self.channel_layer.group_send(
+            room_group(room.id),
+            {
+                'type': 'chat_message',
+                'message': message,
+                'sender_id': str(self.user.id),
+                'sender_username': self.user.username,
+                'timestamp': message_obj.timestamp.isoformat(),
+                'message_id': str(message_obj.id),
+                'client_id': client_id or '',
+                'room_id': str(room.id)
+            }
+        )
+
+    async def mark_read(self, room):
+        """Move the user's read watermark and tell the room if it moved; returns the new watermark or None"""
+        last_read_id = await database_sync_to_async(RoomMembership.mark_read)(
+            room.id, self.user.id, publish=False
+        )
+        if last_read_id is not None:
+            await self.channel_layer.group_send(
+                room_group(room.id),
+                read_receipt_event(room.id, self.user.id, last_read_id)
+            )
+        return last_read_id
+
+    async def read_receipt(self, event):
+        """Forward a participant's new read watermark to the WebSocket"""
+        await self.send(text_data=json.dumps({
+            'type': 'read_receipt',
+            'user_id': event['user_id'],
+            'last_read_message_id': event['last_read_message_id'],
+            'room_id': event.get('room_id', '')
+        }))
+
+    async def receive_write_behind(self, room, writer, message, client_id=None):
+        """
+        Queue the message for the batched writer and broadcast it right away.
+
+        The broadcast carries a client id instead of the database id; a
+        ``message_ack`` with the real id follows once the batch commits. A
+        retry of a saved message is only acknowledged to the sender.
+        """
+        if client_id is not None:
+            known = get_dedup_window().get(self.user.id, client_id)
+            if known is None:
+                # Saved by another worker, or longer ago than the window
+                # remembers; an indexed lookup on the unique key
+                known = await database_sync_to_async(find_submission)(self.user.id, client_id)
+            if known is not None and await self.acknowledge_retry(known, client_id):
+                return
+        future = await writer.submit(room.id, self.user.id, message, client_id)
+        client_id = client_id or uuid.uuid4().hex
+        await self.channel_layer.group_send(
+            room_group(room.id),
+            {
+                'type': 'chat_message',
+                'message': message,
+                'sender_id': str(self.user.id),
+                'sender_username': self.user.username,
+                'timestamp': timezone.now().isoformat(),
+                'message_id': '',
+                'client_id': client_id,
+                'room_id': str(room.id)
+            }
+        )
+        task = asyncio.ensure_future(self.acknowledge_when_persisted(room, future, client_id))
+        self.pending_acks.add(task)
+        task.add_done_callback(self.pending_acks.discard)
+
+    async def acknowledge_when_persisted(self, room, future, client_id):
+        try:
+            message_obj = await future
+        except Exception as e:
+            logger.error(f"Failed to save message to database: {str(e)}")
+            await self.send(text_data=json.dumps({
+                'type': 'message_error',
+                'client_id': client_id,
+                'room_id': str(room.id),
+            }))
+            return
+
+        logger.info(f"Message saved to database. ID: {message_obj.id}, Room: {room.id}")
+        await self.channel_layer.group_send(
+            room_group(room.id),
+            {
+                'type': 'message_ack',
+                'client_id': client_id,
+                'message_id': str(message_obj.id),
+                'timestamp': message_obj.timestamp.isoformat(),
+                'room_id': str(room.id)
+            }
+        )
+
+    async def acknowledge_retry(self, known, client_id):
+        """
+        Confirm a retried submission to the sender only, without saving or
+        broadcasting it again. ``known`` is the saved message, or the
+        writer's future while it is queued. Returns False if the original
+        submission failed or is queued on another event loop, so the
+        retry has to be submitted itself.
+        """
+        if isinstance(known, asyncio.Future):
+            if known.get_loop() is not asyncio.get_running_loop():
+                return False
+            try:
+                known = await known
+            except Exception:
+                return False
+        logger.info(f"Duplicate submission {client_id} of message {known.id}")
+        await self.message_ack({
+            'client_id': client_id,
+            'message_id': str(known.id),
+            'timestamp': known.timestamp.isoformat(),
+            'room_id': str(known.room_id)
+        })
+        return True
+
+    async def finish_pending_acks(self):
+        """Wait until the messages this socket queued are saved, e.g. when the server closes it"""
+        if self.pending_acks:
+            await asyncio.wait(set(self.pending_acks), timeout=PENDING_ACK_TIMEOUT)
+
+    async def message_ack(self, event):
+        """Tell clients the database id of a message broadcast before it was saved"""
+        await self.send(text_data=json.dumps({
+            'type': 'message_ack',
+            'client_id': event['client_id'],
+            'message_id': event['message_id'],
+            'timestamp': event['timestamp'],
+            'room_id': event.get('room_id', '')
+        }))
+
+    @database_sync_to_async
+    def save_message(self, room, message, client_id=None):
+        """Returns ``(message, created)``; ``created`` is False for a retry"""
+        try:
+            return submit_message(room, self.user, message, client_id)
+        except Exception as e:
+            logger.error(f"Error saving message: {str(e)}")
+            return None
+
+    async def chat_message(self, event):
+        """Receive message from room group and send to WebSocket"""
+        try:
+            message_data = {
+                'type': 'chat_message',
+                'message': event['message'],
+                'sender_id': event['sender_id'],
+                'sender_username': event.get('sender_username', ''),
+                'timestamp': event['timestamp'],
+                'message_id': event.get('message_id', ''),
+                'room_id': event.get('room_id', '')
+            }
+            if event.get('client_id'):
+                message_data['client_id'] = event['client_id']
+            logger.info(f"Sending message to WebSocket: {message_data}")
+            await self.send(text_data=json.dumps(message_data))
+        except Exception as e:
+            logger.error(f"Error sending message to WebSocket: {str(e)}")
+
+    async def presence_update(self, event):
+        """Forward a room participant going online or offline"""
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'user_id': event['user_id'],
+            'online': event['online'],
+            'room_id': event.get('room_id', '')
+        }))
+
+    @database_sync_to_async
+    def get_message_history(self, room, resume_from=None):
+        """
+        The history to send on connect: ``(messages, peer's read watermark, resync, page)``.
+
+        With ``resume_from`` only the messages after it, unless too many
+        were missed; then the newest window with ``resync`` set (see
+        main/resume.py). ``page`` is the newest window's page, or None for
+        the messages after ``resume_from``.
+        """
+        peer_last_read_id = RoomMembership.peer_read_watermark(room.id, self.user.id)
+        if resume_from is not None:
+            messages = missed_messages(room.id, resume_from)
+            if messages is not None:
+                return messages, peer_last_read_id, False, None
+        page = paginate_messages(
+            Message.objects.filter(room_id=room.id).select_related('sender')
+        )
+        return page['messages'], peer_last_read_id, resume_from is not None, page
+
+    async def send_message_history(self, room, room_id_in_frames=False, resume_from=None):
+        """Send message history to the client in a few batched frames (see main/history_frames.py)"""
+        try:
+            messages, peer_last_read_id, resync, page = await self.get_message_history(room, resume_from)
+            if resync:
+                await self.send(text_data=json.dumps({
+                    'type': 'resync',
+                    'room_id': str(room.id),
+                    'reason': 'gap_too_large'
+                }))
+            room_id = room.id if room_id_in_frames else None
+            for frame in history_frames(messages, peer_last_read_id, room_id=room_id, page=page):
+                await self.send(**encode(frame, self.history_encoding))
+        except Exception as e:
+            logger.error(f"Error sending message history: {str(e)}")
+
+
+class ChatConsumer(RoomMessagingMixin, InstrumentedConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
+        self.pending_acks = set()
+        self.room_group_name = None
+        self.presence = None
         try:
             self.room_id = self.scope['url_route']['kwargs']['room_id']
-            self.room_group_name = f'chat_{self.room_id}'
-            
+
+            # Resolve the user and the room once for the lifetime of the
+            # connection; reject the handshake if the user may not join.
+            self.user = self.scope.get('user')
+            if self.user is None or not self.user.is_authenticated:
+                logger.warning(f"Rejected anonymous WebSocket for room: {self.room_id}")
+                await self.close()
+                return
+            self.room = await self.get_room(self.room_id)
+            if self.room is None:
+                logger.warning(f"Rejected WebSocket for user {self.user.id}: not a participant of room {self.room_id}")
+                await self.close()
+                return
+            self.room_group_name = room_group(self.room_id)
+
             # Join room group
             await self.channel_layer.group_add(
                 self.room_group_name,
                 self.channel_name
             )
-            await self.accept()
+            # The subprotocol picks the encoding of the history frames
+            subprotocol, self.history_encoding = negotiate(self.scope.get('subprotocols'))
+            await self.accept(subprotocol=subprotocol)
+            await self.send(text_data=json.dumps(reconnect_hint()))
             logger.info(f"WebSocket connected to room: {self.room_id}")
-            
-            # Send message history on connect
-            await self.send_message_history()
-            
+            self.presence = get_presence_tracker()
+            await self.presence.connect(self.user.id)
+
+            # Send message history on connect; a reconnecting client
+            # passes ?after=<last message id> and only gets what it missed
+            query = parse_qs(self.scope.get('query_string', b'').decode())
+            resume_from = parse_resume_id(query.get('after', [None])[0])
+            await self.send_message_history(self.room, resume_from=resume_from)
+            await self.mark_read(self.room)
+
         except Exception as e:
             logger.error(f"Error in WebSocket connect: {str(e)}")
             await self.close()
 
     async def disconnect(self, close_code):
+        await self.finish_pending_acks()
+        if self.presence is not None:
+            await self.presence.disconnect(self.user.id)
         # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        if self.room_group_name:
+            await self.channel_layer.group_discard(
+                self.room_group_name,
+                self.channel_name
+            )
 
     async def receive(self, text_data):
         try:
             text_data_json = json.loads(text_data)
+            if text_data_json.get('type') == 'read':
+                await self.mark_read(self.room)
+                return
+            if text_data_json.get('type') == 'heartbeat':
+                await self.presence.heartbeat(self.user.id)
+                return
             message = text_data_json.get('message', '').strip()
-            sender_id = text_data_json.get('sender_id')
-            
-            if not all([message, sender_id, self.room_id]):
+
+            if not message:
                 logger.error("Missing required fields in message")
                 return
 
-            # 1. First save the message to the database
-            message_obj = await self.save_message(sender_id, message)
-            if not message_obj:
-                logger.error("Failed to save message to database")
-                return
-                
-            logger.info(f"Message saved to database. ID: {message_obj.id}, Room: {self.room_id}")
+            # The sender is always the authenticated user of the socket
+            claimed_sender_id = text_data_json.get('sender_id')
+            if claimed_sender_id is not None and str(claimed_sender_id) != str(self.user.id):
+                logger.warning(f"Ignoring sender_id {claimed_sender_id} sent by user {self.user.id}")
 
-            # 2. Then send the message to the room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message,
-                    'sender_id': sender_id,
-                    'sender_username': message_obj.sender.username,
-                    'timestamp': message_obj.timestamp.isoformat(),
-                    'message_id': str(message_obj.id),
-                    'room_id': str(self.room_id)
-                }
-            )
+            await self.post_message(self.room, message, text_data_json.get('client_id'))
 
         except json.JSONDecodeError:
             logger.error("Invalid JSON received")
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}", exc_info=True)
 
-    @database_sync_to_async
-    def save_message(self, sender_id, message):
-        try:
-            sender = User.objects.get(id=sender_id)
-            room = ChatRoom.objects.get(id=self.room_id)
-            return Message.objects.create(
-                room=room,
-                sender=sender,
-                content=message
+
+class UserConsumer(RoomMessagingMixin, InstrumentedConsumerMixin, AsyncWebsocketConsumer):
+    """
+    One socket per user for every room.
+
+    The socket always receives the user's new-message notifications and
+    unread counters (group ``user_<id>``). Rooms are joined and left with
+    frames, so a page with several chats open needs one connection, one
+    handshake and one session lookup. Frames from the client::
+
+        {"type": "subscribe", "room_id": 12}     -> subscribed, history, read receipt, presence
+        {"type": "subscribe", "room_id": 12, "after": 411}  -> only the history after message 411
+        {"type": "unsubscribe", "room_id": 12}
+        {"type": "message", "room_id": 12, "message": "...", "client_id": "..."}
+        {"type": "read", "room_id": 12}
+        {"type": "heartbeat"}
+
+    Frames to the client carry a ``room_id`` when they belong to a room:
+    ``chat_message``, ``message_ack``, ``message_error``, ``read_receipt``,
+    ``history``, ``resync``, ``presence``, ``subscribed`` and
+    ``unsubscribed``. Frames without one are ``hello`` (sent on connect,
+    see main/resume.py), ``notifications``, ``unread`` and ``error``.
+    """
+
+    async def connect(self):
+        self.pending_acks = set()
+        self.rooms = {}
+        self.user_group_name = None
+        self.presence = None
+        self.user = self.scope.get('user')
+        if self.user is None or not self.user.is_authenticated:
+            await self.close()
+            return
+        get_dispatcher().attach()
+        self.user_group_name = f'user_{self.user.id}'
+        await self.channel_layer.group_add(
+            self.user_group_name,
+            self.channel_name
+        )
+        subprotocol, self.history_encoding = negotiate(self.scope.get('subprotocols'))
+        await self.accept(subprotocol=subprotocol)
+        await self.send(text_data=json.dumps(reconnect_hint()))
+        self.presence = get_presence_tracker()
+        await self.presence.connect(self.user.id)
+
+    async def disconnect(self, close_code):
+        await self.finish_pending_acks()
+        if self.presence is not None:
+            await self.presence.disconnect(self.user.id)
+        for room_id in list(self.rooms):
+            await self.leave_room(room_id)
+        if self.user_group_name:
+            await self.channel_layer.group_discard(
+                self.user_group_name,
+                self.channel_name
             )
-        except (User.DoesNotExist, ChatRoom.DoesNotExist) as e:
-            logger.error(f"User or Room not found: {str(e)}")
-            return None
-        except Exception as e:
-            logger.error(f"Error saving message: {str(e)}")
-            return None
 
-    async def chat_message(self, event):
-        """Receive message from room group and send to WebSocket"""
+    async def receive(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            return
         try:
-            message_data = {
-                'type': 'chat_message',
-                'message': event['message'],
-                'sender_id': event['sender_id'],
-                'sender_username': event.get('sender_username', ''),
-                'timestamp': event['timestamp'],
-                'message_id': event.get('message_id', ''),
-                'room_id': event.get('room_id', '')
-            }
-            logger.info(f"Sending message to WebSocket: {message_data}")
-            await self.send(text_data=json.dumps(message_data))
+            frame = json.loads(text_data)
+            kind = frame.get('type')
+            if kind == 'heartbeat':
+                await self.presence.heartbeat(self.user.id)
+                return
+            try:
+                room_id = int(frame.get('room_id'))
+            except (TypeError, ValueError):
+                await self.send_error('invalid_room', frame.get('room_id'))
+                return
+            if kind == 'subscribe':
+                await self.subscribe_room(room_id, parse_resume_id(frame.get('after')))
+                return
+
+            room = self.rooms.get(room_id)
+            if room is None:
+                await self.send_error('not_subscribed', room_id)
+            elif kind == 'unsubscribe':
+                await self.leave_room(room_id)
+                await self.send(text_data=json.dumps({'type': 'unsubscribed', 'room_id': str(room_id)}))
+            elif kind == 'read':
+                await self.mark_read(room)
+            elif kind == 'message':
+                message = str(frame.get('message', '')).strip()
+                if message:
+                    await self.post_message(room, message, frame.get('client_id'))
+            else:
+                await self.send_error('unknown_type', room_id)
+        except json.JSONDecodeError:
+            logger.error("Invalid JSON received")
         except Exception as e:
-            logger.error(f"Error sending message to WebSocket: {str(e)}")
+            logger.error(f"Error processing frame: {str(e)}", exc_info=True)
+
+    async def send_error(self, error, room_id=None):
+        await self.send(text_data=json.dumps({'type': 'error', 'error': error, 'room_id': str(room_id or '')}))
+
+    async def subscribe_room(self, room_id, resume_from=None):
+        if room_id not in self.rooms:
+            if len(self.rooms) >= MAX_SUBSCRIBED_ROOMS:
+                await self.send_error('too_many_rooms', room_id)
+                return
+            room = await self.get_room(room_id)
+            if room is None:
+                await self.send_error('forbidden', room_id)
+                return
+            self.rooms[room_id] = room
+            await self.channel_layer.group_add(room_group(room_id), self.channel_name)
+            await self.channel_layer.group_send(room_group(room_id), {
+                'type': 'presence_update', 'user_id': str(self.user.id), 'online': True, 'room_id': str(room_id),
+            })
+        room = self.rooms[room_id]
+        await self.send(text_data=json.dumps({'type': 'subscribed', 'room_id': str(room_id)}))
+        await self.send_message_history(room, room_id_in_frames=True, resume_from=resume_from)
+        await self.send_peer_presence(room)
+        await self.mark_read(room)
+
+    async def leave_room(self, room_id):
+        self.rooms.pop(room_id, None)
+        await self.channel_layer.group_discard(room_group(room_id), self.channel_name)
+        # Other sockets of the user in this process keep it online
+        if not self.presence.is_connected(self.user.id):
+            await self.channel_layer.group_send(room_group(room_id), {
+                'type': 'presence_update', 'user_id': str(self.user.id), 'online': False, 'room_id': str(room_id),
+            })
+
+    async def send_peer_presence(self, room):
+        peer_ids = await database_sync_to_async(
+            lambda: list(room.participants.exclude(id=self.user.id).values_list('id', flat=True))
+        )()
+        online = await database_sync_to_async(online_user_ids)(peer_ids)
+        for peer_id in peer_ids:
+            await self.presence_update({
+                'user_id': str(peer_id), 'online': peer_id in online, 'room_id': str(room.id),
+            })
+
+    async def mark_read(self, room):
+        last_read_id = await super().mark_read(room)
+        if last_read_id is not None:
+            # Every open page of the user updates its badge
+            counts = await self.get_unread_counts()
+            await self.channel_layer.group_send(self.user_group_name, {'type': 'unread_counts', **counts})
+        return last_read_id
 
     @database_sync_to_async
-    def get_message_history(self):
-        """Retrieve message history for the room"""
-        return list(Message.objects.filter(
-            room_id=self.room_id
-        ).select_related('sender').order_by('timestamp')[:50])
-
-    async def send_message_history(self):
-        """Send message history to the client"""
+    def get_unread_counts(self):
+        rooms = dict(
+            RoomMembership.objects.filter(user=self.user, unread_count__gt=0).values_list('room_id', 'unread_count')
+        )
+        return {'total': sum(rooms.values()), 'rooms': {str(room_id): count for room_id, count in rooms.items()}}
+
+    async def unread_counts(self, event):
+        await self.send(text_data=json.dumps({'type': 'unread', 'total': event['total'], 'rooms': event['rooms']}))
+
+    async def notify_messages(self, event):
+        """Forward a batch of new-message notifications, then the new unread counters"""
         try:
-            messages = await self.get_message_history()
-            for message in messages:
-                await self.chat_message({
-                    'type': 'chat_message',
-                    'message': message.content,
-                    'sender_id': str(message.sender.id),
-                    'sender_username': message.sender.username,
-                    'timestamp': message.timestamp.isoformat(),
-                    'message_id': str(message.id),
-                })
+            await self.send(text_data=json.dumps({
+                'type': 'notifications',
+                'messages': event['messages'],
+            }))
+            await self.unread_counts({'type': 'unread_counts', **await self.get_unread_counts()})
         except Exception as e:
-            logger.error(f"Error sending message history: {str(e)}")
\ No newline at end of file
+            logger.error(f"Error sending notifications to WebSocket: {str(e)}")
@@ -1,11 +1,12 @@
-from .models import Message
+from .models import RoomMembership
+from .presence import get_config as get_presence_config
 
 def unread_messages_count(request):
     if request.user.is_authenticated:
         return {
-            'unread_messages_count': Message.objects.filter(
-                receiver=request.user,
-                is_read=False
-            ).count()
+            'unread_messages_count': RoomMembership.total_unread(request.user)
         }
     return {'unread_messages_count': 0}
+
+def presence(request):
+    return {'presence_heartbeat_ms': get_presence_config()['HEARTBEAT_INTERVAL'] * 1000}
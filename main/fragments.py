@@ -0,0 +1,137 @@
+"""
+Per-user fragment cache for the matches, inbox and dashboard pages.
+
+A fragment's cache key holds the user id, the user's version counter for
+the fragment's scope and whatever else the page varies on (page number,
+cursor, the partners that are online). Model signals bump the counters
+of exactly the users whose fragment changed, which makes the old entries
+unreachable. Entries therefore never expire; stale ones are evicted by
+the backend like any unused entry.
+
+Views ask for the fragment first and skip building their context on a
+hit. The ``{% fragment %}`` tag (see ``main/templatetags/fragments.py``)
+then outputs the cached HTML or renders and stores it.
+
+Versions and entries live in the ``fragments`` cache (see ``CACHES``).
+The local-memory backend is per process; use the file backend, or a
+shared one, when several processes serve the site. Hits and misses are
+counted per scope; see ``fragment_stats()`` and the
+``fragment_cache_stats`` command.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'fragments',
+}
+
+SCOPES = ('matches', 'inbox', 'dashboard')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'FRAGMENT_CACHE', {})}
+
+
+def get_cache():
+    return caches[get_config()['CACHE']]
+
+
+def _version_key(scope, ident):
+    return f'fragments:version:{scope}:{ident}'
+
+
+def _stats_key(scope, outcome):
+    return f'fragments:stats:{scope}:{outcome}'
+
+
+def get_version(scope, ident):
+    cache = get_cache()
+    key = _version_key(scope, ident)
+    version = cache.get(key)
+    if version is None:
+        # Start from a fresh value so entries from an evicted version are never reused
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump(scope, idents):
+    """Invalidate the ``scope`` fragments of ``idents`` (user ids or bucket names)"""
+    cache = get_cache()
+    for ident in set(idents):
+        try:
+            cache.incr(_version_key(scope, ident))
+        except ValueError:
+            cache.set(_version_key(scope, ident), time.time_ns(), timeout=None)
+
+
+def bump_on_commit(scope, idents):
+    """Bump once the current transaction commits, so no request can cache the old data under the new version"""
+    idents = set(idents)
+    if idents:
+        transaction.on_commit(lambda: bump(scope, idents))
+
+
+def bucket_name(native, learning):
+    return f'{native}:{learning}'
+
+
+def _count(scope, outcome):
+    cache = get_cache()
+    key = _stats_key(scope, outcome)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def fragment_stats():
+    """``{scope: {'hits': n, 'misses': n, 'hit_rate': r}}`` since the last reset"""
+    cache = get_cache()
+    keys = {(scope, outcome): _stats_key(scope, outcome) for scope in SCOPES for outcome in ('hits', 'misses')}
+    found = cache.get_many(keys.values())
+    stats = {}
+    for scope in SCOPES:
+        hits = found.get(keys[scope, 'hits'], 0)
+        misses = found.get(keys[scope, 'misses'], 0)
+        stats[scope] = {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0}
+    return stats
+
+
+def reset_fragment_stats():
+    get_cache().delete_many([_stats_key(scope, outcome) for scope in SCOPES for outcome in ('hits', 'misses')])
+
+
+class Fragment:
+    """A user's cached fragment; ``html`` is None on a miss"""
+
+    def __init__(self, scope, key, html=None):
+        self.scope = scope
+        self.key = key
+        self.html = html
+
+    @property
+    def cached(self):
+        return self.html is not None
+
+    def store(self, html):
+        if self.key is not None:
+            get_cache().set(self.key, html, timeout=None)
+        self.html = html
+
+
+def get_fragment(scope, user_id, *vary):
+    """Look up ``scope`` for ``user_id``; ``vary`` are the other values the fragment depends on"""
+    if not get_config()['ENABLED']:
+        return Fragment(scope, None)
+    digest = hashlib.md5(repr(vary).encode(), usedforsecurity=False).hexdigest()
+    key = f'fragments:{scope}:{user_id}:{get_version(scope, user_id)}:{digest}'
+    html = get_cache().get(key)
+    _count(scope, 'misses' if html is None else 'hits')
+    return Fragment(scope, key, html)
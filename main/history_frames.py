@@ -0,0 +1,105 @@
+"""
+Compact, batched history frames for the chat socket.
+
+On connect the consumer sends the room's history window as a few
+``history`` frames instead of one ``chat_message`` frame per message::
+
+    {"type": "history",
+     "u": {"7": "alice", "9": "bob"},         # sender id -> username, once per frame
+     "m": [[412, 7, 1760680800123, "hola"],   # [id, sender id, epoch ms, content], oldest first
+           ...],
+     "r": 405,                                # last message the peer has read
+     "end": true,                             # last history frame of this connect
+     "b": "MjAyNi0xMC0x..."}                  # cursor for older messages, see below
+
+Each frame carries at most ``MAX_MESSAGES_PER_FRAME`` messages, so a full
+screen of history arrives in one frame.
+
+When the frames hold the newest window of the room (a fresh load or a
+resync, not the messages missed since a resume), the last frame also
+carries ``b``: the ``before`` cursor for ``/api/chat/<room_name>/messages/``
+that loads the messages older than the window, or null if there are none.
+
+The encoding is negotiated in the WebSocket handshake through the
+subprotocol. A client offering ``langlink.msgpack`` gets MessagePack binary
+frames, if the ``msgpack`` package is installed. Clients offering
+``langlink.json``, or nothing, get JSON text frames. Live frames
+(``chat_message``, ``message_ack``, ...) keep their JSON schema. Only the
+history, which makes up almost all bytes sent on connect, changes shape.
+
+Transport compression (permessage-deflate) is negotiated by the server,
+not here. Daphne does not offer it; uvicorn does by default.
+"""
+import json
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DEFAULTS = {
+    'MAX_MESSAGES_PER_FRAME': 100,
+}
+
+SUBPROTOCOLS = {
+    'langlink.msgpack': 'msgpack',
+    'langlink.json': 'json',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_HISTORY_FRAMES', {})}
+
+
+def negotiate(offered):
+    """Pick ``(subprotocol, encoding)`` from the subprotocols the client offered, in its order of preference"""
+    for subprotocol in offered or []:
+        encoding = SUBPROTOCOLS.get(subprotocol)
+        if encoding == 'msgpack' and msgpack is None:
+            continue
+        if encoding:
+            return subprotocol, encoding
+    return None, 'json'
+
+
+def history_frames(messages, peer_last_read_id=0, max_per_frame=None, room_id=None, page=None):
+    """
+    Group ``messages`` (oldest first, with ``sender`` loaded) into history frames.
+
+    ``room_id`` is added to every frame for sockets that carry several rooms.
+    ``page`` is the ``paginate_messages`` page the messages are the window
+    of; it adds the cursor for older messages to the last frame.
+    """
+    max_per_frame = max_per_frame or get_config()['MAX_MESSAGES_PER_FRAME']
+    frames = []
+    for start in range(0, len(messages), max_per_frame):
+        batch = messages[start:start + max_per_frame]
+        frames.append({
+            'type': 'history',
+            'u': {str(message.sender_id): message.sender.username for message in batch},
+            'm': [
+                [message.id, message.sender_id, int(message.timestamp.timestamp() * 1000), message.content]
+                for message in batch
+            ],
+            'r': peer_last_read_id,
+            'end': False,
+        })
+    if not frames:
+        # Tells the client the history is complete, and the peer's watermark
+        frames.append({'type': 'history', 'u': {}, 'm': [], 'r': peer_last_read_id, 'end': False})
+    frames[-1]['end'] = True
+    if page is not None:
+        frames[-1]['b'] = page['before'] if page['has_older'] else None
+    if room_id is not None:
+        for frame in frames:
+            frame['room_id'] = str(room_id)
+    return frames
+
+
+def encode(frame, encoding):
+    """Keyword arguments for ``AsyncWebsocketConsumer.send``"""
+    if encoding == 'msgpack':
+        return {'bytes_data': msgpack.packb(frame)}
+    return {'text_data': json.dumps(frame, ensure_ascii=False, separators=(',', ':'))}
@@ -0,0 +1,139 @@
+"""
+Idempotent message submission.
+
+Clients send every message with a ``client_id`` they generate, and send
+it again with the same id when they are not sure it arrived (a lost
+``message_ack``, a reconnect). A retry resolves to the message saved the
+first time: it is not inserted again and not broadcast again. The sender
+only gets another ``message_ack`` with the saved id.
+
+Two layers catch retries:
+
+* ``DedupWindow`` - a per-process map of recent ``(sender_id, client_id)``
+  keys, kept for ``WINDOW`` seconds. A key maps to the writer's future
+  while its message is queued (see main/message_writer.py) and to the
+  saved ``Message`` afterwards. Most retries arrive within seconds and
+  are answered from memory, without a query.
+* The ``message_sender_client_id_key`` unique constraint on ``Message``
+  catches the rest: retries that reach another process or arrive after
+  the window. ``Message.get_or_create_submission`` and the writer's
+  batches resolve those to the existing row. A socket looks a key that
+  is not in the window up with ``find_submission`` before it broadcasts,
+  so such a retry is not fanned out to the room again either.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Message
+
+MAX_CLIENT_ID_LENGTH = 64
+
+DEFAULTS = {
+    'WINDOW': 600,
+    'MAX_KEYS': 10000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_IDEMPOTENCY', {})}
+
+
+def clean_client_id(value):
+    """The client's idempotency key, or None if it sent none; raises ValueError for an unusable one"""
+    if value is None:
+        return None
+    client_id = str(value).strip()
+    if not client_id:
+        return None
+    if len(client_id) > MAX_CLIENT_ID_LENGTH:
+        raise ValueError(f"client_id is longer than {MAX_CLIENT_ID_LENGTH} characters")
+    return client_id
+
+
+class DedupWindow:
+    """Recently submitted ``(sender_id, client_id)`` keys, oldest first"""
+
+    def __init__(self, window=600, max_keys=10000):
+        self.window = window
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        # Shared by the event loop and the threads serving sync views
+        self._lock = threading.Lock()
+
+    def get(self, sender_id, client_id):
+        """The pending future or saved message of a key, or None"""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get((sender_id, client_id))
+            return entry[1] if entry else None
+
+    def remember(self, sender_id, client_id, value):
+        """Record a future or a saved message; a saved message keeps the key's original age"""
+        key = (sender_id, client_id)
+        with self._lock:
+            added = self._entries[key][0] if key in self._entries else time.monotonic()
+            self._entries[key] = (added, value)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def forget(self, sender_id, client_id):
+        with self._lock:
+            self._entries.pop((sender_id, client_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.window
+        while self._entries:
+            key, (added, _) = next(iter(self._entries.items()))
+            if added >= cutoff:
+                break
+            del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_window = None
+_window_lock = threading.Lock()
+
+
+def get_dedup_window():
+    """Return the process-wide dedup window"""
+    global _window
+    with _window_lock:
+        if _window is None:
+            config = get_config()
+            _window = DedupWindow(window=config['WINDOW'], max_keys=config['MAX_KEYS'])
+        return _window
+
+
+def find_submission(sender_id, client_id):
+    """The message already saved under ``(sender_id, client_id)``, or None; a hit is added to the window"""
+    message = Message.objects.filter(sender_id=sender_id, client_id=client_id).first()
+    if message is not None:
+        get_dedup_window().remember(sender_id, client_id, message)
+    return message
+
+
+def submit_message(room, sender, content, client_id=None):
+    """
+    Save a message submitted outside the write-behind writer; returns ``(message, created)``.
+
+    A retry of a message that is still queued in a writer is looked up in
+    the database, where the unique constraint settles the race.
+    """
+    window = get_dedup_window()
+    if client_id is not None:
+        known = window.get(sender.id, client_id)
+        if isinstance(known, Message):
+            return known, False
+    message, created = Message.get_or_create_submission(room, sender, content, client_id)
+    if client_id is not None:
+        window.remember(sender.id, client_id, message)
+    return message, created
@@ -0,0 +1,192 @@
+"""
+Profile picture processing.
+
+Uploads are stored as received and then processed off the request, in a
+small thread pool, once the saving transaction commits. The processing
+applies the EXIF orientation, drops all metadata (EXIF, GPS, comments) and
+caps the original at ``MAX_DIMENSION`` pixels. It also renders square
+avatars for each of ``SIZES``, in WebP and in a JPEG fallback.
+
+Every file gets a content-hashed name such as
+``profile_pics/user_7/avatar-64.3f2a9c1b0e4d.webp``. A given name never
+changes content, so the web server can serve ``MEDIA_URL`` with
+far-future cache headers. The names are kept in
+``Profile.profile_picture_variants`` and templates pick one with the
+``{% avatar %}`` tag (see ``main/templatetags/avatars.py``).
+
+Set ``ASYNC`` to False to process inline, e.g. in tests.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ASYNC': True,
+    'WORKERS': 2,
+    'MAX_DIMENSION': 1600,
+    'SIZES': [64, 160, 480],
+    'QUALITY': 82,
+}
+
+FORMATS = {
+    'webp': 'WEBP',
+    'jpg': 'JPEG',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_PROCESSING', {})}
+
+
+def hashed_name(directory, label, data, ext):
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    return posixpath.join(directory, f'{label}.{digest}.{ext}')
+
+
+def encode(image, ext, quality):
+    """Encode ``image`` without any of the source file's metadata"""
+    buffer = io.BytesIO()
+    if ext == 'jpg' and image.mode != 'RGB':
+        image = flatten(image)
+    image.save(buffer, FORMATS[ext], quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def flatten(image):
+    """Composite transparent images on white for formats without alpha"""
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def store(name, data):
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data))
+    return name
+
+
+def render_variants(source_name, config):
+    """
+    Write the capped original and the avatar variants of ``source_name``.
+
+    Returns ``(original_name, variants)``. ``variants`` maps a size to a
+    ``{'webp': name, 'jpg': name}`` dict.
+    """
+    with default_storage.open(source_name, 'rb') as f:
+        image = Image.open(f)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+    directory = posixpath.dirname(source_name)
+    quality = config['QUALITY']
+
+    original = image.copy()
+    original.thumbnail((config['MAX_DIMENSION'], config['MAX_DIMENSION']), Image.LANCZOS)
+    data = encode(original, 'jpg', quality)
+    original_name = store(hashed_name(directory, 'original', data, 'jpg'), data)
+
+    variants = {}
+    for size in sorted(config['SIZES']):
+        avatar = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        variants[str(size)] = {}
+        for ext in FORMATS:
+            data = encode(avatar, ext, quality)
+            variants[str(size)][ext] = store(hashed_name(directory, f'avatar-{size}', data, ext), data)
+    return original_name, variants
+
+
+def variant_names(variants):
+    return {name for formats in (variants or {}).values() for name in formats.values()}
+
+
+def delete_files(names):
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except Exception as e:
+            logger.warning(f"Could not delete {name}: {str(e)}")
+
+
+def process_profile_picture(profile_id, source_name):
+    """Replace a raw upload by its processed files, unless it was replaced meanwhile"""
+    from .models import Profile, invalidate_profile_fragments
+
+    try:
+        profile = Profile.objects.filter(pk=profile_id).values(
+            'user_id', 'native_language', 'learning_language', 'profile_picture_variants',
+        ).first()
+        if profile is None:
+            return
+        original_name, variants = render_variants(source_name, get_config())
+        updated = Profile.objects.filter(pk=profile_id, profile_picture=source_name).update(
+            profile_picture=original_name,
+            profile_picture_variants=variants,
+        )
+        written = variant_names(variants) | {original_name}
+        if not updated:
+            # A newer upload or a deleted profile; drop what was just written
+            delete_files(written)
+            return
+        # A queryset update sends no post_save
+        invalidate_profile_fragments(profile['user_id'], [(profile['native_language'], profile['learning_language'])])
+        stale = variant_names(profile['profile_picture_variants']) - written
+        if source_name != original_name:
+            stale.add(source_name)
+        delete_files(stale)
+    except Exception as e:
+        logger.error(f"Error processing profile picture {source_name}: {str(e)}", exc_info=True)
+
+
+def _process_in_worker(profile_id, source_name):
+    # Pool threads keep their connection between jobs
+    close_old_connections()
+    try:
+        process_profile_picture(profile_id, source_name)
+    finally:
+        close_old_connections()
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=get_config()['WORKERS'], thread_name_prefix='image-worker')
+    return _executor
+
+
+def schedule_profile_picture(profile):
+    """Process ``profile``'s picture once the current transaction commits"""
+    profile_id = profile.pk
+    source_name = profile.profile_picture.name
+
+    def run():
+        if get_config()['ASYNC']:
+            get_executor().submit(_process_in_worker, profile_id, source_name)
+        else:
+            process_profile_picture(profile_id, source_name)
+
+    transaction.on_commit(run)
+
+
+def pick_variant(variants, size):
+    """Smallest variant at least ``size`` pixels wide (or the largest one)"""
+    if not variants:
+        return None
+    sizes = sorted(int(key) for key in variants)
+    chosen = next((candidate for candidate in sizes if candidate >= size), sizes[-1])
+    return variants[str(chosen)]
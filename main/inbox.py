@@ -0,0 +1,95 @@
+"""
+Inbox builder.
+
+The whole conversation list is built from the user's RoomMemberships in
+two queries, no matter how many rooms the user has: one for the
+memberships annotated with the last message and the other participant,
+and one for those participants with their profiles.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Message, RoomMembership
+from .pagination import MessageCursor
+from .presence import apply_presence
+
+DEFAULT_PAGE_SIZE = 30
+
+
+def get_inbox_queryset(user):
+    """User's memberships annotated with everything an inbox row needs"""
+    latest = Message.objects.filter(room=OuterRef('room')).order_by('-timestamp', '-id')
+    other = RoomMembership.objects.filter(room=OuterRef('room')).exclude(user=user).order_by('id')
+    return RoomMembership.objects.filter(user=user).select_related('room').annotate(
+        last_message_id=Subquery(latest.values('id')[:1]),
+        last_message_content=Subquery(latest.values('content')[:1]),
+        last_message_timestamp=Subquery(latest.values('timestamp')[:1]),
+        last_message_sender_id=Subquery(latest.values('sender_id')[:1]),
+        other_user_id=Subquery(other.values('user_id')[:1]),
+        other_last_read_id=Subquery(other.values('last_read_message_id')[:1]),
+        activity=Coalesce(F('last_message_timestamp'), F('room__created_at')),
+    ).filter(other_user_id__isnull=False)
+
+
+def partner_ids(user):
+    """Ids of everyone the user shares a room with, in one query"""
+    return set(RoomMembership.objects.filter(
+        room__memberships__user=user
+    ).exclude(user=user).values_list('user_id', flat=True))
+
+
+def build_inbox(user, before=None, limit=None):
+    """
+    Return one page of the user's conversations, most recently active first.
+
+    ``before`` is the cursor returned as ``next_cursor`` by the previous page.
+    """
+    if limit is None:
+        limit = getattr(settings, 'INBOX_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+    queryset = get_inbox_queryset(user)
+    if before:
+        cursor = MessageCursor.decode(before)
+        queryset = queryset.filter(
+            Q(activity__lt=cursor.timestamp) |
+            Q(activity=cursor.timestamp, room_id__lt=cursor.id)
+        )
+    rows = list(queryset.order_by('-activity', '-room_id')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    users = User.objects.select_related('profile').in_bulk({row.other_user_id for row in rows})
+    apply_presence(other.profile for other in users.values() if hasattr(other, 'profile'))
+    users[user.id] = user
+
+    conversations = []
+    for row in rows:
+        last_message = {}
+        if row.last_message_id:
+            last_message = {
+                'content': row.last_message_content,
+                'timestamp': row.last_message_timestamp,
+                'sender': users.get(row.last_message_sender_id),
+                # Own messages are read once they are behind the other
+                # participant's watermark, incoming ones once nothing is unread
+                'is_read': (
+                    (row.other_last_read_id or 0) >= row.last_message_id
+                    if row.last_message_sender_id == user.id
+                    else row.unread_count == 0
+                ),
+            }
+        conversations.append({
+            'user': users[row.other_user_id],
+            'room': row.room,
+            'last_message': last_message,
+            'unread_count': row.unread_count,
+        })
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = MessageCursor(timestamp=last.activity, id=last.room_id).encode()
+
+    return {'conversations': conversations, 'next_cursor': next_cursor}
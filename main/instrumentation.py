@@ -0,0 +1,394 @@
+"""
+Per-endpoint request instrumentation.
+
+``InstrumentationMiddleware`` records every HTTP request and
+``InstrumentedConsumerMixin`` every WebSocket event handled by a consumer.
+Each recording keeps:
+- the number of queries and the time spent in the database;
+- the total latency;
+- the response payload size;
+- exact duplicate queries, and SQL run ``N_PLUS_ONE_THRESHOLD`` or more
+  times with different parameters (an N+1 pattern), which is logged.
+
+Queries are captured by a database execute wrapper installed on every
+connection. It only times a query while a recording is active in the
+current context, and ``database_sync_to_async`` carries that context into
+the database thread. The results are aggregated per endpoint into
+histograms, which ``/metrics`` exposes in the Prometheus text format.
+
+Recording can be switched at runtime: the ``instrumentation:enabled``
+cache key overrides ``ENABLED`` and is re-read every ``REFRESH_INTERVAL``
+seconds. When off, a request costs one clock read and a comparison, and a
+query one context variable lookup. Each process also saves a snapshot of
+its histograms to the cache every ``PUBLISH_INTERVAL`` seconds. The
+``request_metrics`` command merges the snapshots into a top-N report;
+with a per-process cache backend it only sees its own process.
+"""
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'REFRESH_INTERVAL': 5,
+    'PUBLISH_INTERVAL': 10,
+    'N_PLUS_ONE_THRESHOLD': 10,
+    'METRICS_TOKEN': None,
+}
+
+# Histogram upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2)
+
+ENABLED_KEY = 'instrumentation:enabled'
+PROCESSES_KEY = 'instrumentation:processes'
+
+# Collapses literals so one query shape in a loop maps to one template
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+_recording = ContextVar('instrumentation_recording', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'INSTRUMENTATION', {})}
+
+
+class _Switch:
+    """Runtime on/off state, refreshed from the cache at most every ``REFRESH_INTERVAL`` seconds"""
+
+    def __init__(self):
+        self.enabled = False
+        self.checked_at = None
+
+    def is_enabled(self):
+        now = time.monotonic()
+        if self.checked_at is None or now - self.checked_at >= get_config()['REFRESH_INTERVAL']:
+            self.checked_at = now
+            override = cache.get(ENABLED_KEY)
+            self.enabled = get_config()['ENABLED'] if override is None else override
+        return self.enabled
+
+
+_switch = _Switch()
+
+
+def is_enabled():
+    return _switch.is_enabled()
+
+
+def set_enabled(enabled):
+    """Switch recording on or off for every process sharing the cache; None returns to the setting"""
+    if enabled is None:
+        cache.delete(ENABLED_KEY)
+    else:
+        cache.set(ENABLED_KEY, bool(enabled), timeout=None)
+    _switch.checked_at = None
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                low = self.buckets[index - 1] if index else 0
+                if index == len(self.buckets):
+                    return low  # +Inf bucket: only the lower bound is known
+                return low + (self.buckets[index] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def to_dict(self):
+        return {'counts': self.counts, 'sum': self.sum, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, buckets, data):
+        histogram = cls(buckets)
+        histogram.counts = list(data['counts'])
+        histogram.sum = data['sum']
+        histogram.count = data['count']
+        return histogram
+
+
+class EndpointStats:
+    HISTOGRAMS = {
+        'latency_seconds': LATENCY_BUCKETS,
+        'db_seconds': LATENCY_BUCKETS,
+        'queries': QUERY_BUCKETS,
+        'payload_bytes': SIZE_BUCKETS,
+    }
+    COUNTERS = ('errors', 'duplicate_queries', 'n_plus_one')
+
+    def __init__(self):
+        self.histograms = {name: Histogram(buckets) for name, buckets in self.HISTOGRAMS.items()}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    @property
+    def requests(self):
+        return self.histograms['latency_seconds'].count
+
+    def merge(self, other):
+        for name, histogram in other.histograms.items():
+            self.histograms[name].merge(histogram)
+        for name, value in other.counters.items():
+            self.counters[name] += value
+
+    def to_dict(self):
+        return {
+            'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            'counters': dict(self.counters),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for name, histogram in data['histograms'].items():
+            stats.histograms[name] = Histogram.from_dict(cls.HISTOGRAMS[name], histogram)
+        stats.counters.update(data['counters'])
+        return stats
+
+
+class Registry:
+    """Endpoint statistics of this process"""
+
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        self.process_key = f'instrumentation:snapshot:{socket.gethostname()}:{os.getpid()}'
+        self.published_at = time.monotonic()
+
+    def record(self, recording):
+        with self.lock:
+            stats = self.endpoints.get(recording.endpoint)
+            if stats is None:
+                stats = self.endpoints[recording.endpoint] = EndpointStats()
+            stats.histograms['latency_seconds'].observe(recording.latency)
+            stats.histograms['db_seconds'].observe(recording.db_time)
+            stats.histograms['queries'].observe(recording.query_count)
+            if recording.payload_bytes is not None:
+                stats.histograms['payload_bytes'].observe(recording.payload_bytes)
+            stats.counters['errors'] += recording.error
+            stats.counters['duplicate_queries'] += recording.duplicate_queries
+            stats.counters['n_plus_one'] += bool(recording.repeated_sql)
+        if time.monotonic() - self.published_at >= get_config()['PUBLISH_INTERVAL']:
+            self.publish()
+
+    def endpoints_copy(self):
+        with self.lock:
+            return {endpoint: EndpointStats.from_dict(stats.to_dict()) for endpoint, stats in self.endpoints.items()}
+
+    def snapshot(self):
+        with self.lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in self.endpoints.items()}
+
+    def publish(self):
+        """Save this process's statistics for ``request_metrics``"""
+        self.published_at = time.monotonic()
+        try:
+            cache.set(self.process_key, self.snapshot(), timeout=None)
+            processes = cache.get(PROCESSES_KEY) or []
+            if self.process_key not in processes:
+                cache.set(PROCESSES_KEY, processes + [self.process_key], timeout=None)
+        except Exception as e:
+            logger.error(f"Error publishing request metrics: {str(e)}")
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+
+registry = Registry()
+
+
+def collect_snapshots():
+    """Endpoint statistics of every process that published a snapshot, merged"""
+    merged = {}
+    keys = cache.get(PROCESSES_KEY) or []
+    for snapshot in cache.get_many(keys).values():
+        for endpoint, data in snapshot.items():
+            stats = merged.setdefault(endpoint, EndpointStats())
+            stats.merge(EndpointStats.from_dict(data))
+    return merged
+
+
+def reset_metrics():
+    registry.reset()
+    cache.delete_many((cache.get(PROCESSES_KEY) or []) + [PROCESSES_KEY])
+
+
+class Recording:
+    """Measurements of one request or consumer event; queries also count towards an enclosing recording"""
+
+    def __init__(self, endpoint, parent=None):
+        self.endpoint = endpoint
+        self.parent = parent
+        self.started = time.perf_counter()
+        self.queries = []
+        self.db_time = 0
+        self.latency = 0
+        self.payload_bytes = None
+        self.error = False
+        self.duplicate_queries = 0
+        self.repeated_sql = []
+
+    def add_query(self, sql, params, duration):
+        self.queries.append((sql, repr(params)))
+        self.db_time += duration
+        if self.parent is not None:
+            self.parent.add_query(sql, params, duration)
+
+    def add_payload(self, size):
+        self.payload_bytes = (self.payload_bytes or 0) + size
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    def finish(self, register=True):
+        self.latency = time.perf_counter() - self.started
+        exact = Counter(self.queries)
+        self.duplicate_queries = sum(count - 1 for count in exact.values())
+        threshold = get_config()['N_PLUS_ONE_THRESHOLD']
+        shapes = Counter(SQL_LITERALS.sub('?', sql) for sql, _ in self.queries)
+        self.repeated_sql = [(sql, count) for sql, count in shapes.items() if count >= threshold]
+        if register:
+            for sql, count in self.repeated_sql:
+                logger.warning(f"{self.endpoint} ran the same query {count} times: {sql[:200]}")
+            registry.record(self)
+
+
+def start_recording(endpoint):
+    """Start recording in the current context; returns ``(recording, token)``"""
+    recording = Recording(endpoint, parent=_recording.get())
+    return recording, _recording.set(recording)
+
+
+def stop_recording(recording, token, register=True):
+    """Stop recording; with ``register`` False the results are only kept on ``recording``, and not logged"""
+    _recording.reset(token)
+    recording.finish(register=register)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper feeding the active recording"""
+    recording = _recording.get()
+    if recording is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recording.add_query(sql, params, time.perf_counter() - start)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class InstrumentationMiddleware:
+    """Record query count, DB time, latency and payload size per URL name"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_enabled():
+            return self.get_response(request)
+        recording, token = start_recording('unresolved')
+        try:
+            response = self.get_response(request)
+        except Exception:
+            recording.error = True
+            raise
+        finally:
+            match = getattr(request, 'resolver_match', None)
+            if match is not None:
+                recording.endpoint = match.view_name or match.route
+            _recording.reset(token)
+        recording.error = response.status_code >= 500
+        if not response.streaming:
+            recording.add_payload(len(response.content))
+        recording.finish()
+        return response
+
+
+class InstrumentedConsumerMixin:
+    """Record each message a consumer handles, by consumer and message type"""
+
+    async def dispatch(self, message):
+        if not is_enabled():
+            return await super().dispatch(message)
+        recording, token = start_recording(f"ws:{type(self).__name__}:{message['type']}")
+        try:
+            return await super().dispatch(message)
+        except Exception:
+            recording.error = True
+            raise
+        finally:
+            stop_recording(recording, token)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        recording = _recording.get()
+        if recording is not None:
+            recording.add_payload(len(text_data.encode()) if text_data else len(bytes_data or b''))
+        return await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+
+def format_labels(endpoint, extra=''):
+    endpoint = endpoint.replace('\\', '\\\\').replace('"', '\\"')
+    return f'endpoint="{endpoint}"{extra}'
+
+
+def render_prometheus(endpoints):
+    """Endpoint statistics in the Prometheus text exposition format"""
+    lines = []
+    for name in EndpointStats.HISTOGRAMS:
+        metric = f'langlink_request_{name}'
+        lines.append(f'# TYPE {metric} histogram')
+        for endpoint, stats in sorted(endpoints.items()):
+            histogram = stats.histograms[name]
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                cumulative += count
+                labels = format_labels(endpoint, f',le="{bound}"')
+                lines.append(f'{metric}_bucket{{{labels}}} {cumulative}')
+            lines.append(f'{metric}_sum{{{format_labels(endpoint)}}} {histogram.sum}')
+            lines.append(f'{metric}_count{{{format_labels(endpoint)}}} {histogram.count}')
+    for name in EndpointStats.COUNTERS:
+        metric = f'langlink_request_{name}_total'
+        lines.append(f'# TYPE {metric} counter')
+        for endpoint, stats in sorted(endpoints.items()):
+            lines.append(f'{metric}{{{format_labels(endpoint)}}} {stats.counters[name]}')
+    return '\n'.join(lines) + '\n'
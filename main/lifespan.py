@@ -0,0 +1,50 @@
+"""
+Shutdown of the in-memory work queues.
+
+Chat messages (write-behind), presence states and notifications are
+batched in memory before they are written or sent, so they must be
+flushed when the server stops.
+``LifespanMiddleware`` answers the ASGI ``lifespan`` protocol. On
+``lifespan.shutdown`` it flushes them on the server's event loop, while
+the database settings are still the ones the server ran with.
+
+uvicorn and hypercorn send lifespan events. Daphne does not, but it
+closes every socket on shutdown. A closing consumer waits until its
+messages are saved, and the presence tracker writes once the last socket
+of the process is gone.
+"""
+import logging
+
+from .message_writer import close_message_writer
+from .notifications import close_notification_dispatcher
+from .presence import close_presence_tracker
+
+logger = logging.getLogger(__name__)
+
+
+async def shutdown():
+    """Write everything still queued on the running event loop"""
+    for close in (close_message_writer, close_presence_tracker, close_notification_dispatcher):
+        try:
+            await close()
+        except Exception as e:
+            logger.error(f"Error in {close.__name__} on shutdown: {str(e)}", exc_info=True)
+
+
+class LifespanMiddleware:
+    """ASGI middleware that handles ``lifespan`` scopes and passes everything else on"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await self.app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,214 @@
+"""
+Minimal local stand-in for a Redis server.
+
+It speaks just enough of the Redis protocol (RESP2 and RESP3) for the
+``channels_redis.pubsub.RedisPubSubChannelLayer``: PUBLISH, SUBSCRIBE,
+UNSUBSCRIBE and the connection housekeeping commands redis-py sends.
+That is enough to run the pub/sub channel layer across several worker
+processes in tests and benchmarks without a Redis installation or a
+network. It is not a general purpose Redis replacement: the core
+``RedisChannelLayer`` needs Lua scripting and sorted sets, so point it
+at a real Redis.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+
+def encode(value):
+    """Encode a Python value as a RESP reply"""
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if isinstance(value, (list, tuple)):
+        return b'*%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+    if isinstance(value, dict):
+        return b'%%%d\r\n' % len(value) + b''.join(encode(k) + encode(v) for k, v in value.items())
+    raise TypeError(f"Cannot encode {type(value).__name__} as RESP")
+
+
+def encode_push(items, protocol):
+    """Encode an out-of-band pub/sub frame (a push in RESP3, an array in RESP2)"""
+    frame = encode(list(items))
+    return b'>' + frame[1:] if protocol == 3 else frame
+
+
+OK = b'+OK\r\n'
+
+
+def error(message):
+    return b'-ERR %s\r\n' % message.encode()
+
+
+async def read_command(reader):
+    """Read one client command (an array of bulk strings), or None on EOF"""
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        # Inline command, e.g. "PING\r\n" typed into telnet
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        if not header.startswith(b'$'):
+            raise ValueError(f"Expected bulk string, got {header!r}")
+        length = int(header[1:])
+        data = await reader.readexactly(length + 2)
+        args.append(data[:-2])
+    return args
+
+
+class Session:
+    """State of one client connection"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.protocol = 2
+        self.subscriptions = set()
+
+
+class LocalRedisServer:
+    """
+    Asyncio pub/sub server implementing the subset of Redis used by the
+    pub/sub channel layer.
+
+    Use ``start()``/``stop()`` from a running event loop, or
+    ``start_in_thread()`` to serve from a background thread::
+
+        server = LocalRedisServer()
+        url = server.start_in_thread()
+        ...
+        server.stop_thread()
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self._server = None
+        self._subscribers = defaultdict(set)
+        self._loop = None
+        self._thread = None
+        self.published = 0
+
+    @property
+    def url(self):
+        return f'redis://{self.host}:{self.port}/0'
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.url
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._subscribers.clear()
+
+    def start_in_thread(self):
+        """Serve from a daemon thread with its own event loop and return the URL"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='local-redis', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.url
+
+    def stop_thread(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+            self._thread = None
+
+    async def _handle_client(self, reader, writer):
+        session = Session(writer)
+        try:
+            while True:
+                try:
+                    command = await read_command(reader)
+                except (ValueError, asyncio.IncompleteReadError) as e:
+                    writer.write(error(f'Protocol error: {e}'))
+                    break
+                if command is None:
+                    break
+                if not command:
+                    continue
+                name = command[0].decode().upper()
+                args = command[1:]
+                if name == 'QUIT':
+                    writer.write(OK)
+                    break
+                writer.write(self._execute(name, args, session))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            for channel in session.subscriptions:
+                self._subscribers[channel].discard(session)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+            writer.close()
+
+    def _execute(self, name, args, session):
+        if name == 'HELLO':
+            if args:
+                protocol = int(args[0])
+                if protocol not in (2, 3):
+                    return b'-NOPROTO unsupported protocol version\r\n'
+                session.protocol = protocol
+            info = {
+                'server': 'redis', 'version': '7.0.0', 'proto': session.protocol,
+                'id': id(session), 'mode': 'standalone', 'role': 'master', 'modules': [],
+            }
+            if session.protocol == 3:
+                return encode(info)
+            return encode([item for pair in info.items() for item in pair])
+        if name == 'PING':
+            if session.subscriptions and session.protocol == 2:
+                return encode([b'pong', args[0] if args else b''])
+            return encode(args[0]) if args else b'+PONG\r\n'
+        if name == 'ECHO':
+            return encode(args[0])
+        if name in ('SELECT', 'CLIENT', 'FLUSHALL', 'FLUSHDB'):
+            return OK
+        if name == 'PUBLISH':
+            channel, payload = args
+            receivers = self._subscribers.get(channel, ())
+            for subscriber in list(receivers):
+                subscriber.writer.write(encode_push([b'message', channel, payload], subscriber.protocol))
+            self.published += 1
+            return encode(len(receivers))
+        if name == 'SUBSCRIBE':
+            replies = []
+            for channel in args:
+                session.subscriptions.add(channel)
+                self._subscribers[channel].add(session)
+                replies.append(encode_push([b'subscribe', channel, len(session.subscriptions)], session.protocol))
+            return b''.join(replies)
+        if name == 'UNSUBSCRIBE':
+            replies = []
+            for channel in args or list(session.subscriptions):
+                session.subscriptions.discard(channel)
+                self._subscribers[channel].discard(session)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+                replies.append(encode_push([b'unsubscribe', channel, len(session.subscriptions)], session.protocol))
+            return b''.join(replies) or encode_push([b'unsubscribe', None, 0], session.protocol)
+        return error(f"unknown command '{name}'")
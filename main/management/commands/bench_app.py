@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.app_bench import SCENARIOS, compare, run_app_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Load the HTTP views and the chat WebSocket in-process and report throughput, latency and queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios', choices=SCENARIOS,
+            help='Scenario to run (repeatable; default: all)',
+        )
+        parser.add_argument('--users', type=int, default=50, help='Bench users to log in and spread the load over')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per HTTP scenario')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent HTTP clients')
+        parser.add_argument('--sockets', type=int, default=50, help='Concurrent chat sockets')
+        parser.add_argument('--socket-messages', type=int, default=10, help='Messages sent on each socket')
+        parser.add_argument('--cold', action='store_true', help='Disable the fragment cache')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for picking the users')
+        parser.add_argument('--output', help='Also write the JSON result to this file')
+        parser.add_argument('--compare', help='Earlier JSON result to report changes against')
+        parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+        try:
+            result = run_app_benchmark(
+                scenarios=options['scenarios'] or SCENARIOS,
+                users=options['users'],
+                requests=options['requests'],
+                concurrency=options['concurrency'],
+                sockets=options['sockets'],
+                messages=options['socket_messages'],
+                cold=options['cold'],
+                seed_value=options['seed'],
+            )
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        if baseline is not None:
+            result['changes_pct'] = compare(baseline, result)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(result, f, indent=2)
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        meta = result['meta']
+        self.stdout.write(
+            f"{meta['database']}, {meta['bench_users']} bench users, {meta['users']} logged in, "
+            f"fragment cache {'on' if meta['fragment_cache'] else 'off'}"
+        )
+        for name, scenario in result['scenarios'].items():
+            if name == 'websocket':
+                connect, latency = scenario['connect_ms'], scenario['round_trip_ms']
+                self.stdout.write(
+                    f"{name:<10} {scenario['connected']}/{scenario['sockets']} sockets  "
+                    f"connect p50 {connect['p50']}ms p95 {connect['p95']}ms  "
+                    f"{scenario['throughput_msgs_per_s']} msgs/sec  "
+                    f"round trip p50 {latency['p50']}ms p95 {latency['p95']}ms p99 {latency['p99']}ms  "
+                    f"{scenario['queries_per_socket']['mean']} queries/socket"
+                )
+            else:
+                latency = scenario['latency_ms']
+                self.stdout.write(
+                    f"{name:<10} {scenario['throughput_rps']} req/sec  "
+                    f"p50 {latency['p50']}ms p95 {latency['p95']}ms p99 {latency['p99']}ms  "
+                    f"{scenario['queries']['mean']} queries  {scenario['response_bytes']} bytes"
+                )
+            if scenario.get('errors') or scenario.get('failed') or scenario.get('rejected'):
+                self.stdout.write(self.style.WARNING(f"{name:<10} had errors: {json.dumps(scenario)}"))
+            change = result.get('changes_pct', {}).get(name)
+            if change:
+                self.stdout.write(f"{'':<10} change vs baseline: {json.dumps(change)}")
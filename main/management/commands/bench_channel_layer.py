@@ -0,0 +1,70 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from language_exchange.channel_layers import build_channel_layers
+from main.channel_bench import run_fanout_benchmark
+from main.local_redis import LocalRedisServer
+
+
+class Command(BaseCommand):
+    help = 'Measure channel layer fan-out throughput and delivery latency across worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of receiving worker processes')
+        parser.add_argument('--messages', type=int, default=1000, help='Messages sent to the group')
+        parser.add_argument('--payload-size', type=int, default=128, help='Payload size in bytes')
+        parser.add_argument('--rate', type=float, default=None, help='Limit the producer to this many messages/sec')
+        parser.add_argument(
+            '--backend', choices=['settings', 'redis', 'pubsub'], default='pubsub',
+            help="Layer to benchmark; 'settings' uses CHANNEL_LAYERS as configured",
+        )
+        parser.add_argument(
+            '--url', action='append', dest='urls',
+            help='Redis URL (repeat to shard). Without it a local pub/sub stand-in server is started',
+        )
+        parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+
+    def handle(self, *args, **options):
+        server = None
+        if options['backend'] == 'settings':
+            layer_config = settings.CHANNEL_LAYERS['default']
+        else:
+            urls = options['urls']
+            if not urls:
+                if options['backend'] != 'pubsub':
+                    raise CommandError('The local stand-in server only supports the pubsub backend; pass --url')
+                server = LocalRedisServer()
+                urls = [server.start_in_thread()]
+            layer_config = build_channel_layers(options['backend'], urls)['default']
+
+        if layer_config['BACKEND'].endswith('InMemoryChannelLayer'):
+            raise CommandError('The in-memory channel layer cannot deliver across processes')
+
+        try:
+            result = run_fanout_benchmark(
+                layer_config,
+                workers=options['workers'],
+                messages=options['messages'],
+                payload_size=options['payload_size'],
+                rate=options['rate'],
+            )
+        finally:
+            if server is not None:
+                server.stop_thread()
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        latency = result['latency_ms']
+        self.stdout.write(f"backend     {result['backend']}")
+        self.stdout.write(f"workers     {result['workers']}")
+        self.stdout.write(f"delivered   {result['delivered']}/{result['expected']} in {result['elapsed_s']}s")
+        self.stdout.write(f"throughput  {result['throughput_msgs_per_s']} msgs/sec")
+        self.stdout.write(
+            f"latency     p50 {latency['p50']}ms  p95 {latency['p95']}ms  p99 {latency['p99']}ms  max {latency['max']}ms"
+        )
+        if result['lost']:
+            self.stdout.write(self.style.WARNING(f"{result['lost']} deliveries were lost"))
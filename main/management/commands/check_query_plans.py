@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.query_audit import HOT_QUERIES, AuditNotSupported, audit_hot_queries
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the registered hot queries and fail if any of them needs a full table scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', help='Only audit these queries (default: all)')
+        parser.add_argument('--database', default='default', help='Database alias to explain against')
+        parser.add_argument('--show-plans', action='store_true', help='Print the full plan of every query')
+
+    def handle(self, *args, **options):
+        unknown = set(options['queries']) - set(HOT_QUERIES)
+        if unknown:
+            raise CommandError(f"Unknown hot queries: {', '.join(sorted(unknown))}")
+
+        try:
+            results = audit_hot_queries(using=options['database'], names=options['queries'])
+        except AuditNotSupported as e:
+            raise CommandError(str(e))
+
+        failures = []
+        for name, plan, scanned in results:
+            if scanned:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {name}: {', '.join(scanned)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok         {name}"))
+            if options['show_plans'] or scanned:
+                for line in plan.splitlines():
+                    self.stdout.write(f"    {line}")
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot queries fall back to a full scan: {', '.join(failures)}")
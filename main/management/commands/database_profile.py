@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from language_exchange.databases import describe_database
+
+
+class Command(BaseCommand):
+    help = 'Report the effective database configuration (journal mode, timeouts, pooling) of each connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', dest='aliases', help='Only this alias (repeatable)')
+        parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+
+    def handle(self, *args, **options):
+        descriptions = [describe_database(connections[alias]) for alias in options['aliases'] or connections]
+        if options['json']:
+            self.stdout.write(json.dumps(descriptions, indent=2, default=str))
+            return
+        for description in descriptions:
+            self.stdout.write(self.style.MIGRATE_HEADING(description.pop('alias')))
+            for key, value in description.items():
+                self.stdout.write(f"  {key:<20} {value}")
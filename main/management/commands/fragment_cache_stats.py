@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from main.fragments import fragment_stats, reset_fragment_stats
+
+
+class Command(BaseCommand):
+    help = 'Show fragment cache hits and misses per page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after showing them')
+
+    def handle(self, *args, **options):
+        for scope, stats in fragment_stats().items():
+            self.stdout.write(
+                f"{scope:<10} hits={stats['hits']:<8} misses={stats['misses']:<8} hit rate={stats['hit_rate']:.1%}"
+            )
+        if options['reset']:
+            reset_fragment_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from main.images import process_profile_picture
+from main.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Create the resized avatar variants of profile pictures that have none'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Reprocess every profile picture, not only unprocessed ones')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        if not options['all']:
+            profiles = profiles.filter(profile_picture_variants={})
+        processed = 0
+        for profile_id, name in profiles.values_list('pk', 'profile_picture').iterator():
+            process_profile_picture(profile_id, name)
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} profile pictures"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from main.models import ProgressRollup, ProgressTotal
+
+
+class Command(BaseCommand):
+    help = 'Recompute the ProgressLog daily rollups and lifetime totals from the logs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='Only rebuild this user id (repeatable; default: all users)')
+
+    def handle(self, *args, **options):
+        ProgressRollup.rebuild(user_ids=options['user_ids'])
+        rollups = ProgressRollup.objects.all()
+        totals = ProgressTotal.objects.all()
+        if options['user_ids']:
+            rollups = rollups.filter(user_id__in=options['user_ids'])
+            totals = totals.filter(user_id__in=options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {rollups.count()} rollup rows and {totals.count()} user totals"
+        ))
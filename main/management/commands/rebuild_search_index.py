@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.search import SearchNotSupported, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Reindex all chat messages for full-text search, a batch of rooms at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Rooms reindexed per statement')
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options['verbosity'] > 0 else (lambda message: None)
+        try:
+            counts = rebuild_index(batch_size=options['batch_size'], log=log)
+        except SearchNotSupported as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Reindexed {counts['messages']} messages in {counts['rooms']} rooms"))
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+
+from main.instrumentation import collect_snapshots, reset_metrics, set_enabled
+
+SORT_KEYS = {
+    'latency': lambda stats: stats.histograms['latency_seconds'].quantile(0.95),
+    'queries': lambda stats: stats.histograms['queries'].sum / stats.requests,
+    'db': lambda stats: stats.histograms['db_seconds'].sum,
+    'requests': lambda stats: stats.requests,
+    'bytes': lambda stats: stats.histograms['payload_bytes'].sum,
+}
+
+
+class Command(BaseCommand):
+    help = 'Print the endpoints with the highest cost from the request instrumentation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Number of endpoints to show')
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='db',
+                            help='latency (p95), queries (average), db (total time), requests or bytes (total)')
+        switch = parser.add_mutually_exclusive_group()
+        switch.add_argument('--enable', action='store_true', help='Start recording in every process sharing the cache')
+        switch.add_argument('--disable', action='store_true', help='Stop recording')
+        switch.add_argument('--default', action='store_true', help='Go back to INSTRUMENTATION["ENABLED"]')
+        parser.add_argument('--reset', action='store_true', help='Clear the published statistics')
+
+    def handle(self, *args, **options):
+        if options['enable'] or options['disable'] or options['default']:
+            set_enabled(None if options['default'] else options['enable'])
+            self.stdout.write(self.style.SUCCESS('Instrumentation switch updated'))
+            return
+        if options['reset']:
+            reset_metrics()
+            self.stdout.write(self.style.SUCCESS('Statistics cleared'))
+            return
+
+        endpoints = [(endpoint, stats) for endpoint, stats in collect_snapshots().items() if stats.requests]
+        if not endpoints:
+            self.stdout.write('No statistics published yet')
+            return
+        endpoints.sort(key=lambda item: SORT_KEYS[options['sort']](item[1]), reverse=True)
+
+        self.stdout.write(
+            f"{'endpoint':<40} {'requests':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'queries':>8} {'db ms':>8} {'KiB':>8} {'dups':>6} {'n+1':>5} {'errors':>6}"
+        )
+        for endpoint, stats in endpoints[:options['top']]:
+            latency = stats.histograms['latency_seconds']
+            requests = stats.requests
+            self.stdout.write(
+                f"{endpoint[:40]:<40} {requests:>8} "
+                f"{latency.quantile(0.5) * 1000:>8.1f} {latency.quantile(0.95) * 1000:>8.1f} "
+                f"{latency.quantile(0.99) * 1000:>8.1f} "
+                f"{stats.histograms['queries'].sum / requests:>8.1f} "
+                f"{stats.histograms['db_seconds'].sum / requests * 1000:>8.2f} "
+                f"{stats.histograms['payload_bytes'].sum / max(stats.histograms['payload_bytes'].count, 1) / 1024:>8.1f} "
+                f"{stats.counters['duplicate_queries']:>6} {stats.counters['n_plus_one']:>5} "
+                f"{stats.counters['errors']:>6}"
+            )
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from main.bench_data import bench_users, clear, seed
+
+
+class Command(BaseCommand):
+    help = 'Create (or delete) the synthetic bench_* users, rooms, messages and progress logs used by bench_app'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to create')
+        parser.add_argument('--messages', type=int, default=100000, help='Messages to create across all rooms')
+        parser.add_argument('--rooms-per-user', type=int, default=4, help='Approximate number of rooms per user')
+        parser.add_argument('--logs-per-user', type=int, default=20, help='Progress logs per user')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed creates the same data')
+        parser.add_argument('--clear', action='store_true', help='Delete the existing bench data and exit')
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options['verbosity'] > 1 else (lambda message: None)
+        if options['clear']:
+            clear(log=self.stdout.write)
+            return
+        counts = seed(
+            users=options['users'],
+            messages=options['messages'],
+            rooms_per_user=options['rooms_per_user'],
+            logs_per_user=options['logs_per_user'],
+            seed_value=options['seed'],
+            log=log,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Created {json.dumps(counts)}; {bench_users().count()} bench users in total"))
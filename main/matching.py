@@ -0,0 +1,172 @@
+"""
+Partner matching engine.
+
+Profiles are bucketed by ``(native_language, learning_language)``. A user's
+partners are exactly the profiles in the mirrored bucket, so matching
+never looks at other language pairs. Each bucket is ranked once and the
+ranked user ids are cached. The ranking puts online users (from
+``main.presence``) first, then weighs how recently the user was seen and
+how much they studied in the last ``ACTIVITY_DAYS`` days. On top of that,
+pages of a user's matches are cached per user.
+
+Buckets are versioned. Saving a profile with new languages, or deleting
+one, bumps the version of the buckets it left and joined. That makes
+every cached bucket and page built from them unreachable. Ranking inputs
+like ``last_seen`` change all the time and are only refreshed when the
+cache entries expire after ``CACHE_TIMEOUT`` seconds.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .presence import apply_presence, online_user_ids
+
+DEFAULTS = {
+    'PAGE_SIZE': 12,
+    'CACHE_TIMEOUT': 300,
+    'MAX_CANDIDATES': 1000,
+    'ACTIVITY_DAYS': 30,
+}
+
+# Ranking weights: being online outweighs any recency/activity difference
+ONLINE_WEIGHT = 2.0
+RECENCY_HALF_LIFE_HOURS = 24
+ACTIVITY_TARGET_MINUTES = 300
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'MATCHING', {})}
+
+
+def get_page_number(value):
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def _version_key(native, learning):
+    return f'matching:version:{native}:{learning}'
+
+
+def get_bucket_version(native, learning):
+    key = _version_key(native, learning)
+    version = cache.get(key)
+    if version is None:
+        # Start from a fresh value so entries from an evicted version are never reused
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_bucket(native, learning):
+    """Drop the cached ranking and pages built from one bucket"""
+    if not native or not learning:
+        return
+    try:
+        cache.incr(_version_key(native, learning))
+    except ValueError:
+        cache.set(_version_key(native, learning), time.time_ns(), timeout=None)
+
+
+def match_score(is_online, last_seen, recent_minutes, now):
+    hours = max((now - last_seen).total_seconds() / 3600, 0)
+    recency = 0.5 ** (hours / RECENCY_HALF_LIFE_HOURS)
+    activity = min(recent_minutes / ACTIVITY_TARGET_MINUTES, 1.0)
+    return (ONLINE_WEIGHT if is_online else 0) + recency + activity
+
+
+def rank_bucket(native, learning):
+    """Ranked user ids of the active profiles in one bucket, best first"""
+    from .models import Profile
+
+    config = get_config()
+    now = timezone.now()
+    since = now.date() - timedelta(days=config['ACTIVITY_DAYS'])
+    rows = list(Profile.objects.filter(
+        native_language=native,
+        learning_language=learning,
+        user__is_active=True,
+    ).annotate(
+        recent_minutes=Coalesce(
+            Sum('user__progress_logs__minutes_studied', filter=Q(user__progress_logs__date__gte=since)),
+            0,
+        )
+    ).values_list('user_id', 'last_seen', 'recent_minutes'))
+    online = online_user_ids(row[0] for row in rows)
+
+    ranked = sorted(
+        rows,
+        key=lambda row: (-match_score(row[0] in online, row[1], row[2], now), row[0]),
+    )
+    return [row[0] for row in ranked[:config['MAX_CANDIDATES']]]
+
+
+def get_bucket(native, learning):
+    config = get_config()
+    key = f'matching:bucket:{native}:{learning}:{get_bucket_version(native, learning)}'
+    user_ids = cache.get(key)
+    if user_ids is None:
+        user_ids = rank_bucket(native, learning)
+        cache.set(key, user_ids, timeout=config['CACHE_TIMEOUT'])
+    return user_ids
+
+
+def get_match_entry(profile, page=1, page_size=None):
+    """
+    Ranked user ids of one page of partners for ``profile``, from the cache.
+
+    Returns a dict with ``user_ids``, ``page``, ``has_next``, ``has_previous``
+    and ``total``; no profiles are loaded.
+    """
+    config = get_config()
+    page = get_page_number(page)
+    page_size = page_size or config['PAGE_SIZE']
+    # Partners speak what the user learns and learn what the user speaks
+    native, learning = profile.learning_language, profile.native_language
+    if not native or not learning:
+        return {'user_ids': [], 'page': 1, 'has_next': False, 'has_previous': False, 'total': 0}
+
+    version = get_bucket_version(native, learning)
+    key = f'matching:page:{profile.user_id}:{native}:{learning}:{version}:{page}:{page_size}'
+    entry = cache.get(key)
+    if entry is None:
+        user_ids = [user_id for user_id in get_bucket(native, learning) if user_id != profile.user_id]
+        start = (page - 1) * page_size
+        entry = {
+            'user_ids': user_ids[start:start + page_size],
+            'has_next': len(user_ids) > start + page_size,
+            'total': len(user_ids),
+        }
+        cache.set(key, entry, timeout=config['CACHE_TIMEOUT'])
+    return {**entry, 'page': page, 'has_previous': page > 1}
+
+
+def load_match_page(entry):
+    """Turn a ``get_match_entry`` result into a page of Profiles with their users"""
+    from .models import Profile
+
+    profiles = Profile.objects.select_related('user').in_bulk(entry['user_ids'], field_name='user_id')
+    matches = apply_presence(profiles[user_id] for user_id in entry['user_ids'] if user_id in profiles)
+    return {
+        'matches': matches,
+        'page': entry['page'],
+        'has_next': entry['has_next'],
+        'has_previous': entry['has_previous'],
+        'total': entry['total'],
+    }
+
+
+def get_match_page(profile, page=1, page_size=None):
+    """
+    One page of ranked partners for ``profile``.
+
+    Returns a dict with ``matches`` (Profiles with their users), ``page``,
+    ``has_next``, ``has_previous`` and ``total``.
+    """
+    return load_match_page(get_match_entry(profile, page=page, page_size=page_size))
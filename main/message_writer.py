@@ -0,0 +1,244 @@
+"""
+Write-behind persistence for chat messages.
+
+Consumers hand messages to a process-wide ``MessageWriter`` instead of
+inserting them one by one. The writer coalesces everything submitted
+within ``FLUSH_INTERVAL`` seconds (or ``MAX_BATCH`` messages) into a single
+``bulk_create`` inside one transaction, so a burst of frames costs one
+thread-pool hop and one SQLite write lock instead of one per message.
+
+``submit`` returns a future that resolves to the saved ``Message`` once
+its batch has committed. When ``MAX_PENDING`` messages are waiting,
+``submit`` blocks, which applies backpressure to the sending sockets.
+
+Nothing is written at interpreter exit, when the database settings may
+no longer be the server's. Consumers wait for their own messages to be
+acknowledged when their socket closes, which covers a server that closes
+every socket on shutdown. The ASGI lifespan shutdown closes the writer
+(see main/lifespan.py). A writer belongs to one event loop and is dropped
+once that loop is closed.
+
+Messages submitted with a ``client_id`` are registered in the dedup
+window (main/idempotency.py), so a retry can wait for the same future.
+A batch never inserts a ``(sender, client_id)`` that is already saved.
+"""
+import asyncio
+import logging
+import weakref
+from collections import deque
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .idempotency import get_dedup_window
+from .models import ChatRoom, Message, messages_bulk_created
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_BATCH': 100,
+    'FLUSH_INTERVAL': 0.05,
+    'MAX_PENDING': 1000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_WRITE_BEHIND', {})}
+
+
+def persist_messages(items):
+    """
+    Insert a batch of ``(room_id, sender_id, content, client_id)`` tuples and
+    return the saved messages, in the order of ``items``.
+
+    An item whose sender already saved its ``client_id`` resolves to the
+    existing message and is not inserted again. That includes a row saved
+    by another process between the lookup and the insert: the unique
+    constraint rejects the insert, and the batch is retried without the
+    conflicting items instead of being lost.
+    """
+    with transaction.atomic():
+        saved = _saved_submissions(items)
+        while True:
+            messages, created = _resolve_batch(items, saved)
+            try:
+                # A savepoint, so a conflict only undoes this insert
+                with transaction.atomic():
+                    if created:
+                        Message.objects.bulk_create(created)
+                break
+            except IntegrityError:
+                found = _saved_submissions(items)
+                if found.keys() <= saved.keys():
+                    # Not a client id conflict
+                    raise
+                logger.info(f"Resolved {len(found) - len(saved)} concurrently saved messages in a batch")
+                saved = found
+        if created:
+            ChatRoom.objects.filter(id__in={message.room_id for message in created}).update(
+                last_updated=timezone.now()
+            )
+            # bulk_create bypasses post_save, so run the per-message side effects here
+            messages_bulk_created.send(sender=Message, messages=created)
+    return messages
+
+
+def _resolve_batch(items, saved):
+    """The messages for ``items``, and those of them to insert; ``saved`` maps keys to existing messages"""
+    by_key = dict(saved)
+    messages, created = [], []
+    for room_id, sender_id, content, client_id in items:
+        key = (sender_id, client_id)
+        if client_id is not None and key in by_key:
+            messages.append(by_key[key])
+            continue
+        message = Message(room_id=room_id, sender_id=sender_id, content=content, client_id=client_id)
+        messages.append(message)
+        created.append(message)
+        if client_id is not None:
+            by_key[key] = message
+    return messages, created
+
+
+def _saved_submissions(items):
+    """Messages already saved under the ``(sender_id, client_id)`` keys of ``items``"""
+    keys = {(sender_id, client_id) for _, sender_id, _, client_id in items if client_id is not None}
+    if not keys:
+        return {}
+    saved = Message.objects.filter(
+        sender_id__in={sender_id for sender_id, _ in keys},
+        client_id__in={client_id for _, client_id in keys},
+    )
+    return {(message.sender_id, message.client_id): message for message in saved
+            if (message.sender_id, message.client_id) in keys}
+
+
+class PendingMessage:
+    __slots__ = ('room_id', 'sender_id', 'content', 'client_id', 'future')
+
+    def __init__(self, room_id, sender_id, content, client_id, future):
+        self.room_id = room_id
+        self.sender_id = sender_id
+        self.content = content
+        self.client_id = client_id
+        self.future = future
+
+    def as_item(self):
+        return self.room_id, self.sender_id, self.content, self.client_id
+
+
+class MessageWriter:
+    def __init__(self, max_batch=100, flush_interval=0.05, max_pending=1000):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._pending = deque()
+        self._slots = asyncio.Semaphore(max_pending)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closed = False
+
+    async def submit(self, room_id, sender_id, content, client_id=None):
+        """Queue a message and return a future resolving to the saved Message"""
+        if self._closed:
+            raise RuntimeError('MessageWriter is closed')
+        await self._slots.acquire()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(PendingMessage(room_id, sender_id, content, client_id, future))
+        if client_id is not None:
+            get_dedup_window().remember(sender_id, client_id, future)
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        self._ensure_running()
+        return future
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            if len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self._flush_batch()
+
+    async def _flush_batch(self):
+        batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+        if not batch:
+            return
+        try:
+            messages = await database_sync_to_async(persist_messages)([item.as_item() for item in batch])
+        except Exception as e:
+            logger.error(f"Error persisting batch of {len(batch)} messages: {str(e)}", exc_info=True)
+            window = get_dedup_window()
+            for item in batch:
+                # A retry of a failed message is a new attempt
+                if item.client_id is not None:
+                    window.forget(item.sender_id, item.client_id)
+                if not item.future.done():
+                    item.future.set_exception(e)
+        else:
+            window = get_dedup_window()
+            for item, message in zip(batch, messages):
+                if item.client_id is not None:
+                    window.remember(item.sender_id, item.client_id, message)
+                if not item.future.done():
+                    item.future.set_result(message)
+        finally:
+            for _ in batch:
+                self._slots.release()
+
+    async def flush(self):
+        """Write everything that is currently pending"""
+        while self._pending:
+            await self._flush_batch()
+
+    async def close(self):
+        """Refuse new messages and write the pending ones"""
+        self._closed = True
+        await self.flush()
+        if self._task is not None:
+            await self._task
+
+
+# Weak keys let a loop that is garbage collected take its writer along;
+# a closed loop that is still referenced is evicted on the next lookup
+_writers = weakref.WeakKeyDictionary()
+
+
+def _evict_closed_loops():
+    for loop in [loop for loop in _writers if loop.is_closed()]:
+        writer = _writers.pop(loop)
+        if writer._pending:
+            logger.error(f"Dropping {len(writer._pending)} messages queued on a closed event loop")
+
+
+def get_message_writer():
+    """Return the writer for the running event loop, or None when write-behind is disabled"""
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+    loop = asyncio.get_running_loop()
+    _evict_closed_loops()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = _writers[loop] = MessageWriter(
+            max_batch=config['MAX_BATCH'],
+            flush_interval=config['FLUSH_INTERVAL'],
+            max_pending=config['MAX_PENDING'],
+        )
+    return writer
+
+
+
+async def close_message_writer():
+    """Write and drop the writer of the running event loop, if it has one"""
+    writer = _writers.pop(asyncio.get_running_loop(), None)
+    if writer is not None:
+        await writer.close()
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_memberships(apps, schema_editor):
+    """Create a membership per existing participant with its current unread count"""
+    ChatRoom = apps.get_model('main', 'ChatRoom')
+    Message = apps.get_model('main', 'Message')
+    RoomMembership = apps.get_model('main', 'RoomMembership')
+
+    memberships = []
+    for room_id, user_id in ChatRoom.participants.through.objects.values_list('chatroom_id', 'user_id').iterator():
+        others = Message.objects.filter(room_id=room_id).exclude(sender_id=user_id)
+        unread_count = others.filter(is_read=False).count()
+        last_read = others.filter(is_read=True).order_by('-timestamp', '-id').values_list('id', flat=True).first()
+        memberships.append(RoomMembership(
+            room_id=room_id,
+            user_id=user_id,
+            unread_count=unread_count,
+            last_read_message_id=last_read,
+        ))
+    RoomMembership.objects.bulk_create(memberships, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_message_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('joined_at', models.DateTimeField(auto_now_add=True)),
+                ('last_read_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.message')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='main.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('unread_count__gt', 0)), fields=['user'], name='membership_user_unread_idx')],
+                'unique_together': {('room', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_memberships, migrations.RunPython.noop),
+    ]
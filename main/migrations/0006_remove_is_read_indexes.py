@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_roommembership'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_room_unread_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_receiver_unread_idx',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_remove_is_read_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['native_language', 'learning_language'], name='profile_language_pair_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rollups(apps, schema_editor):
+    """Aggregate the existing progress logs into rollups and lifetime totals"""
+    ProgressLog = apps.get_model('main', 'ProgressLog')
+    ProgressRollup = apps.get_model('main', 'ProgressRollup')
+    ProgressTotal = apps.get_model('main', 'ProgressTotal')
+    totals = dict(sessions=Count('id'), minutes_studied=Sum('minutes_studied'), words_learned=Sum('words_learned'))
+    logs = ProgressLog.objects.order_by()
+    ProgressRollup.objects.bulk_create([
+        ProgressRollup(**row)
+        for row in logs.values('user_id', 'date', 'language', 'activity_type').annotate(**totals)
+    ], batch_size=1000)
+    ProgressTotal.objects.bulk_create([
+        ProgressTotal(**row) for row in logs.values('user_id').annotate(**totals)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_profile_language_pair_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgressTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sessions', models.IntegerField(default=0)),
+                ('minutes_studied', models.IntegerField(default=0)),
+                ('words_learned', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='progress_total', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProgressRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('language', models.CharField(choices=[('en', 'English'), ('es', 'Spanish'), ('fr', 'French'), ('de', 'German'), ('it', 'Italian'), ('pt', 'Portuguese'), ('ru', 'Russian'), ('zh', 'Chinese'), ('ja', 'Japanese'), ('ko', 'Korean'), ('hi', 'Hindi')], max_length=2)),
+                ('activity_type', models.CharField(choices=[('chat', 'Chat'), ('lesson', 'Lesson'), ('practice', 'Speaking Practice'), ('vocab', 'Vocabulary'), ('grammar', 'Grammar'), ('other', 'Other')], max_length=20)),
+                ('sessions', models.IntegerField(default=0)),
+                ('minutes_studied', models.IntegerField(default=0)),
+                ('words_learned', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'date', 'language', 'activity_type'), name='progress_rollup_key')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_progressrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PracticeSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(max_length=100)),
+                ('session_type', models.CharField(choices=[('chat', 'Chat'), ('voice', 'Voice Call'), ('video', 'Video Call'), ('other', 'Other')], max_length=50)),
+                ('duration_minutes', models.PositiveIntegerField(help_text='Duration in minutes')),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='practice_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LanguageProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(max_length=100)),
+                ('level', models.CharField(choices=[('beginner', 'Beginner'), ('elementary', 'Elementary'), ('intermediate', 'Intermediate'), ('upper_intermediate', 'Upper Intermediate'), ('advanced', 'Advanced'), ('native', 'Native')], max_length=50)),
+                ('proficiency', models.PositiveIntegerField(default=0, help_text='Proficiency percentage (0-100)')),
+                ('minutes_practiced', models.PositiveIntegerField(default=0)),
+                ('hours_practiced', models.FloatField(default=0)),
+                ('words_learned', models.PositiveIntegerField(default=0)),
+                ('last_practiced', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='language_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Language Progress',
+                'unique_together': {('user', 'language')},
+            },
+        ),
+    ]
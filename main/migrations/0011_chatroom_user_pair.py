@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:22
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def merge_duplicate_rooms(apps, schema_editor):
+    """
+    Set the pair key of every 1:1 room. Rooms of the same two users are
+    merged into the oldest one: messages move over, and the unread
+    counters and read watermarks of both users are combined.
+
+    Rooms left with a single participant (the other user was deleted)
+    and group rooms keep no pair key. A key (x, x) would make the room
+    come up as user x's chat with themselves.
+    """
+    ChatRoom = apps.get_model('main', 'ChatRoom')
+    Message = apps.get_model('main', 'Message')
+    RoomMembership = apps.get_model('main', 'RoomMembership')
+
+    participants = defaultdict(set)
+    for room_id, user_id in ChatRoom.participants.through.objects.values_list('chatroom_id', 'user_id'):
+        participants[room_id].add(user_id)
+    rooms_by_pair = defaultdict(list)
+    for room_id, user_ids in participants.items():
+        if len(user_ids) == 2:
+            rooms_by_pair[tuple(sorted(user_ids))].append(room_id)
+
+    keyed = []
+    for (user_a, user_b), room_ids in rooms_by_pair.items():
+        keep, *duplicates = sorted(room_ids)
+        keyed.append(ChatRoom(id=keep, user_a_id=user_a, user_b_id=user_b))
+        if not duplicates:
+            continue
+        Message.objects.filter(room_id__in=duplicates).update(room_id=keep)
+        for user_id in {user_a, user_b}:
+            merged = RoomMembership.objects.filter(room_id__in=room_ids, user_id=user_id).aggregate(
+                unread_count=models.Sum('unread_count'),
+                last_read_message_id=Max('last_read_message_id'),
+            )
+            RoomMembership.objects.update_or_create(room_id=keep, user_id=user_id, defaults={
+                'unread_count': merged['unread_count'] or 0,
+                'last_read_message_id': merged['last_read_message_id'],
+            })
+        last_updated = ChatRoom.objects.filter(id__in=room_ids).aggregate(latest=Max('last_updated'))['latest']
+        ChatRoom.objects.filter(id__in=duplicates).delete()
+        ChatRoom.objects.filter(id=keep).update(last_updated=last_updated)
+    ChatRoom.objects.bulk_update(keyed, ['user_a', 'user_b'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    # The data step commits on its own before the constraints are added.
+    # In one transaction PostgreSQL refuses the ALTER TABLE: the deferred
+    # foreign key checks of the moved rows would still be pending.
+    atomic = False
+
+    dependencies = [
+        ('main', '0010_profile_picture_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='user_a',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='user_b',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(merge_duplicate_rooms, migrations.RunPython.noop, atomic=True),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(fields=('user_a', 'user_b'), name='chatroom_user_pair_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.CheckConstraint(condition=models.Q(('user_a__lte', models.F('user_b'))), name='chatroom_user_pair_ordered'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:40
+
+from django.db import migrations
+
+# Triggers keep the index in step with every write, including bulk_create,
+# queryset updates and cascading deletes, which send no model signals.
+SQLITE_FORWARDS = [
+    """
+    CREATE VIRTUAL TABLE main_message_fts USING fts5(
+        content, content='main_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER main_message_fts_insert AFTER INSERT ON main_message BEGIN
+        INSERT INTO main_message_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER main_message_fts_delete AFTER DELETE ON main_message BEGIN
+        INSERT INTO main_message_fts(main_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER main_message_fts_update AFTER UPDATE OF content ON main_message BEGIN
+        INSERT INTO main_message_fts(main_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO main_message_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO main_message_fts(main_message_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARDS = [
+    'DROP TRIGGER IF EXISTS main_message_fts_insert',
+    'DROP TRIGGER IF EXISTS main_message_fts_delete',
+    'DROP TRIGGER IF EXISTS main_message_fts_update',
+    'DROP TABLE IF EXISTS main_message_fts',
+]
+
+POSTGRESQL_FORWARDS = [
+    'ALTER TABLE main_message ADD COLUMN search_vector tsvector',
+    """
+    CREATE TRIGGER main_message_search_vector BEFORE INSERT OR UPDATE OF content ON main_message
+    FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, 'pg_catalog.simple', content)
+    """,
+    "UPDATE main_message SET search_vector = to_tsvector('pg_catalog.simple', content)",
+    'CREATE INDEX main_message_search_vector_idx ON main_message USING GIN (search_vector)',
+]
+POSTGRESQL_BACKWARDS = [
+    'DROP TRIGGER IF EXISTS main_message_search_vector ON main_message',
+    'ALTER TABLE main_message DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_chatroom_user_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARDS, 'postgresql': POSTGRESQL_FORWARDS}),
+            run({'sqlite': SQLITE_BACKWARDS, 'postgresql': POSTGRESQL_BACKWARDS}),
+        ),
+    ]
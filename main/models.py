@@ -1,12 +1,16 @@
 import os
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Greatest
 from django.utils import timezone
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
+from collections import Counter
+from .fragments import bucket_name, bump_on_commit
+from .images import delete_files, schedule_profile_picture, variant_names
+from .matching import invalidate_bucket
+from .notifications import publish_message_created, publish_read_receipt
 
 
 def user_profile_picture_path(instance, filename):
@@ -17,9 +21,18 @@ class ChatRoom(models.Model):
     """Chat room for private messaging"""
     name = models.CharField(max_length=255, unique=True)
     participants = models.ManyToManyField(User, related_name='chat_rooms')
+    # Canonical key of a 1:1 room: its two users, lower id first
+    user_a = models.ForeignKey(User, related_name='+', null=True, blank=True, on_delete=models.CASCADE)
+    user_b = models.ForeignKey(User, related_name='+', null=True, blank=True, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_a', 'user_b'], name='chatroom_user_pair_key'),
+            models.CheckConstraint(condition=Q(user_a__lte=F('user_b')), name='chatroom_user_pair_ordered'),
+        ]
+
     def __str__(self):
         usernames = [user.username for user in self.participants.all()]
         return f"Chat {self.id}: {', '.join(usernames)}" if usernames else f"Chat {self.id}: No participants"
@@ -30,27 +43,106 @@ class ChatRoom(models.Model):
         
     @classmethod
     def get_or_create_for_users(cls, user1, user2):
-        """Get or create a chat room for two users"""
-        # Create a unique room name by sorting user IDs to ensure consistency
-        user_ids = sorted([str(user1.id), str(user2.id)])
-        room_name = f"chat_{'_'.join(user_ids)}"
-        
-        # Try to get existing room with these participants
-        room = cls.objects.filter(
-            name=room_name,
-            participants=user1
-        ).filter(
-            participants=user2
-        ).first()
-        
-        # If room doesn't exist, create it
-        if not room:
-            room = cls.objects.create(name=room_name)
-            room.participants.add(user1, user2)
-            
+        """
+        Get or create the chat room of two users.
+
+        An existing room is found with one lookup on the unique pair key.
+        When two requests create the same room at once, the constraint
+        rejects the second insert and that request reads the winner's room.
+        """
+        user_a, user_b = sorted((user1.pk, user2.pk))
+        room = cls.objects.filter(user_a_id=user_a, user_b_id=user_b).first()
+        if room:
+            return room
+        try:
+            with transaction.atomic():
+                room = cls.objects.create(name=f'chat_{user_a}_{user_b}', user_a_id=user_a, user_b_id=user_b)
+                room.participants.add(user_a, user_b)
+        except IntegrityError:
+            room = cls.objects.get(user_a_id=user_a, user_b_id=user_b)
         return room
 
 
+class RoomMembership(models.Model):
+    """Per-participant state of a chat room: unread counter and read watermark"""
+    room = models.ForeignKey(ChatRoom, related_name='memberships', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='room_memberships', on_delete=models.CASCADE)
+    unread_count = models.PositiveIntegerField(default=0)
+    last_read_message = models.ForeignKey(
+        'Message', related_name='+', null=True, blank=True, on_delete=models.SET_NULL
+    )
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('room', 'user')
+        indexes = [
+            models.Index(
+                fields=['user'],
+                condition=Q(unread_count__gt=0),
+                name='membership_user_unread_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} in chat {self.room_id} ({self.unread_count} unread)"
+
+    @classmethod
+    def increment_unread(cls, room_id, sender_id, count=1):
+        """Add ``count`` new messages to every other participant's counter"""
+        return cls.objects.filter(room_id=room_id).exclude(user_id=sender_id).update(
+            unread_count=F('unread_count') + count
+        )
+
+    @classmethod
+    def mark_read(cls, room_id, user_id, publish=True):
+        """
+        Reset the user's counter and move the read watermark to the newest
+        message from another participant.
+
+        Returns the new watermark id, or None when everything was already
+        read; in that case nothing is written, so repeated page loads and
+        polls stay read-only. When the watermark moves and ``publish`` is
+        set, a read receipt is pushed to the room's sockets.
+        """
+        latest_incoming = Message.objects.filter(room_id=OuterRef('room_id')).exclude(
+            sender_id=user_id
+        ).order_by('-timestamp', '-id').values('id')[:1]
+        membership = cls.objects.filter(room_id=room_id, user_id=user_id).annotate(
+            latest_id=Subquery(latest_incoming)
+        ).values('id', 'unread_count', 'last_read_message_id', 'latest_id').first()
+        if membership is None or membership['latest_id'] is None:
+            return None
+        latest_id = membership['latest_id']
+        # Decide with a read first: even an UPDATE matching no rows takes
+        # SQLite's write lock
+        if membership['unread_count'] == 0 and (membership['last_read_message_id'] or 0) >= latest_id:
+            return None
+        # Subtract what was read rather than zeroing, so messages counted
+        # after the read above stay unread
+        cls.objects.filter(id=membership['id']).update(
+            unread_count=Greatest(F('unread_count') - membership['unread_count'], 0),
+            last_read_message_id=latest_id,
+        )
+        bump_on_commit('inbox', [user_id])
+        if publish:
+            publish_read_receipt(room_id, user_id, latest_id)
+        return latest_id
+
+    @classmethod
+    def peer_read_watermark(cls, room_id, user_id):
+        """Id of the last message the other participant has read (0 if none)"""
+        return cls.objects.filter(room_id=room_id).exclude(user_id=user_id).values_list(
+            'last_read_message_id', flat=True
+        ).first() or 0
+
+    @classmethod
+    def total_unread(cls, user):
+        """Total unread messages across all of the user's rooms"""
+        return cls.objects.filter(user=user, unread_count__gt=0).aggregate(
+            total=Sum('unread_count')
+        )['total'] or 0
+
+
 class Profile(models.Model):
     """User profile with language preferences and additional info"""
     LANGUAGES = [
@@ -72,20 +164,45 @@ class Profile(models.Model):
     learning_language = models.CharField(max_length=2, choices=LANGUAGES)
     bio = models.TextField(max_length=500, blank=True)
     profile_picture = models.ImageField(upload_to=user_profile_picture_path, null=True, blank=True)
+    # Processed avatar files by size and format, see main/images.py
+    profile_picture_variants = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_online = models.BooleanField(default=False)
     last_seen = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # Matching buckets
+            models.Index(fields=['native_language', 'learning_language'], name='profile_language_pair_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
-    def get_potential_matches(self):
-        """Find users who want to learn your native language and speak your target language"""
-        return Profile.objects.filter(
-            native_language=self.learning_language,
-            learning_language=self.native_language
-        ).exclude(user=self.user)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded bucket so a language change can invalidate it
+        instance._loaded_languages = (
+            instance.__dict__.get('native_language'),
+            instance.__dict__.get('learning_language'),
+        )
+        instance._loaded_picture = instance.__dict__.get('profile_picture') or ''
+        return instance
+
+    def get_potential_matches(self, page=1, page_size=None):
+        """Ranked page of users who want to learn your native language and speak your target language"""
+        from .matching import get_match_page
+        return get_match_page(self, page=page, page_size=page_size)
+
+    def is_potential_match(self, other):
+        """Whether the ``other`` profile is one of this user's partners, without a query"""
+        return (
+            other.user_id != self.user_id
+            and other.native_language == self.learning_language
+            and other.learning_language == self.native_language
+        )
 
 
 class Message(models.Model):
@@ -98,17 +215,41 @@ class Message(models.Model):
     receiver = models.ForeignKey(User, related_name='received_messages', null=True, blank=True, on_delete=models.SET_NULL)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Superseded by RoomMembership.last_read_message; no longer updated
     is_read = models.BooleanField(default=False)
+    # Idempotency key chosen by the sending client; a retried submission
+    # with the same key resolves to this message (see main/idempotency.py)
+    client_id = models.CharField(max_length=64, null=True, blank=True)
     
     class Meta:
         ordering = ['timestamp']
-        
-    def mark_as_read(self):
-        if not self.is_read:
-            self.is_read = True
-            self.save(update_fields=['is_read'])
-            return True
-        return False
+        indexes = [
+            # Room history windows and latest-message lookups
+            models.Index(fields=['room', 'timestamp', 'id'], name='message_room_ts_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sender', 'client_id'],
+                condition=Q(client_id__isnull=False),
+                name='message_sender_client_id_key',
+            ),
+        ]
+
+    @classmethod
+    def get_or_create_submission(cls, room, sender, content, client_id=None):
+        """Save a submitted message once per ``client_id``; returns ``(message, created)``"""
+        if client_id is not None:
+            message = cls.objects.filter(sender=sender, client_id=client_id).first()
+            if message:
+                return message, False
+        try:
+            with transaction.atomic():
+                return cls.objects.create(room=room, sender=sender, content=content, client_id=client_id), True
+        except IntegrityError:
+            if client_id is None:
+                raise
+            # Saved concurrently since the lookup above
+            return cls.objects.get(sender=sender, client_id=client_id), False
 
 
 class ProgressLog(models.Model):
@@ -145,57 +286,338 @@ class ProgressLog(models.Model):
     def __str__(self):
         return f"{self.user.username}'s {self.get_activity_type_display()} on {self.date}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the log contributed to the rollups when it was loaded
+        instance._rollup_contribution = instance.rollup_contribution()
+        return instance
+
+    def rollup_contribution(self):
+        """``(key, minutes, words)`` this log adds to ProgressRollup"""
+        key = (self.user_id, self.date, self.language, self.activity_type)
+        return key, self.minutes_studied, self.words_learned
+
     @classmethod
     def get_weekly_summary(cls, user):
         """Get weekly summary of user's progress"""
         today = timezone.now().date()
         week_ago = today - timezone.timedelta(days=7)
-        
-        logs = cls.objects.filter(
-            user=user,
-            date__range=[week_ago, today]
-        )
-        
-        total_minutes = sum(log.minutes_studied for log in logs)
-        total_words = sum(log.words_learned for log in logs)
+        summary = ProgressRollup.summarize(user, week_ago, today)
         
         return {
-            'total_minutes': total_minutes,
-            'total_hours': round(total_minutes / 60, 1),
-            'words_learned': total_words,
-            'activity_distribution': logs.values('activity_type').annotate(
-                count=models.Count('id'),
-                total_minutes=models.Sum('minutes_studied')
+            'total_minutes': summary['total_minutes'],
+            'total_hours': round(summary['total_minutes'] / 60, 1),
+            'words_learned': summary['total_words'],
+            'activity_distribution': summary['activity_distribution'],
+        }
+
+
+class ProgressRollup(models.Model):
+    """
+    ProgressLog totals per user, day, language and activity.
+
+    Maintained incrementally by the ProgressLog signals below; rebuild with
+    ``manage.py rebuild_progress_rollups`` after bulk changes that bypass
+    them (``QuerySet.update``/``delete``, raw SQL).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='progress_rollups')
+    date = models.DateField()
+    language = models.CharField(max_length=2, choices=Profile.LANGUAGES)
+    activity_type = models.CharField(max_length=20, choices=ProgressLog.ACTIVITY_CHOICES)
+    sessions = models.IntegerField(default=0)
+    minutes_studied = models.IntegerField(default=0)
+    words_learned = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'date', 'language', 'activity_type'],
+                name='progress_rollup_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.date} {self.language}/{self.activity_type}: {self.minutes_studied} min"
+
+    @classmethod
+    def apply(cls, key, sessions, minutes, words):
+        """Add the deltas to the rollup row for ``key``, creating it if needed"""
+        user_id, date, language, activity_type = key
+        rows = cls.objects.filter(user_id=user_id, date=date, language=language, activity_type=activity_type)
+        deltas = {
+            'sessions': F('sessions') + sessions,
+            'minutes_studied': F('minutes_studied') + minutes,
+            'words_learned': F('words_learned') + words,
+        }
+        if rows.update(**deltas) or sessions < 0:
+            # Nothing to subtract from a missing row, e.g. while the user is being deleted
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    user_id=user_id, date=date, language=language, activity_type=activity_type,
+                    sessions=sessions, minutes_studied=minutes, words_learned=words,
+                )
+        except IntegrityError:
+            # Created concurrently since the update above
+            rows.update(**deltas)
+
+    @classmethod
+    def rebuild(cls, user_ids=None):
+        """Recompute rollups and lifetime totals from ProgressLog (all users by default)"""
+        logs = ProgressLog.objects.all()
+        if user_ids is not None:
+            logs = logs.filter(user_id__in=user_ids)
+        with transaction.atomic():
+            rollups = cls.objects.all()
+            totals = ProgressTotal.objects.all()
+            if user_ids is not None:
+                rollups = rollups.filter(user_id__in=user_ids)
+                totals = totals.filter(user_id__in=user_ids)
+            rollups.delete()
+            totals.delete()
+            cls.objects.bulk_create([
+                cls(**row) for row in logs.order_by().values('user_id', 'date', 'language', 'activity_type').annotate(
+                    sessions=models.Count('id'),
+                    minutes_studied=Sum('minutes_studied'),
+                    words_learned=Sum('words_learned'),
+                )
+            ], batch_size=1000)
+            ProgressTotal.objects.bulk_create([
+                ProgressTotal(**row) for row in logs.order_by().values('user_id').annotate(
+                    sessions=models.Count('id'),
+                    minutes_studied=Sum('minutes_studied'),
+                    words_learned=Sum('words_learned'),
+                )
+            ], batch_size=1000)
+
+    @classmethod
+    def summarize(cls, user, start, end):
+        """
+        Totals and distributions of the user's progress between two dates.
+
+        Reads one row per (day, language, activity) in the range, so the
+        cost depends on the range and not on how many logs there are.
+        """
+        rows = list(cls.objects.filter(user=user, date__range=[start, end], sessions__gt=0).values(
+            'date', 'language', 'activity_type', 'sessions', 'minutes_studied', 'words_learned'
+        ))
+        activities = {}
+        languages = {}
+        days = {}
+        for row in rows:
+            activity = activities.setdefault(
+                row['activity_type'], {'activity_type': row['activity_type'], 'count': 0, 'total_minutes': 0}
             )
+            activity['count'] += row['sessions']
+            activity['total_minutes'] += row['minutes_studied']
+            language = languages.setdefault(row['language'], {'language': row['language'], 'total_minutes': 0})
+            language['total_minutes'] += row['minutes_studied']
+            day = days.setdefault(row['date'], {'minutes': 0, 'words': 0})
+            day['minutes'] += row['minutes_studied']
+            day['words'] += row['words_learned']
+        return {
+            'total_minutes': sum(row['minutes_studied'] for row in rows),
+            'total_words': sum(row['words_learned'] for row in rows),
+            'activity_distribution': list(activities.values()),
+            'language_distribution': sorted(languages.values(), key=lambda item: -item['total_minutes']),
+            'days': days,
         }
 
 
+class ProgressTotal(models.Model):
+    """Lifetime ProgressLog totals of a user, maintained alongside ProgressRollup"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='progress_total')
+    sessions = models.IntegerField(default=0)
+    minutes_studied = models.IntegerField(default=0)
+    words_learned = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.minutes_studied} min, {self.words_learned} words"
+
+    @classmethod
+    def apply(cls, user_id, sessions, minutes, words):
+        rows = cls.objects.filter(user_id=user_id)
+        deltas = {
+            'sessions': F('sessions') + sessions,
+            'minutes_studied': F('minutes_studied') + minutes,
+            'words_learned': F('words_learned') + words,
+        }
+        if rows.update(**deltas) or sessions < 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_id, sessions=sessions, minutes_studied=minutes, words_learned=words)
+        except IntegrityError:
+            rows.update(**deltas)
+
+    @classmethod
+    def for_user(cls, user):
+        """The user's totals; an unsaved zero row if nothing was logged yet"""
+        return cls.objects.filter(user=user).first() or cls(user=user)
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Create a profile when a new user signs up"""
     if created:
         Profile.objects.create(user=instance)
 
+def invalidate_profile_fragments(user_id, buckets):
+    """Drop the cached pages showing a user: partners' inboxes and the match lists of ``buckets``"""
+    bump_on_commit('bucket', [bucket_name(*pair) for pair in buckets if all(pair)])
+    bump_on_commit('inbox', RoomMembership.objects.filter(
+        room__memberships__user_id=user_id
+    ).exclude(user_id=user_id).values_list('user_id', flat=True))
+
+@receiver(post_save, sender=User)
+def invalidate_user_fragments(sender, instance, created, update_fields=None, **kwargs):
+    """Names are shown to partners; a login only touches last_login"""
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    buckets = Profile.objects.filter(user=instance).values_list('native_language', 'learning_language')
+    invalidate_profile_fragments(instance.pk, list(buckets))
+
+@receiver(post_save, sender=Profile)
+def invalidate_match_buckets(sender, instance, created, **kwargs):
+    """Refresh the matching buckets a profile left or joined, and the pages showing the profile"""
+    languages = (instance.native_language, instance.learning_language)
+    loaded = getattr(instance, '_loaded_languages', None)
+    buckets = {languages, loaded} - {None}
+    if languages != loaded:
+        for pair in buckets:
+            invalidate_bucket(*pair)
+        instance._loaded_languages = languages
+    invalidate_profile_fragments(instance.user_id, buckets)
+
+@receiver(post_save, sender=Profile)
+def process_profile_picture(sender, instance, created, **kwargs):
+    """Queue a new upload for resizing; drop the variants of a removed picture"""
+    picture = instance.profile_picture.name or ''
+    if picture == getattr(instance, '_loaded_picture', ''):
+        return
+    instance._loaded_picture = picture
+    if picture:
+        schedule_profile_picture(instance)
+    elif instance.profile_picture_variants:
+        stale = variant_names(instance.profile_picture_variants)
+        Profile.objects.filter(pk=instance.pk).update(profile_picture_variants={})
+        instance.profile_picture_variants = {}
+        transaction.on_commit(lambda: delete_files(stale))
+
+@receiver(post_delete, sender=Profile)
+def invalidate_match_bucket_on_delete(sender, instance, **kwargs):
+    invalidate_bucket(instance.native_language, instance.learning_language)
+    bump_on_commit('bucket', [bucket_name(instance.native_language, instance.learning_language)])
+
+def apply_progress_contribution(contribution, sign):
+    key, minutes, words = contribution
+    ProgressRollup.apply(key, sign, sign * minutes, sign * words)
+    ProgressTotal.apply(key[0], sign, sign * minutes, sign * words)
+
+@receiver(post_save, sender=ProgressLog)
+def update_progress_rollups(sender, instance, created, **kwargs):
+    """Move the log's minutes and words between rollup rows as it is created or edited"""
+    contribution = instance.rollup_contribution()
+    previous = getattr(instance, '_rollup_contribution', None)
+    if contribution == previous:
+        return
+    with transaction.atomic():
+        if previous is not None:
+            apply_progress_contribution(previous, -1)
+        apply_progress_contribution(contribution, 1)
+    instance._rollup_contribution = contribution
+
+@receiver(post_delete, sender=ProgressLog)
+def remove_progress_rollups(sender, instance, **kwargs):
+    contribution = getattr(instance, '_rollup_contribution', None) or instance.rollup_contribution()
+    with transaction.atomic():
+        apply_progress_contribution(contribution, -1)
+
+@receiver(post_save, sender=ProgressLog)
+@receiver(post_delete, sender=ProgressLog)
+def invalidate_dashboard_fragment(sender, instance, **kwargs):
+    bump_on_commit('dashboard', [instance.user_id])
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def sync_room_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep a RoomMembership row for every room participant"""
+    if action == 'post_add':
+        if reverse:
+            pairs = [(room_id, instance.pk) for room_id in pk_set]
+        else:
+            pairs = [(instance.pk, user_id) for user_id in pk_set]
+        RoomMembership.objects.bulk_create(
+            [RoomMembership(room_id=room_id, user_id=user_id) for room_id, user_id in pairs],
+            ignore_conflicts=True,
+        )
+    elif action == 'post_remove':
+        if reverse:
+            RoomMembership.objects.filter(user=instance, room_id__in=pk_set).delete()
+        else:
+            RoomMembership.objects.filter(room=instance, user_id__in=pk_set).delete()
+    elif action == 'post_clear':
+        if reverse:
+            RoomMembership.objects.filter(user=instance).delete()
+        else:
+            RoomMembership.objects.filter(room=instance).delete()
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def invalidate_participant_inboxes(sender, instance, action, reverse, pk_set, **kwargs):
+    """Everyone in a room that gains or loses a participant sees a different inbox"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        if pk_set is None:
+            pk_set = set(instance.room_memberships.values_list('room_id', flat=True))
+        room_ids, users = pk_set, {instance.pk}
+    else:
+        room_ids, users = {instance.pk}, set(pk_set or ())
+    invalidate_room_inboxes(room_ids, users)
+
+def invalidate_room_inboxes(room_ids, extra_user_ids=()):
+    members = RoomMembership.objects.filter(room_id__in=room_ids).values_list('user_id', flat=True)
+    bump_on_commit('inbox', set(members) | set(extra_user_ids))
+
+# Sent with ``messages=[...]`` after messages are inserted with bulk_create,
+# which does not send post_save for each of them.
+messages_bulk_created = Signal()
+
+@receiver(post_save, sender=Message)
+def update_unread_counters(sender, instance, created, **kwargs):
+    """Count a new room message as unread for everyone but its sender"""
+    if created and instance.room_id:
+        RoomMembership.increment_unread(instance.room_id, instance.sender_id)
+
+@receiver(messages_bulk_created, sender=Message)
+def update_unread_counters_bulk(sender, messages, **kwargs):
+    """Same as update_unread_counters, with one UPDATE per (room, sender)"""
+    counts = Counter((message.room_id, message.sender_id) for message in messages if message.room_id)
+    for (room_id, sender_id), count in counts.items():
+        RoomMembership.increment_unread(room_id, sender_id, count)
+
 @receiver(post_save, sender=Message)
 def send_message_notification(sender, instance, created, **kwargs):
-    """Send WebSocket notification for new messages"""
+    """Queue a WebSocket notification for new messages"""
     if created:
-        channel_layer = get_channel_layer()
-        room_name = f"chat_{instance.room.id}"
-        
-        # Notify all participants in the room
-        for participant in instance.room.participants.all():
-            if participant != instance.sender:  # Don't notify the sender
-                async_to_sync(channel_layer.group_send)(
-                    f"user_{participant.id}",
-                    {
-                        'type': 'chat_message',
-                        'message': {
-                            'room_id': instance.room.id,
-                            'sender': instance.sender.username,
-                            'content': instance.content,
-                            'timestamp': instance.timestamp.isoformat(),
-                            'is_read': instance.is_read
-                        }
-                    }
-                )
+        publish_message_created(instance)
+
+@receiver(messages_bulk_created, sender=Message)
+def send_message_notifications_bulk(sender, messages, **kwargs):
+    for message in messages:
+        publish_message_created(message)
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_message_inboxes(sender, instance, **kwargs):
+    """The room's last message and unread counts change for all its members"""
+    if instance.room_id:
+        invalidate_room_inboxes([instance.room_id])
+
+@receiver(messages_bulk_created, sender=Message)
+def invalidate_message_inboxes_bulk(sender, messages, **kwargs):
+    invalidate_room_inboxes({message.room_id for message in messages if message.room_id})
+
+
+# Practice tracking models live in their own module
+from .models_progress import LanguageProgress, PracticeSession  # noqa: E402,F401
@@ -1,7 +1,16 @@
-from django.db import models
+from collections import defaultdict
+
+from django.db import connection, models, transaction
 from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Floor, Least
 from django.utils import timezone
 
+# Starting proficiency of a new language; one more point per full hour practiced
+BASE_PROFICIENCY = 10
+MAX_PROFICIENCY = 100
+
+
 class LanguageProgress(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='language_progress')
     language = models.CharField(max_length=100)
@@ -14,18 +23,119 @@ class LanguageProgress(models.Model):
         ('native', 'Native')
     ])
     proficiency = models.PositiveIntegerField(default=0, help_text="Proficiency percentage (0-100)")
+    # Source of truth for practice time; hours_practiced is derived from it
+    minutes_practiced = models.PositiveIntegerField(default=0)
     hours_practiced = models.FloatField(default=0)
     words_learned = models.PositiveIntegerField(default=0)
     last_practiced = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    
+
     class Meta:
         verbose_name_plural = "Language Progress"
         unique_together = ('user', 'language')
-    
+
     def __str__(self):
         return f"{self.user.username}'s {self.language} progress ({self.level})"
 
+    @classmethod
+    def add_practice(cls, totals):
+        """
+        Add practice minutes to many ``(user_id, language)`` rows at once.
+
+        ``totals`` maps ``(user_id, language)`` to minutes. The rows are
+        created or incremented by the database itself, so concurrent callers
+        never overwrite each other's totals. Proficiency is
+        ``BASE_PROFICIENCY`` plus one per full hour practiced, capped at
+        ``MAX_PROFICIENCY``.
+        """
+        if not totals:
+            return
+        if connection.vendor in ('sqlite', 'postgresql'):
+            cls._upsert_practice(totals)
+            return
+        # Backends without INSERT ... ON CONFLICT: increment, create on a miss
+        for (user_id, language), minutes in totals.items():
+            rows = cls.objects.filter(user_id=user_id, language=language)
+            merged = F('minutes_practiced') + minutes
+            increments = {
+                'minutes_practiced': merged,
+                'hours_practiced': merged / 60.0,
+                'proficiency': Least(Floor(merged / 60) + BASE_PROFICIENCY, MAX_PROFICIENCY),
+                'last_practiced': timezone.now(),
+            }
+            if rows.update(**increments):
+                continue
+            _, created = cls.objects.get_or_create(user_id=user_id, language=language, defaults={
+                'level': 'beginner',
+                'minutes_practiced': minutes,
+                'hours_practiced': minutes / 60,
+                'proficiency': min(BASE_PROFICIENCY + minutes // 60, MAX_PROFICIENCY),
+            })
+            if not created:
+                # Created concurrently since the update above
+                rows.update(**increments)
+
+    @classmethod
+    def _upsert_practice(cls, totals):
+        # One INSERT ... ON CONFLICT DO UPDATE statement for the whole batch,
+        # split only where the backend limits the number of query parameters
+        max_rows = (connection.features.max_query_params or len(totals) * 8) // 8
+        items = list(totals.items())
+        for start in range(0, len(items), max_rows):
+            cls._upsert_rows(items[start:start + max_rows])
+
+    @classmethod
+    def _upsert_rows(cls, items):
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        minutes = qn('minutes_practiced')
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        rows = []
+        params = []
+        for (user_id, language), total in items:
+            rows.append('(%s, %s, %s, %s, %s, %s, %s, %s, 0)')
+            params.extend([
+                user_id, language, 'beginner', total, total / 60,
+                min(BASE_PROFICIENCY + total // 60, MAX_PROFICIENCY), now, now,
+            ])
+        merged = f'({table}.{minutes} + EXCLUDED.{minutes})'
+        sql = (
+            f'INSERT INTO {table} ({qn("user_id")}, {qn("language")}, {qn("level")}, {minutes}, '
+            f'{qn("hours_practiced")}, {qn("proficiency")}, {qn("last_practiced")}, {qn("created_at")}, '
+            f'{qn("words_learned")}) '
+            f'VALUES {", ".join(rows)} '
+            f'ON CONFLICT ({qn("user_id")}, {qn("language")}) DO UPDATE SET '
+            f'{minutes} = {merged}, '
+            f'{qn("hours_practiced")} = {merged} / 60.0, '
+            # Integer division: one point per full hour
+            f'{qn("proficiency")} = CASE WHEN {merged} >= {(MAX_PROFICIENCY - BASE_PROFICIENCY) * 60} '
+            f'THEN {MAX_PROFICIENCY} ELSE {BASE_PROFICIENCY} + {merged} / 60 END, '
+            f'{qn("last_practiced")} = EXCLUDED.{qn("last_practiced")}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+class PracticeSessionManager(models.Manager):
+    def bulk_ingest(self, sessions, batch_size=500):
+        """
+        Save many practice sessions and update LanguageProgress for them.
+
+        Each batch costs one ``bulk_create`` and one set-based upsert of
+        the per-(user, language) totals, whatever the number of sessions.
+        """
+        sessions = list(sessions)
+        for start in range(0, len(sessions), batch_size):
+            batch = sessions[start:start + batch_size]
+            totals = defaultdict(int)
+            for session in batch:
+                totals[(session.user_id, session.language)] += session.duration_minutes
+            with transaction.atomic():
+                self.bulk_create(batch)
+                LanguageProgress.add_practice(totals)
+        return sessions
+
+
 class PracticeSession(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='practice_sessions')
     language = models.CharField(max_length=100)
@@ -38,27 +148,19 @@ class PracticeSession(models.Model):
     duration_minutes = models.PositiveIntegerField(help_text="Duration in minutes")
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    
+
+    objects = PracticeSessionManager()
+
     class Meta:
         ordering = ['-created_at']
-    
+
     def save(self, *args, **kwargs):
-        # Update the related LanguageProgress when a session is saved
-        super().save(*args, **kwargs)
-        progress, created = LanguageProgress.objects.get_or_create(
-            user=self.user,
-            language=self.language,
-            defaults={
-                'level': 'beginner',
-                'proficiency': 10,
-                'hours_practiced': self.duration_minutes / 60
-            }
-        )
-        if not created:
-            progress.hours_practiced += self.duration_minutes / 60
-            # Simple progression logic (1% per hour of practice, capped at 100%)
-            progress.proficiency = min(progress.proficiency + (self.duration_minutes / 60), 100)
-            progress.save()
-    
+        # Count a new session towards the related LanguageProgress in the same transaction
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                LanguageProgress.add_practice({(self.user_id, self.language): self.duration_minutes})
+
     def __str__(self):
         return f"{self.user.username}'s {self.session_type} session - {self.duration_minutes}min"
@@ -0,0 +1,351 @@
+"""
+Outbox for per-user new-message notifications.
+
+Saving a message only records a small event (after the transaction
+commits); it never talks to the channel layer. A dispatcher running on
+an event loop collects the events for ``FLUSH_INTERVAL`` seconds, resolves
+the recipients of the whole batch with one query, and sends a single
+``group_send`` per recipient carrying all of that user's new messages.
+``UserConsumer`` (``ws/user/``) listens on those ``user_<id>`` groups.
+
+Read receipts from HTTP views are sent to the room's ``chat_<id>`` group
+through the same loop, so a page load never waits on the channel layer.
+
+A batch that fails, because the recipients could not be looked up or a
+``group_send`` raised, is retried after ``RETRY_DELAY`` seconds times the
+attempt number, up to ``MAX_ATTEMPTS`` attempts in all. A retry only goes
+to the recipients whose send failed, so nobody is notified twice.
+
+In the ASGI server the dispatcher runs on the server's event loop (see
+``DispatcherLoopMiddleware``). Elsewhere, e.g. under WSGI or in management
+commands, it runs on a loop in a background thread. ``close_notification_dispatcher``
+sends what is still queued; the ASGI lifespan shutdown calls it (see
+main/lifespan.py).
+"""
+import asyncio
+import contextvars
+import itertools
+import logging
+import threading
+from collections import defaultdict, deque
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_BATCH': 500,
+    'FLUSH_INTERVAL': 0.05,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 1.0,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_NOTIFICATIONS', {})}
+
+
+def message_event(message):
+    """Outbox event for a newly created message, built without any queries"""
+    return {
+        'message_id': message.id,
+        'room_id': message.room_id,
+        'sender_id': message.sender_id,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def resolve_recipients(events):
+    """
+    Group a batch of events by recipient.
+
+    Returns ``{user_id: [payload, ...]}`` where every participant of a
+    room except the sender receives the room's messages. An event being
+    retried carries the ``recipient_ids`` it still has to reach.
+    """
+    from .models import RoomMembership
+
+    room_ids = {event['room_id'] for event in events}
+    members = defaultdict(list)
+    for room_id, user_id in RoomMembership.objects.filter(room_id__in=room_ids).values_list('room_id', 'user_id'):
+        members[room_id].append(user_id)
+    usernames = dict(
+        User.objects.filter(id__in={event['sender_id'] for event in events}).values_list('id', 'username')
+    )
+
+    outbox = defaultdict(list)
+    for event in events:
+        payload = {
+            'message_id': event['message_id'],
+            'room_id': event['room_id'],
+            'sender': usernames.get(event['sender_id'], ''),
+            'content': event['content'],
+            'timestamp': event['timestamp'],
+        }
+        for user_id in event.get('recipient_ids', members[event['room_id']]):
+            if user_id != event['sender_id']:
+                outbox[user_id].append(payload)
+    return outbox
+
+
+class _LoopWorker:
+    """Dispatcher state bound to one event loop; only touched from that loop"""
+
+    def __init__(self, loop, max_batch, flush_interval, max_attempts=3, retry_delay=1.0, owns_thread=False):
+        self.loop = loop
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.owns_thread = owns_thread
+        # (event, attempt) pairs; attempt counts the failed dispatches so far
+        self.pending = deque()
+        # Retries waiting for their delay: key -> (timer handle, event, attempt)
+        self.retries = {}
+        self._retry_keys = itertools.count()
+        self.sends = set()
+        self.task = None
+        self.thread = None
+        self.closing = False
+        self.flush_now = asyncio.Event()
+
+    @property
+    def usable(self):
+        # A borrowed loop (e.g. one that ran a test) may have stopped since
+        return not self.loop.is_closed() and (self.owns_thread or self.loop.is_running())
+
+    def enqueue(self, event, attempt=0):
+        self.pending.append((event, attempt))
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self.drain())
+
+    async def drain(self):
+        while self.pending:
+            # Coalesce everything that arrives within the flush interval
+            if not self.closing:
+                try:
+                    await asyncio.wait_for(self.flush_now.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            while self.pending:
+                batch = [self.pending.popleft() for _ in range(min(self.max_batch, len(self.pending)))]
+                try:
+                    await self.dispatch(batch)
+                except Exception as e:
+                    logger.error(f"Error dispatching {len(batch)} notifications: {str(e)}", exc_info=True)
+                    self.retry(batch)
+
+    def retry(self, batch):
+        """Queue ``batch`` again after a delay, dropping events that used up their attempts"""
+        for event, attempt in batch:
+            attempt += 1
+            if attempt >= self.max_attempts:
+                logger.error(f"Dropping notification of message {event['message_id']} after {attempt} failed attempts")
+            elif self.closing:
+                self.enqueue(event, attempt)
+            else:
+                key = next(self._retry_keys)
+                handle = self.loop.call_later(self.retry_delay * attempt, self._requeue, key)
+                self.retries[key] = (handle, event, attempt)
+
+    def _requeue(self, key):
+        _, event, attempt = self.retries.pop(key)
+        self.enqueue(event, attempt)
+
+    def send(self, group, message):
+        task = self.loop.create_task(self._send(group, message))
+        self.sends.add(task)
+        task.add_done_callback(self.sends.discard)
+
+    async def _send(self, group, message):
+        try:
+            await get_channel_layer().group_send(group, message)
+        except Exception as e:
+            logger.error(f"Error sending {message.get('type')} to {group}: {str(e)}", exc_info=True)
+
+    async def dispatch(self, batch):
+        outbox = await database_sync_to_async(resolve_recipients)([event for event, _ in batch])
+        if not outbox:
+            return
+        channel_layer = get_channel_layer()
+        results = await asyncio.gather(*(
+            channel_layer.group_send(f"user_{user_id}", {
+                'type': 'notify_messages',
+                'messages': messages,
+            })
+            for user_id, messages in outbox.items()
+        ), return_exceptions=True)
+
+        failed = defaultdict(list)
+        for (user_id, messages), result in zip(outbox.items(), results):
+            if isinstance(result, Exception):
+                logger.error(f"Error sending {len(messages)} notifications to user {user_id}: {str(result)}")
+                for payload in messages:
+                    failed[payload['message_id']].append(user_id)
+        if failed:
+            self.retry([
+                ({**event, 'recipient_ids': failed[event['message_id']]}, attempt)
+                for event, attempt in batch if event['message_id'] in failed
+            ])
+
+    def stop_thread(self):
+        """Close the worker on its own thread's loop, then stop that loop; callable from any thread"""
+        future = asyncio.run_coroutine_threadsafe(self.close(), self.loop)
+        future.add_done_callback(lambda _: self.loop.call_soon_threadsafe(self.loop.stop))
+        return future
+
+    async def close(self):
+        """Send everything queued, retrying failures right away, and wait for sends in flight"""
+        self.closing = True
+        self.flush_now.set()
+        for handle, event, attempt in self.retries.values():
+            handle.cancel()
+            self.enqueue(event, attempt)
+        self.retries.clear()
+        while True:
+            running = [task for task in (self.task, *self.sends) if task is not None and not task.done()]
+            if not running:
+                return
+            await asyncio.gather(*running)
+
+
+class NotificationDispatcher:
+    def __init__(self, max_batch=500, flush_interval=0.05, max_attempts=3, retry_delay=1.0):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def _new_worker(self, loop, owns_thread=False):
+        return _LoopWorker(loop, self.max_batch, self.flush_interval, self.max_attempts, self.retry_delay, owns_thread)
+
+    def attach(self, loop=None):
+        """Dispatch on ``loop`` (default: the running loop) from now on"""
+        loop = loop or asyncio.get_running_loop()
+        worker = self._worker
+        if worker is not None and worker.usable and (worker.loop is loop or not worker.owns_thread):
+            return
+        with self._lock:
+            worker = self._worker
+            if worker is None or worker.owns_thread or not worker.usable:
+                self._worker = self._new_worker(loop)
+                if worker is not None and worker.owns_thread and worker.usable:
+                    # The background thread is not needed any more
+                    worker.stop_thread()
+
+    def _start_thread_worker(self):
+        loop = asyncio.new_event_loop()
+        worker = self._new_worker(loop, owns_thread=True)
+        worker.thread = threading.Thread(target=_run_loop, args=(loop,), name='notification-dispatcher', daemon=True)
+        worker.thread.start()
+        return worker
+
+    def _get_worker(self):
+        worker = self._worker
+        if worker is None or not worker.usable:
+            with self._lock:
+                if self._worker is None or not self._worker.usable:
+                    self._worker = self._start_thread_worker()
+                worker = self._worker
+        return worker
+
+    def publish(self, event):
+        """Queue an event; safe to call from any thread and never blocks on the channel layer"""
+        worker = self._get_worker()
+        # Run with a fresh context: the caller's may belong to a sync_to_async
+        # thread, and tasks inheriting it could not use database_sync_to_async.
+        worker.loop.call_soon_threadsafe(worker.enqueue, event, context=contextvars.Context())
+
+    def group_send(self, group, message):
+        """Send ``message`` to ``group`` from the dispatcher's loop without waiting for it"""
+        worker = self._get_worker()
+        worker.loop.call_soon_threadsafe(worker.send, group, message, context=contextvars.Context())
+
+    async def close(self):
+        """Send what is queued, then stop the background thread's loop if the dispatcher started one"""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is None:
+            return
+        if not worker.usable:
+            if worker.pending:
+                logger.warning(f"Dropping {len(worker.pending)} notifications left on a stopped event loop")
+        elif worker.owns_thread:
+            await asyncio.wrap_future(worker.stop_thread())
+            await asyncio.to_thread(worker.thread.join)
+        elif worker.loop is asyncio.get_running_loop():
+            await worker.close()
+        else:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(worker.close(), worker.loop))
+
+
+def _run_loop(loop):
+    """Target of the dispatcher's background thread"""
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+
+
+_dispatcher = None
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        config = get_config()
+        _dispatcher = NotificationDispatcher(
+            max_batch=config['MAX_BATCH'],
+            flush_interval=config['FLUSH_INTERVAL'],
+            max_attempts=config['MAX_ATTEMPTS'],
+            retry_delay=config['RETRY_DELAY'],
+        )
+    return _dispatcher
+
+
+async def close_notification_dispatcher():
+    """Send the queued notifications and read receipts; called on server shutdown"""
+    if _dispatcher is not None:
+        await _dispatcher.close()
+
+
+def publish_message_created(message):
+    """Record a notification for ``message`` once the current transaction commits"""
+    if not message.room_id:
+        return
+    event = message_event(message)
+    transaction.on_commit(lambda: get_dispatcher().publish(event))
+
+
+def read_receipt_event(room_id, user_id, message_id):
+    return {
+        'type': 'read_receipt',
+        'room_id': str(room_id),
+        'user_id': str(user_id),
+        'last_read_message_id': str(message_id),
+    }
+
+
+def publish_read_receipt(room_id, user_id, message_id):
+    """Tell the room's sockets that ``user_id`` has read up to ``message_id``"""
+    event = read_receipt_event(room_id, user_id, message_id)
+    transaction.on_commit(lambda: get_dispatcher().group_send(f'chat_{room_id}', event))
+
+
+class DispatcherLoopMiddleware:
+    """ASGI middleware that runs the notification dispatcher on the server's event loop"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        get_dispatcher().attach()
+        return await self.app(scope, receive, send)
@@ -0,0 +1,102 @@
+import base64
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client supplies a malformed pagination cursor"""
+
+
+@dataclass(frozen=True)
+class MessageCursor:
+    """Position of a row in a (timestamp, id) ordering, e.g. messages of a room"""
+    timestamp: datetime
+    id: int
+
+    @classmethod
+    def for_message(cls, message):
+        return cls(timestamp=message.timestamp, id=message.id)
+
+    def encode(self):
+        raw = f"{self.timestamp.isoformat()}|{self.id}".encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, token):
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            timestamp, message_id = base64.urlsafe_b64decode(padded).decode().split('|')
+            return cls(timestamp=datetime.fromisoformat(timestamp), id=int(message_id))
+        except (ValueError, TypeError, UnicodeDecodeError) as e:
+            raise InvalidCursor(f"Invalid cursor: {token!r}") from e
+
+
+def get_page_size(value=None):
+    """Clamp a requested page size to the configured bounds"""
+    default = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    maximum = getattr(settings, 'CHAT_HISTORY_MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    if value in (None, ''):
+        return default
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
+
+
+def paginate_messages(queryset, before=None, after=None, limit=None):
+    """
+    Return one keyset page of messages from ``queryset``.
+
+    Without cursors this is the newest window of the room. ``before`` walks
+    back into older history and ``after`` fetches anything newer than the
+    cursor. Messages are always returned oldest-first so they can be
+    rendered directly; only ``limit + 1`` rows are read from the database,
+    so the cost of a page does not depend on how old the room is.
+    """
+    if before is not None and after is not None:
+        raise InvalidCursor("Use either 'before' or 'after', not both")
+
+    limit = get_page_size(limit)
+
+    if isinstance(before, str):
+        before = MessageCursor.decode(before)
+    if isinstance(after, str):
+        after = MessageCursor.decode(after)
+
+    if after is not None:
+        queryset = queryset.filter(
+            Q(timestamp__gt=after.timestamp) |
+            Q(timestamp=after.timestamp, id__gt=after.id)
+        ).order_by('timestamp', 'id')
+        rows = list(queryset[:limit + 1])
+        has_more = len(rows) > limit
+        messages = rows[:limit]
+        has_newer, has_older = has_more, True
+    else:
+        if before is not None:
+            queryset = queryset.filter(
+                Q(timestamp__lt=before.timestamp) |
+                Q(timestamp=before.timestamp, id__lt=before.id)
+            )
+        rows = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+        has_more = len(rows) > limit
+        messages = rows[:limit][::-1]
+        has_older, has_newer = has_more, before is not None
+
+    return {
+        'messages': messages,
+        'has_older': has_older,
+        'has_newer': has_newer,
+        'before': MessageCursor.for_message(messages[0]).encode() if messages else None,
+        'after': MessageCursor.for_message(messages[-1]).encode() if messages else (
+            after.encode() if after is not None else None
+        ),
+    }
@@ -0,0 +1,175 @@
+"""
+Presence tracking.
+
+Live presence is kept in the cache, not in the database. Every connected
+socket refreshes a ``presence:<user_id>`` key on connect and on each
+heartbeat. The key expires ``TIMEOUT`` seconds after the last refresh, so
+users of a crashed worker drop offline on their own. ``online_user_ids``
+answers "who of these is online" with a single ``get_many``.
+
+``Profile.is_online`` and ``Profile.last_seen`` are a snapshot for
+queries and the admin. They are written every ``FLUSH_INTERVAL`` seconds,
+with at most one UPDATE for the users seen online and one for the users
+who went offline, so ``last_seen`` is accurate to that interval.
+
+Each worker counts its own sockets per user, so closing one of several
+tabs does not mark the user offline. Tabs served by another worker keep
+the user online again with their next heartbeat.
+
+Pending states are also written when the last socket of the process
+closes, which is what a server shutdown does, and on the ASGI lifespan
+shutdown (see main/lifespan.py). A tracker belongs to one event loop and
+is dropped once that loop is closed.
+"""
+import asyncio
+import logging
+import weakref
+from collections import Counter
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'TIMEOUT': 60,
+    'HEARTBEAT_INTERVAL': 25,
+    'FLUSH_INTERVAL': 30,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PRESENCE', {})}
+
+
+def presence_key(user_id):
+    return f'presence:{user_id}'
+
+
+def online_user_ids(user_ids):
+    """Return the subset of ``user_ids`` that is online, in one cache round trip"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+    found = cache.get_many([presence_key(user_id) for user_id in user_ids])
+    return {user_id for user_id in user_ids if presence_key(user_id) in found}
+
+
+def apply_presence(profiles):
+    """Set ``is_online`` on loaded profiles from live presence instead of the DB snapshot"""
+    profiles = [profile for profile in profiles if profile is not None]
+    online = online_user_ids({profile.user_id for profile in profiles})
+    for profile in profiles:
+        profile.is_online = profile.user_id in online
+    return profiles
+
+
+def flush_presence(states):
+    """Write a batch of ``{user_id: is_online}`` states to the profiles"""
+    from .models import Profile
+
+    now = timezone.now()
+    online = [user_id for user_id, is_online in states.items() if is_online]
+    offline = [user_id for user_id, is_online in states.items() if not is_online]
+    if online:
+        Profile.objects.filter(user_id__in=online).update(is_online=True, last_seen=now)
+    if offline:
+        Profile.objects.filter(user_id__in=offline).update(is_online=False, last_seen=now)
+
+
+class PresenceTracker:
+    def __init__(self, timeout=60, flush_interval=30):
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.connections = Counter()
+        self._dirty = {}
+        self._task = None
+
+    async def connect(self, user_id):
+        self.connections[user_id] += 1
+        await self.heartbeat(user_id)
+
+    async def heartbeat(self, user_id):
+        await cache.aset(presence_key(user_id), timezone.now().timestamp(), timeout=self.timeout)
+        self._mark(user_id, True)
+
+    async def disconnect(self, user_id):
+        self.connections[user_id] -= 1
+        if self.connections[user_id] > 0:
+            return
+        del self.connections[user_id]
+        await cache.adelete(presence_key(user_id))
+        self._mark(user_id, False)
+        if not self.connections:
+            # No sockets left in this process, e.g. on shutdown
+            await self.flush()
+
+    def is_connected(self, user_id):
+        """Whether ``user_id`` has a socket open in this process"""
+        return self.connections[user_id] > 0
+
+    def _mark(self, user_id, is_online):
+        self._dirty[user_id] = is_online
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        states, self._dirty = self._dirty, {}
+        if not states:
+            return
+        try:
+            await database_sync_to_async(flush_presence)(states)
+        except Exception as e:
+            logger.error(f"Error flushing presence of {len(states)} users: {str(e)}", exc_info=True)
+
+    def flush_sync(self):
+        """Write pending states from a thread without a running loop"""
+        states, self._dirty = self._dirty, {}
+        if states:
+            flush_presence(states)
+
+    async def close(self):
+        """Stop the flush task and write what is pending"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        await self.flush()
+
+
+# Weak keys let a loop that is garbage collected take its tracker along;
+# a closed loop that is still referenced is evicted on the next lookup
+_trackers = weakref.WeakKeyDictionary()
+
+
+def _evict_closed_loops():
+    for loop in [loop for loop in _trackers if loop.is_closed()]:
+        tracker = _trackers.pop(loop)
+        if tracker._dirty:
+            logger.warning(f"Dropping presence of {len(tracker._dirty)} users left on a closed event loop")
+
+
+def get_presence_tracker():
+    """Return the tracker for the running event loop"""
+    loop = asyncio.get_running_loop()
+    _evict_closed_loops()
+    tracker = _trackers.get(loop)
+    if tracker is None:
+        config = get_config()
+        tracker = _trackers[loop] = PresenceTracker(
+            timeout=config['TIMEOUT'],
+            flush_interval=config['FLUSH_INTERVAL'],
+        )
+    return tracker
+
+
+async def close_presence_tracker():
+    """Write and drop the tracker of the running event loop, if it has one"""
+    tracker = _trackers.pop(asyncio.get_running_loop(), None)
+    if tracker is not None:
+        await tracker.close()
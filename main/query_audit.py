@@ -0,0 +1,137 @@
+"""
+Registry of the hot ORM queries behind the chat pages and their query plans.
+
+Each registered query is a callable that builds a queryset for a sample
+user/room. ``audit_hot_queries`` runs EXPLAIN on every one of them and
+reports the ones where the database would fall back to a full table scan.
+"""
+import re
+
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+
+from .inbox import get_inbox_queryset
+from .models import ChatRoom, Message, Profile, RoomMembership
+
+HOT_QUERIES = {}
+
+# SQLite: "SCAN main_message" without an index, e.g. not
+# "SCAN main_chatroom_participants USING COVERING INDEX ..."
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (?!.*\bUSING\b.*\bINDEX\b)(\S+)')
+POSTGRES_FULL_SCAN = re.compile(r'\bSeq Scan on (\S+)')
+FULL_SCAN_PATTERNS = {
+    'sqlite': SQLITE_FULL_SCAN,
+    'postgresql': POSTGRES_FULL_SCAN,
+}
+
+
+class AuditNotSupported(Exception):
+    """Raised on database backends whose query plans the audit cannot read"""
+
+
+def hot_query(name):
+    """Register a queryset factory ``func(user, room)`` under ``name``"""
+    def decorator(func):
+        HOT_QUERIES[name] = func
+        return func
+    return decorator
+
+
+@hot_query('room_history_window')
+def room_history_window(user, room):
+    return Message.objects.filter(room=room).order_by('-timestamp', '-id')[:51]
+
+
+@hot_query('room_latest_message')
+def room_latest_message(user, room):
+    return Message.objects.filter(room=room).order_by('-timestamp')[:1]
+
+
+@hot_query('room_latest_incoming')
+def room_latest_incoming(user, room):
+    # Read watermark target in RoomMembership.mark_read
+    return Message.objects.filter(room=room).exclude(sender=user).order_by('-timestamp', '-id')[:1]
+
+
+@hot_query('room_peer_read_watermark')
+def room_peer_read_watermark(user, room):
+    return RoomMembership.objects.filter(room=room).exclude(user=user).values('last_read_message_id')
+
+
+@hot_query('room_for_pair')
+def room_for_pair(user, room):
+    # ChatRoom.get_or_create_for_users
+    return ChatRoom.objects.filter(user_a_id=room.user_a_id or user.id, user_b_id=room.user_b_id or user.id)
+
+
+@hot_query('user_chat_rooms')
+def user_chat_rooms(user, room):
+    return ChatRoom.objects.filter(participants=user).order_by('-last_updated')
+
+
+@hot_query('membership_unread_total')
+def membership_unread_total(user, room):
+    return RoomMembership.objects.filter(user=user, unread_count__gt=0)
+
+
+@hot_query('inbox_page')
+def inbox_page(user, room):
+    # build_inbox: the memberships with their last message and other
+    # participant, each looked up by a correlated subquery per room
+    return get_inbox_queryset(user).order_by('-activity', '-room_id')[:31]
+
+
+@hot_query('inbox_partner_ids')
+def inbox_partner_ids(user, room):
+    return RoomMembership.objects.filter(room__memberships__user=user).exclude(user=user).values('user_id')
+
+
+@hot_query('match_bucket')
+def match_bucket(user, room):
+    return Profile.objects.filter(native_language='en', learning_language='es')
+
+
+def explain(queryset, using='default'):
+    """Return the query plan of ``queryset`` as text"""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        # Small or empty tables are always cheaper to seq-scan; disabling
+        # seq scans shows whether an index path exists at all.
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.using(using).explain()
+    return queryset.using(using).explain()
+
+
+def check_vendor(vendor):
+    if vendor not in FULL_SCAN_PATTERNS:
+        raise AuditNotSupported(
+            f"Query plan audit is not supported on {vendor}, only on {', '.join(FULL_SCAN_PATTERNS)}"
+        )
+
+
+def full_scans(plan, vendor):
+    """Return the tables that ``plan`` reads with a full scan"""
+    check_vendor(vendor)
+    return FULL_SCAN_PATTERNS[vendor].findall(plan)
+
+
+def audit_hot_queries(using='default', names=None):
+    """
+    EXPLAIN every registered hot query.
+
+    Returns a list of ``(name, plan, scanned_tables)`` tuples.
+    """
+    vendor = connections[using].vendor
+    check_vendor(vendor)
+    # EXPLAIN only needs ids, so unsaved sample rows are enough
+    user = User(id=1)
+    room = ChatRoom(id=1)
+    results = []
+    for name, factory in HOT_QUERIES.items():
+        if names and name not in names:
+            continue
+        plan = explain(factory(user, room), using=using)
+        results.append((name, plan, full_scans(plan, vendor)))
+    return results
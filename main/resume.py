@@ -0,0 +1,79 @@
+"""
+Delta sync for reconnecting chat sockets.
+
+A client that reconnects already shows most of the room. It presents the
+id of the newest message it has (``after`` in the ``subscribe`` frame of
+``ws/user/``, or ``?after=<id>`` on ``ws/chat/<room_id>/``), and the
+server sends only the messages with a higher id, as ordinary ``history``
+frames. Nothing missed means a single empty frame that carries the peer's
+read watermark.
+
+If more than ``MAX_MISSED_MESSAGES`` were missed, catching up would cost
+as much as a fresh load. The server then sends a ``resync`` frame and
+the newest history window, and the client replaces what it shows::
+
+    {"type": "resync", "room_id": "12", "reason": "gap_too_large"}
+
+Message ids grow with every insert, so "newer than the client's last id"
+holds even for messages the write-behind writer stamped out of order.
+
+Every socket is greeted with a ``hello`` frame holding reconnect hints::
+
+    {"type": "hello", "reconnect": {"delay_ms": 1730, "min_ms": 1000, "max_ms": 30000}}
+
+``delay_ms`` is drawn at random for each connection. When a worker
+restarts, its clients wait for different delays before their first retry
+instead of reconnecting all at once. Later retries back off exponentially
+between ``min_ms`` and ``max_ms``, with full jitter.
+"""
+import random
+
+from django.conf import settings
+
+from .models import Message
+
+DEFAULTS = {
+    'MAX_MISSED_MESSAGES': 500,
+    'RECONNECT_MIN_MS': 1000,
+    'RECONNECT_MAX_MS': 30000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_RESUME', {})}
+
+
+def parse_resume_id(value):
+    """The message id a client resumes from, or None for a full history"""
+    try:
+        message_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return message_id if message_id > 0 else None
+
+
+def missed_messages(room_id, after_id, limit=None):
+    """
+    Messages of the room newer than ``after_id``, oldest first, with ``sender`` loaded.
+
+    Returns None when there are more than ``limit`` of them.
+    """
+    limit = limit or get_config()['MAX_MISSED_MESSAGES']
+    messages = list(
+        Message.objects.filter(room_id=room_id, id__gt=after_id).select_related('sender').order_by('id')[:limit + 1]
+    )
+    return messages if len(messages) <= limit else None
+
+
+def reconnect_hint():
+    """The ``hello`` frame with this connection's reconnect hints"""
+    config = get_config()
+    min_ms, max_ms = config['RECONNECT_MIN_MS'], config['RECONNECT_MAX_MS']
+    return {
+        'type': 'hello',
+        'reconnect': {
+            'delay_ms': random.randint(min_ms, min(2 * min_ms, max_ms)),
+            'min_ms': min_ms,
+            'max_ms': max_ms,
+        },
+    }
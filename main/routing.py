@@ -4,4 +4,7 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<room_id>\d+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/user/$', consumers.UserConsumer.as_asgi()),
+    # Clients that only want notifications; served by the same consumer
+    re_path(r'ws/notifications/$', consumers.UserConsumer.as_asgi()),
 ]
\ No newline at end of file
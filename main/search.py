@@ -0,0 +1,198 @@
+"""
+Full-text search over chat messages.
+
+The index lives in the database next to ``main_message`` (migration
+``0012_message_search``):
+
+* SQLite  - an external-content FTS5 table, ``main_message_fts``. The
+  ``unicode61`` tokenizer folds case and diacritics, so ``cafe`` finds
+  ``Café``. Triggers on ``main_message`` keep it up to date.
+* PostgreSQL - a ``search_vector`` tsvector column with a GIN index. A
+  trigger fills it with the ``simple`` configuration, which does no
+  stemming, so no language is preferred over another.
+
+The triggers also catch writes that bypass the ORM's signals, e.g. the
+write-behind ``bulk_create``. Django's SQLite schema editor rebuilds a
+table to alter it, which drops its triggers. So a later migration that
+alters ``Message`` must create them again. ``check_search_index`` (a
+``database`` system check) reports missing triggers.
+
+``search_messages`` only looks in rooms the user takes part in. It ranks
+the hits (bm25 / ``ts_rank_cd``) and highlights the matches in an
+HTML-escaped snippet. ``rebuild_index`` reindexes rooms in batches; see
+the ``rebuild_search_index`` command.
+"""
+import logging
+import re
+from contextlib import nullcontext
+
+from django.db import connection, transaction
+from django.utils.html import escape
+
+from .models import ChatRoom, Message
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+MAX_TERMS = 16
+SNIPPET_WORDS = 12
+
+# Control characters cannot appear in a query term, so they mark the
+# matches until the snippet is escaped
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+TERM = re.compile(r'\w+')
+
+SQLITE_TRIGGERS = {'main_message_fts_insert', 'main_message_fts_delete', 'main_message_fts_update'}
+POSTGRESQL_TRIGGERS = {'main_message_search_vector'}
+
+SQLITE_SEARCH = f"""
+    SELECT main_message.id, -bm25(main_message_fts) AS rank,
+           snippet(main_message_fts, 0, '{MARK_START}', '{MARK_END}', '…', {SNIPPET_WORDS})
+    FROM main_message_fts
+    JOIN main_message ON main_message.id = main_message_fts.rowid
+    WHERE main_message_fts MATCH %s
+      AND main_message.room_id IN ({{rooms}})
+    ORDER BY rank DESC, main_message.id DESC
+    LIMIT %s OFFSET %s
+"""
+POSTGRESQL_SEARCH = f"""
+    SELECT main_message.id, ts_rank_cd(main_message.search_vector, query) AS rank,
+           ts_headline('pg_catalog.simple', main_message.content, query,
+                       'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={SNIPPET_WORDS}, MinWords=4')
+    FROM main_message, to_tsquery('pg_catalog.simple', %s) AS query
+    WHERE main_message.search_vector @@ query
+      AND main_message.room_id IN ({{rooms}})
+    ORDER BY rank DESC, main_message.id DESC
+    LIMIT %s OFFSET %s
+"""
+ROOMS_OF_USER = 'SELECT room_id FROM main_roommembership WHERE user_id = %s'
+
+
+class SearchNotSupported(Exception):
+    """Raised on database backends without a search index"""
+
+
+def parse_terms(query):
+    """The words of ``query``; every one of them must match"""
+    return TERM.findall(query.lower())[:MAX_TERMS]
+
+
+def match_expression(terms, vendor):
+    """
+    A backend query that matches all ``terms``, the last one as a prefix.
+
+    The words are quoted, so user input never reaches the query syntax of
+    FTS5 or ``to_tsquery``.
+    """
+    if vendor == 'sqlite':
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+    quoted = [f"'{term}'" for term in terms]
+    quoted[-1] += ':*'
+    return ' & '.join(quoted)
+
+
+def highlight(snippet):
+    """Escape ``snippet`` and turn the match markers into ``<mark>`` tags"""
+    return escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def search_messages(user, query, page=1, limit=DEFAULT_PAGE_SIZE, room=None):
+    """
+    One page of the messages matching ``query`` in ``user``'s rooms, best first.
+
+    Returns ``{'results': [...], 'page': n, 'has_next': bool}``. Every result
+    holds the message, its rank (higher is better) and its highlighted
+    snippet. ``room`` narrows the search to one of the user's rooms.
+    """
+    vendor = connection.vendor
+    if vendor not in ('sqlite', 'postgresql'):
+        raise SearchNotSupported(f"Message search is not available on {vendor}")
+    page = max(1, int(page))
+    limit = min(max(1, int(limit)), MAX_PAGE_SIZE)
+    terms = parse_terms(query)
+    if not terms:
+        return {'results': [], 'page': page, 'has_next': False}
+
+    rooms, params = ROOMS_OF_USER, [user.id]
+    if room is not None:
+        rooms += ' AND room_id = %s'
+        params.append(room.id)
+    sql = (SQLITE_SEARCH if vendor == 'sqlite' else POSTGRESQL_SEARCH).format(rooms=rooms)
+    with connection.cursor() as cursor:
+        # One extra row tells whether there is a next page
+        cursor.execute(sql, [match_expression(terms, vendor), *params, limit + 1, (page - 1) * limit])
+        rows = cursor.fetchall()
+
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    messages = Message.objects.select_related('room', 'sender').in_bulk([row[0] for row in rows])
+    results = [
+        {'message': messages[message_id], 'rank': rank, 'snippet': highlight(snippet)}
+        for message_id, rank, snippet in rows if message_id in messages
+    ]
+    return {'results': results, 'page': page, 'has_next': has_next}
+
+
+def rebuild_index(batch_size=200, log=None):
+    """
+    Reindex every message, ``batch_size`` rooms per statement.
+
+    ``log`` gets a progress line per batch; by default it goes to this
+    module's logger.
+
+    PostgreSQL commits each batch on its own; recomputing a row's vector is
+    harmless while messages keep arriving. On SQLite the FTS table is
+    emptied and refilled in one transaction. Otherwise a message inserted
+    by a trigger mid-rebuild could be indexed twice, and searches would
+    miss the rooms not refilled yet.
+    """
+    vendor = connection.vendor
+    if vendor not in ('sqlite', 'postgresql'):
+        raise SearchNotSupported(f"Message search is not available on {vendor}")
+
+    log = log or logger.info
+    indexed = rooms = 0
+    with transaction.atomic() if vendor == 'sqlite' else nullcontext():
+        if vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO main_message_fts(main_message_fts) VALUES ('delete-all')")
+        room_ids = list(ChatRoom.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(room_ids), batch_size):
+            batch = room_ids[start:start + batch_size]
+            indexed += _reindex_rooms(batch, vendor)
+            rooms += len(batch)
+            log(f"Reindexed {rooms}/{len(room_ids)} rooms, {indexed} messages")
+    return {'rooms': rooms, 'messages': indexed}
+
+
+def _reindex_rooms(room_ids, vendor):
+    placeholders = ', '.join(['%s'] * len(room_ids))
+    if vendor == 'sqlite':
+        sql = (f'INSERT INTO main_message_fts(rowid, content) '
+               f'SELECT id, content FROM main_message WHERE room_id IN ({placeholders})')
+    else:
+        sql = (f"UPDATE main_message SET search_vector = to_tsvector('pg_catalog.simple', content) "
+               f"WHERE room_id IN ({placeholders})")
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, room_ids)
+        return cursor.rowcount
+
+
+def missing_triggers(using_connection=None):
+    """Names of the index triggers that are missing from the database"""
+    using_connection = using_connection or connection
+    with using_connection.cursor() as cursor:
+        if using_connection.vendor == 'sqlite':
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'main_message'")
+            expected = SQLITE_TRIGGERS
+        elif using_connection.vendor == 'postgresql':
+            cursor.execute("SELECT tgname FROM pg_trigger WHERE tgrelid = 'main_message'::regclass")
+            expected = POSTGRESQL_TRIGGERS
+        else:
+            return set()
+        return expected - {row[0] for row in cursor.fetchall()}
@@ -0,0 +1,36 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from ..images import pick_variant
+
+register = template.Library()
+
+
+@register.inclusion_tag('includes/avatar.html')
+def avatar(profile, size, alt='', css_class='', style=''):
+    """
+    Render ``profile``'s picture at ``size`` CSS pixels.
+
+    Uses the smallest processed variant that covers ``size`` (and twice
+    that for high-density screens), as WebP with a JPEG fallback. Until
+    an upload has been processed the stored original is used.
+    """
+    context = {'size': size, 'alt': alt, 'css_class': css_class, 'style': style}
+    variants = profile.profile_picture_variants
+    if not variants:
+        context['src'] = profile.profile_picture.url if profile.profile_picture else ''
+        return context
+
+    standard, dense = pick_variant(variants, size), pick_variant(variants, size * 2)
+
+    def srcset(ext):
+        if dense is standard:
+            return default_storage.url(standard[ext])
+        return f'{default_storage.url(standard[ext])} 1x, {default_storage.url(dense[ext])} 2x'
+
+    context.update({
+        'src': default_storage.url(standard['jpg']),
+        'webp_srcset': srcset('webp'),
+        'jpg_srcset': srcset('jpg'),
+    })
+    return context
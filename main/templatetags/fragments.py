@@ -0,0 +1,35 @@
+from django import template
+
+register = template.Library()
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, fragment):
+        self.nodelist = nodelist
+        self.fragment = fragment
+
+    def render(self, context):
+        fragment = self.fragment.resolve(context)
+        if fragment is None:
+            return self.nodelist.render(context)
+        if not fragment.cached:
+            fragment.store(self.nodelist.render(context))
+        return fragment.html
+
+
+@register.tag
+def fragment(parser, token):
+    """
+    Output a ``main.fragments.Fragment`` from the view if it is cached,
+    otherwise render the enclosed block and store it::
+
+        {% fragment inbox_fragment %}...{% endfragment %}
+
+    Without a fragment in the context the block is rendered uncached.
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes one argument, the fragment from the view")
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(nodelist, parser.compile_filter(bits[1]))
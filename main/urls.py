@@ -1,7 +1,8 @@
 from django.urls import path, include
 from django.contrib.auth.decorators import login_required
 from . import views
-from .views_chat import chat_room, send_message, get_messages, get_unread_count
+from .views_chat import chat_room, send_message, get_messages, get_unread_count, search_chat_messages
+from . import views_export, views_metrics
 
 app_name = 'main'
 
@@ -22,9 +23,19 @@ urlpatterns = [
     path('api/chat/<str:room_name>/send/', send_message, name='send_message'),
     path('api/chat/<str:room_name>/messages/', get_messages, name='get_messages'),
     path('api/chat/unread-count/', get_unread_count, name='unread_count'),
+    path('api/chat/search/', search_chat_messages, name='search_messages'),
     path('inbox/', views.inbox_view, name='inbox'),
     path('chat/<int:user_id>/', views.chat_view, name='chat'),
     
+    # Streaming exports (fmt: csv or ndjson, add ?gzip=1 to compress)
+    path('api/export/chat/<str:room_name>/messages.<str:fmt>', views_export.export_room_messages, name='export_room_messages'),
+    path('api/export/messages.<str:fmt>', views_export.export_message_archive, name='export_messages'),
+    path('api/export/progress.<str:fmt>', views_export.export_progress_logs, name='export_progress'),
+    path('api/export/practice.<str:fmt>', views_export.export_practice_sessions, name='export_practice'),
+    
+    # Request instrumentation (Prometheus text format)
+    path('metrics', views_metrics.metrics, name='metrics'),
+    
     # Progress Dashboard
     path('progress/', login_required(views.ProgressDashboardView.as_view()), name='progress_dashboard'),
     path('progress/add/', login_required(views.ProgressLogCreateView.as_view()), name='progress_add'),
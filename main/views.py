@@ -9,9 +9,13 @@ from django.db.models import Q
 from django.views.generic import TemplateView, ListView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
 from django.utils import timezone
-from django.db.models import Count, Sum
-from .models import Profile, Message, ChatRoom, ProgressLog
+from .models import Profile, Message, ChatRoom, ProgressLog, ProgressRollup, ProgressTotal, RoomMembership
 from .forms import ProfileForm
+from .fragments import bucket_name, get_fragment, get_version
+from .inbox import build_inbox, partner_ids
+from .matching import get_match_entry, load_match_page
+from .pagination import InvalidCursor, paginate_messages
+from .presence import apply_presence, online_user_ids
 
 class HomeView(TemplateView):
     template_name = 'home.html'
@@ -99,26 +103,35 @@ def profile_view(request):
 
 @login_required
 def matches_view(request):
-    potential_matches = request.user.profile.get_potential_matches()
-    return render(request, 'matches.html', {'matches': potential_matches})
+    profile = request.user.profile
+    entry = get_match_entry(profile, page=request.GET.get('page'))
+    # The ranking comes from the cached entry; the cards change with any profile in the bucket
+    bucket = bucket_name(profile.learning_language, profile.native_language)
+    fragment = get_fragment('matches', request.user.id, entry['page'], entry['user_ids'], get_version('bucket', bucket))
+    context = {'matches_fragment': fragment}
+    if not fragment.cached:
+        match_page = load_match_page(entry)
+        context.update({'matches': match_page['matches'], 'match_page': match_page})
+    return render(request, 'matches.html', context)
 
 @login_required
 def chat_view(request, user_id):
-    other_user = get_object_or_404(User, id=user_id)
+    other_user = get_object_or_404(User.objects.select_related('profile'), id=user_id)
     
     # Ensure users can only chat with their matches
-    if not request.user.profile.get_potential_matches().filter(user=other_user).exists():
+    if not request.user.profile.is_potential_match(other_user.profile):
         messages.error(request, 'You can only chat with your language exchange partners.')
         return redirect('main:matches')
+    apply_presence([other_user.profile])
     
     # Get or create chat room for these users
     room = ChatRoom.get_or_create_for_users(request.user, other_user)
     
-    # Get messages for this room
-    chat_messages = room.messages.select_related('sender').order_by('timestamp')
+    # Get the newest page of messages for this room
+    chat_messages = paginate_messages(room.messages.select_related('sender'))['messages']
     
-    # Mark messages as read
-    room.messages.filter(sender=other_user, is_read=False).update(is_read=True)
+    # Move the read watermark; a single-row update, skipped when nothing is unread
+    RoomMembership.mark_read(room.id, request.user.id)
     
     if request.method == 'POST':
         content = request.POST.get('content', '').strip()
@@ -144,7 +157,8 @@ def chat_view(request, user_id):
         'messages': chat_messages,
         'room': room,
         'room_id': room.id,  # Make sure to pass room_id to the template
-        'room_name': room.name  # Also pass room_name for WebSocket connection
+        'room_name': room.name,  # Also pass room_name for WebSocket connection
+        'peer_last_read_id': RoomMembership.peer_read_watermark(room.id, request.user.id),
     }
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -159,46 +173,20 @@ def chat_view(request, user_id):
     
 @login_required
 def inbox_view(request):
-    # Get all chat rooms where the current user is a participant
-    chat_rooms = ChatRoom.objects.filter(participants=request.user)
-    
-    # Get the latest message for each chat room
-    latest_messages = {}
-    for room in chat_rooms:
-        latest_message = Message.objects.filter(room=room).order_by('-timestamp').first()
-        if latest_message:
-            latest_messages[room.id] = {
-                'content': latest_message.content,
-                'timestamp': latest_message.timestamp,
-                'sender': latest_message.sender,
-                'is_read': latest_message.is_read
-            }
-    
-    # Get unread message counts for each room
-    unread_counts = {}
-    for room in chat_rooms:
-        unread_count = Message.objects.filter(
-            room=room, 
-            is_read=False
-        ).exclude(sender=request.user).count()
-        unread_counts[room.id] = unread_count
-    
-    # Prepare conversations data with the other user's information
-    conversations = []
-    for room in chat_rooms:
-        # Get the other user in the chat (not the current user)
-        other_user = room.participants.exclude(id=request.user.id).first()
-        if other_user:  # Only include if we found another user
-            conversations.append({
-                'user': other_user,
-                'room': room,
-                'last_message': latest_messages.get(room.id, {})
-            })
-    
-    context = {
-        'conversations': conversations,
-        'unread_counts': unread_counts,
-    }
+    before = request.GET.get('before')
+    # Online dots are part of the fragment, so it varies on who of the partners is online
+    online = sorted(online_user_ids(partner_ids(request.user)))
+    fragment = get_fragment('inbox', request.user.id, before, online)
+    context = {'inbox_fragment': fragment}
+    if not fragment.cached:
+        try:
+            inbox = build_inbox(request.user, before=before)
+        except InvalidCursor:
+            return redirect('main:inbox')
+        context.update({
+            'conversations': inbox['conversations'],
+            'next_cursor': inbox['next_cursor'],
+        })
     return render(request, 'inbox.html', context)
 
 
@@ -208,50 +196,38 @@ class ProgressDashboardView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
-        
-        # Get weekly summary
         today = timezone.now().date()
-        week_ago = today - timezone.timedelta(days=7)
         
-        # Get logs from the past week
-        weekly_logs = ProgressLog.objects.filter(
-            user=user,
-            date__range=[week_ago, today]
-        )
+        # The week shown moves with the date
+        fragment = get_fragment('dashboard', user.id, today)
+        context['dashboard_fragment'] = fragment
+        if fragment.cached:
+            return context
         
-        # Calculate weekly stats
-        total_minutes = weekly_logs.aggregate(total=Sum('minutes_studied'))['total'] or 0
-        total_words = weekly_logs.aggregate(total=Sum('words_learned'))['total'] or 0
-        
-        # Activity distribution
-        activity_distribution = weekly_logs.values('activity_type').annotate(
-            count=Count('id'),
-            total_minutes=Sum('minutes_studied')
-        )
+        # Everything below comes from the pre-aggregated rollups for the week
+        week_ago = today - timezone.timedelta(days=7)
+        summary = ProgressRollup.summarize(user, week_ago, today)
+        total_minutes = summary['total_minutes']
+        total_words = summary['total_words']
         
         # Calculate percentages for activity distribution
-        total_activities = sum(item['count'] for item in activity_distribution) if activity_distribution else 1
+        activity_distribution = summary['activity_distribution']
+        total_activities = sum(item['count'] for item in activity_distribution)
         for activity in activity_distribution:
             activity['percentage'] = (activity['count'] / total_activities * 100) if total_activities > 0 else 0
         
         # Get recent activities
         recent_activities = ProgressLog.objects.filter(user=user).order_by('-date')[:5]
         
-        # Language distribution
-        language_distribution = weekly_logs.values('language').annotate(
-            total_minutes=Sum('minutes_studied')
-        ).order_by('-total_minutes')
-        
         # Calculate percentages for language distribution
-        total_lang_minutes = sum(item['total_minutes'] for item in language_distribution) if language_distribution else 1
+        language_distribution = summary['language_distribution']
+        total_lang_minutes = sum(item['total_minutes'] for item in language_distribution)
         for lang in language_distribution:
             lang['percentage'] = (lang['total_minutes'] / total_lang_minutes * 100) if total_lang_minutes > 0 else 0
             lang['color'] = self.get_language_color(lang['language'])
         
-        # Calculate total hours studied
-        total_hours = ProgressLog.objects.filter(user=user).aggregate(
-            total=Sum('minutes_studied')
-        )['total'] or 0
+        # Lifetime totals
+        totals = ProgressTotal.for_user(user)
         
         # Add data to context
         context.update({
@@ -266,10 +242,8 @@ class ProgressDashboardView(LoginRequiredMixin, TemplateView):
             },
             'recent_activities': recent_activities,
             'language_distribution': language_distribution,
-            'total_hours_studied': round(total_hours / 60, 1) if total_hours else 0,
-            'total_words_learned': ProgressLog.objects.filter(user=user).aggregate(
-                total=Sum('words_learned')
-            )['total'] or 0,
+            'total_hours_studied': round(totals.minutes_studied / 60, 1),
+            'total_words_learned': totals.words_learned,
         })
         
         return context
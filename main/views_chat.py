@@ -4,10 +4,14 @@ from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Q
+from django.db.models import OuterRef, Prefetch, Q, Subquery
 from django.contrib.auth.models import User
-from .models import ChatRoom, Message, Profile
+from .models import ChatRoom, Profile, RoomMembership
 from .forms import MessageForm
+from .idempotency import clean_client_id, submit_message
+from .pagination import InvalidCursor, paginate_messages
+from .presence import apply_presence
+from .search import DEFAULT_PAGE_SIZE as SEARCH_PAGE_SIZE, SearchNotSupported, search_messages
 
 @login_required
 def chat_room(request, room_name=None, user_id=None):
@@ -19,12 +23,7 @@ def chat_room(request, room_name=None, user_id=None):
         chat_room = get_object_or_404(ChatRoom, name=room_name, participants=user)
     elif user_id:
         other_user = get_object_or_404(User, id=user_id)
-        chat_room = ChatRoom.objects.filter(participants=user).filter(participants=other_user).first()
-        
-        if not chat_room:
-            # Create a new chat room
-            chat_room = ChatRoom.objects.create(name=f"chat_{user.id}_{other_user.id}")
-            chat_room.participants.add(user, other_user)
+        chat_room = ChatRoom.get_or_create_for_users(user, other_user)
     else:
         # Get the most recent chat or redirect to matches
         chat_room = ChatRoom.objects.filter(participants=user).order_by('-last_updated').first()
@@ -35,17 +34,30 @@ def chat_room(request, room_name=None, user_id=None):
         if not chat_room:
             return redirect('matches')  # Redirect to matches if no chat exists
     
-    # Get messages for the chat room
-    messages = chat_room.messages.all().order_by('timestamp')
+    # Get the newest page of messages for the chat room
+    messages = paginate_messages(chat_room.messages.select_related('sender'))['messages']
     
-    # Mark messages as read
-    chat_room.messages.filter(sender__in=chat_room.participants.exclude(id=user.id)).update(is_read=True)
+    # Move the read watermark; a single-row update, skipped when nothing is unread
+    RoomMembership.mark_read(chat_room.id, user.id)
+    peer_last_read_id = RoomMembership.peer_read_watermark(chat_room.id, user.id)
     
     # Get other participant (for 1:1 chat)
-    other_participant = chat_room.get_other_participant(user)
+    other_participant = chat_room.participants.select_related('profile').exclude(id=user.id).first()
     
-    # Get user's chat list
-    chat_rooms = ChatRoom.objects.filter(participants=user).order_by('-last_updated')
+    # Get user's chat list with the user's unread counter for each room
+    chat_rooms = list(ChatRoom.objects.filter(participants=user).annotate(
+        unread_count=Subquery(
+            RoomMembership.objects.filter(room=OuterRef('pk'), user=user).values('unread_count')[:1]
+        )
+    ).prefetch_related(
+        Prefetch('participants', queryset=User.objects.select_related('profile'))
+    ).order_by('-last_updated'))
+    
+    # Online dots come from live presence, looked up for all rooms at once
+    participants = [p for room in chat_rooms for p in room.participants.all() if p.id != user.id]
+    if other_participant is not None:
+        participants.append(other_participant)
+    apply_presence(p.profile for p in participants if hasattr(p, 'profile'))
     
     return render(request, 'chat/room.html', {
         'room_name': chat_room.name,
@@ -53,65 +65,125 @@ def chat_room(request, room_name=None, user_id=None):
         'other_participant': other_participant,
         'chat_messages': messages,
         'chat_rooms': chat_rooms,
+        'peer_last_read_id': peer_last_read_id,
         'form': MessageForm(),
     })
 
 @login_required
 @require_http_methods(["POST"])
 def send_message(request, room_name):
-    """API endpoint to send a message"""
+    """
+    API endpoint to send a message.
+
+    A retry with the ``client_id`` of an earlier submission returns the
+    message saved the first time instead of saving it again.
+    """
     chat_room = get_object_or_404(ChatRoom, name=room_name, participants=request.user)
     form = MessageForm(request.POST)
+    try:
+        client_id = clean_client_id(request.POST.get('client_id'))
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'errors': {'client_id': [str(e)]}}, status=400)
     
     if form.is_valid():
-        message = Message.objects.create(
-            room=chat_room,
-            sender=request.user,
-            content=form.cleaned_data['content']
-        )
+        message, created = submit_message(chat_room, request.user, form.cleaned_data['content'], client_id)
         
-        # Update last_updated timestamp
-        chat_room.save()
+        if created:
+            # Update last_updated timestamp
+            chat_room.save()
         
         return JsonResponse({
             'status': 'success',
             'message': {
                 'id': message.id,
                 'content': message.content,
-                'sender': message.sender.username,
+                'sender': request.user.username,
                 'timestamp': message.timestamp.isoformat(),
-                'is_read': message.is_read
-            }
+                'is_read': False,
+                'client_id': message.client_id
+            },
+            'duplicate': not created
         })
     
     return JsonResponse({'status': 'error', 'errors': form.errors}, status=400)
 
 @login_required
 def get_messages(request, room_name):
-    """API endpoint to get messages for a chat room"""
+    """API endpoint to get a page of messages for a chat room"""
     chat_room = get_object_or_404(ChatRoom, name=room_name, participants=request.user)
-    messages = chat_room.messages.all().order_by('timestamp')
     
-    # Mark messages as read
-    chat_room.messages.filter(sender__in=chat_room.participants.exclude(id=request.user.id)).update(is_read=True)
+    try:
+        page = paginate_messages(
+            chat_room.messages.select_related('sender'),
+            before=request.GET.get('before'),
+            after=request.GET.get('after'),
+            limit=request.GET.get('limit'),
+        )
+    except InvalidCursor as e:
+        return JsonResponse({'status': 'error', 'errors': str(e)}, status=400)
+    
+    RoomMembership.mark_read(chat_room.id, request.user.id)
+    peer_last_read_id = RoomMembership.peer_read_watermark(chat_room.id, request.user.id)
     
+    # Incoming messages were just read; own messages are read up to the peer's watermark
     data = [{
         'id': msg.id,
         'content': msg.content,
         'sender': msg.sender.username,
         'timestamp': msg.timestamp.isoformat(),
-        'is_read': msg.is_read,
-        'is_own': msg.sender == request.user
-    } for msg in messages]
+        'is_read': msg.sender_id != request.user.id or msg.id <= peer_last_read_id,
+        'is_own': msg.sender_id == request.user.id
+    } for msg in page['messages']]
     
-    return JsonResponse({'messages': data})
+    return JsonResponse({
+        'messages': data,
+        'peer_last_read_id': peer_last_read_id,
+        'has_older': page['has_older'],
+        'has_newer': page['has_newer'],
+        'before': page['before'],
+        'after': page['after'],
+    })
 
 @login_required
 def get_unread_count(request):
     """API endpoint to get unread message count"""
-    count = Message.objects.filter(
-        room__participants=request.user,
-        is_read=False
-    ).exclude(sender=request.user).count()
+    count = RoomMembership.total_unread(request.user)
     
-    return JsonResponse({'unread_count': count})
\ No newline at end of file
+    return JsonResponse({'unread_count': count})
+
+@login_required
+def search_chat_messages(request):
+    """API endpoint to search the messages of the user's rooms, optionally of one room"""
+    room = None
+    if request.GET.get('room'):
+        room = get_object_or_404(ChatRoom, name=request.GET['room'], participants=request.user)
+    
+    try:
+        page = search_messages(
+            request.user,
+            request.GET.get('q', ''),
+            page=request.GET.get('page', 1),
+            limit=request.GET.get('limit', SEARCH_PAGE_SIZE),
+            room=room,
+        )
+    except ValueError:
+        return JsonResponse({'status': 'error', 'errors': 'page and limit must be integers'}, status=400)
+    except SearchNotSupported as e:
+        return JsonResponse({'status': 'error', 'errors': str(e)}, status=501)
+    
+    data = [{
+        'id': result['message'].id,
+        'room': result['message'].room.name,
+        'sender': result['message'].sender.username,
+        'timestamp': result['message'].timestamp.isoformat(),
+        'content': result['message'].content,
+        'snippet': result['snippet'],
+        'rank': result['rank'],
+        'is_own': result['message'].sender_id == request.user.id
+    } for result in page['results']]
+    
+    return JsonResponse({
+        'results': data,
+        'page': page['page'],
+        'has_next': page['has_next'],
+    })
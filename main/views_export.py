@@ -0,0 +1,172 @@
+"""
+Streaming exports of chat history and learning progress.
+
+Rows are read with ``QuerySet.iterator(chunk_size=...)``, which uses a
+server-side cursor on PostgreSQL and batched ``fetchmany`` on SQLite. They
+are encoded as CSV or NDJSON and sent with a ``StreamingHttpResponse``.
+Memory use therefore stays at one chunk of rows plus one output buffer,
+however large the export is. Add ``?gzip=1`` to receive a gzip-compressed
+file instead.
+
+Under ASGI Django would read a synchronous iterator into a list before
+sending it. So there the body is wrapped in an async iterator that pulls
+one buffer at a time from the database thread.
+"""
+import csv
+import json
+import zlib
+from datetime import date, datetime
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+
+from .models import ChatRoom, Message, PracticeSession, ProgressLog
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+MESSAGE_FIELDS = {
+    'id': 'id',
+    'room_name': F('room__name'),
+    'sender_username': F('sender__username'),
+    'timestamp': 'timestamp',
+    'content': 'content',
+}
+PROGRESS_LOG_FIELDS = {
+    name: name for name in [
+        'id', 'date', 'activity_type', 'language', 'minutes_studied',
+        'words_learned', 'proficiency_level', 'notes',
+    ]
+}
+PRACTICE_SESSION_FIELDS = {
+    name: name for name in ['id', 'created_at', 'language', 'session_type', 'duration_minutes', 'notes']
+}
+
+
+class _Echo:
+    """File-like object for csv.writer that returns each line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def encode_csv(rows, columns):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_csv_value(row[column]) for column in columns])
+
+
+def encode_ndjson(rows, columns):
+    for row in rows:
+        record = {column: row[column] for column in columns}
+        yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+ENCODERS = {
+    'csv': encode_csv,
+    'ndjson': encode_ndjson,
+}
+
+
+def buffered(pieces, size=BUFFER_SIZE):
+    """Join small encoded pieces into chunks of about ``size`` bytes"""
+    buffer = []
+    length = 0
+    for piece in pieces:
+        data = piece.encode()
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def iterate_in_thread(iterator):
+    """Yield from a sync iterator without blocking the event loop"""
+    done = object()
+    # thread_sensitive: the database cursor stays on the thread that opened it
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await next_chunk(iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+def export_response(request, queryset, fields, fmt, filename):
+    """Stream ``queryset`` as a file download in ``fmt``"""
+    if fmt not in EXPORT_FORMATS:
+        raise Http404(f"Unknown export format {fmt!r}")
+    columns = list(fields)
+    named = {name: field for name, field in fields.items() if name == field}
+    expressions = {name: field for name, field in fields.items() if name != field}
+    rows = queryset.values(*named, **expressions).iterator(chunk_size=CHUNK_SIZE)
+
+    body = buffered(ENCODERS[fmt](rows, columns))
+    filename = f'{filename}.{fmt}'
+    content_type = EXPORT_FORMATS[fmt]
+    if request.GET.get('gzip') in ('1', 'true'):
+        body = gzipped(body)
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    if isinstance(request, ASGIRequest):
+        body = iterate_in_thread(body)
+    response = StreamingHttpResponse(body, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+def export_room_messages(request, room_name, fmt):
+    """All messages of one of the user's rooms, oldest first"""
+    chat_room = get_object_or_404(ChatRoom, name=room_name, participants=request.user)
+    queryset = Message.objects.filter(room=chat_room).order_by('timestamp', 'id')
+    return export_response(request, queryset, MESSAGE_FIELDS, fmt, f'{chat_room.name}-messages')
+
+
+@login_required
+def export_message_archive(request, fmt):
+    """Every message of every room the user takes part in, grouped by room"""
+    queryset = Message.objects.filter(room__memberships__user=request.user).order_by('room', 'timestamp', 'id')
+    return export_response(request, queryset, MESSAGE_FIELDS, fmt, f'{request.user.username}-messages')
+
+
+@login_required
+def export_progress_logs(request, fmt):
+    queryset = ProgressLog.objects.filter(user=request.user).order_by('date', 'id')
+    return export_response(request, queryset, PROGRESS_LOG_FIELDS, fmt, f'{request.user.username}-progress')
+
+
+@login_required
+def export_practice_sessions(request, fmt):
+    queryset = PracticeSession.objects.filter(user=request.user).order_by('created_at', 'id')
+    return export_response(request, queryset, PRACTICE_SESSION_FIELDS, fmt, f'{request.user.username}-practice')
@@ -0,0 +1,37 @@
+"""
+``/metrics``: request instrumentation in the Prometheus text format.
+
+Staff users can read it when logged in. Scrapers send
+``Authorization: Bearer <INSTRUMENTATION['METRICS_TOKEN']>``. A staff POST
+with ``enabled=1``/``enabled=0`` switches recording on or off at runtime;
+``reset=1`` clears the counters.
+"""
+import hmac
+
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_http_methods
+
+from .instrumentation import get_config, registry, render_prometheus, reset_metrics, set_enabled
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def has_metrics_token(request):
+    token = get_config()['METRICS_TOKEN']
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header, f'Bearer {token}')
+
+
+@require_http_methods(['GET', 'POST'])
+def metrics(request):
+    is_staff = request.user.is_authenticated and request.user.is_staff
+    if request.method == 'POST':
+        if not is_staff:
+            return HttpResponseForbidden()
+        if 'enabled' in request.POST:
+            set_enabled(request.POST['enabled'] in ('1', 'true'))
+        if request.POST.get('reset') in ('1', 'true'):
+            reset_metrics()
+    elif not (is_staff or has_metrics_token(request)):
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(registry.endpoints_copy()), content_type=CONTENT_TYPE)
@@ -3,7 +3,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
-from .models import Profile, ProgressLog
+from .models import Profile, ProgressLog, ProgressRollup, ProgressTotal
 from .forms import UserUpdateForm, ProfileForm, ProgressLogForm
 
 @login_required
@@ -57,15 +57,14 @@ def progress_dashboard(request):
     """View progress dashboard"""
     progress_logs = ProgressLog.objects.filter(user=request.user).order_by('-date')
     
-    # Calculate totals
-    total_minutes = sum(log.minutes_studied for log in progress_logs)
-    total_words = sum(log.words_learned for log in progress_logs)
+    # Lifetime totals
+    totals = ProgressTotal.for_user(request.user)
     
-    # Get weekly progress (last 7 days)
+    # Get weekly progress (last 7 days) from the daily rollups
     from datetime import datetime, timedelta
     today = datetime.now().date()
     week_ago = today - timedelta(days=7)
-    weekly_logs = progress_logs.filter(date__gte=week_ago)
+    days = ProgressRollup.summarize(request.user, week_ago, today)['days']
     
     # Prepare data for charts
     chart_data = {
@@ -76,15 +75,15 @@ def progress_dashboard(request):
     
     for i in range(7):
         date = today - timedelta(days=6-i)
-        daily_logs = [log for log in weekly_logs if log.date == date]
+        daily = days.get(date, {'minutes': 0, 'words': 0})
         chart_data['labels'].append(date.strftime('%a'))
-        chart_data['minutes'].append(sum(log.minutes_studied for log in daily_logs))
-        chart_data['words'].append(sum(log.words_learned for log in daily_logs))
+        chart_data['minutes'].append(daily['minutes'])
+        chart_data['words'].append(daily['words'])
     
     return render(request, 'progress/dashboard.html', {
         'progress_logs': progress_logs[:10],  # Show recent 10 logs
-        'total_minutes': total_minutes,
-        'total_words': total_words,
+        'total_minutes': totals.minutes_studied,
+        'total_words': totals.words_learned,
         'chart_data': chart_data,
     })
 